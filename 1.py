@@ -1,7 +1,8 @@
 import sqlite3
 import os
 import requests
-import json
+
+from gemini_client import GeminiClient, list_models
 
 DB_NAME = "account_book.db"
 
@@ -29,40 +30,28 @@ def check_available_models():
     finally:
         conn.close()
 
-    # 2. 查詢模型列表
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={key}"
-
+    # 2. 查詢模型列表 (與 ds_manager 備援用的是同一份清單)
     try:
-        response = requests.get(url, timeout=10)
-
-        if response.status_code == 200:
-            data = response.json()
-            print("✅ Google 回傳了以下可用模型：")
-            print("=" * 40)
-
-            # 過濾出 generateContent 支援的模型
-            valid_models = []
-            for m in data.get('models', []):
-                if 'generateContent' in m['supportedGenerationMethods']:
-                    print(f"🔹 {m['name']}")
-                    valid_models.append(m['name'])
-
-            print("=" * 40)
-
-            # 自動推薦
-            print("\n💡 建議修改：")
-            if 'models/gemini-1.5-flash-001' in valid_models:
-                print("請將程式碼中的 'gemini-1.5-flash' 改為 'gemini-1.5-flash-001'")
-            elif 'models/gemini-pro' in valid_models:
-                print("請將程式碼中的 'gemini-1.5-flash' 改為 'gemini-pro'")
-            else:
-                print("請從上面清單挑一個名字，填入 ds_manager.py 的第 30 行。")
-
-        else:
-            print(f"❌ 查詢失敗: {response.text}")
-
+        valid_models = list_models(key)
+    except requests.HTTPError as e:
+        print(f"❌ 查詢失敗: {e.response.text}")
+        return
     except Exception as e:
         print(f"❌ 連線錯誤: {e}")
+        return
+
+    print("✅ Google 回傳了以下可用模型：")
+    print("=" * 40)
+    for name in valid_models:
+        print(f"🔹 {name}")
+    print("=" * 40)
+
+    # 更新快取並顯示 ds_manager 實際的備援順序
+    client = GeminiClient(key)
+    client.set_models(valid_models)
+    print("\n💡 ds_manager 會依下列順序嘗試 (遇到 429 自動換下一個)：")
+    for i, name in enumerate(client.candidate_models(), start=1):
+        print(f"{i}. {name}")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,25 @@
-import requests
 import urllib3
 import os
 import time
 import sys
-import io
 import json
+import hmac
 import sqlite3
+import asyncio
 import logging
 import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+from job_runner import JobRunner
+from command_router import CommandRouter
+from bot_state import BotStateStore
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
 
 # ================= 📝 LOGGING 系統設定 =================
 logging.basicConfig(
@@ -20,23 +31,34 @@ logger = logging.getLogger(__name__)
 
 # ================= 🔤 環境初始化 =================
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+ensure_utf8_stdout()
 
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+BT_ROOT = '/volume1/淳/BT/'
+# webhook 模式只聽本機 (前面由反向代理提供 HTTPS)，可用設定 tele_webhook_host 覆寫
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_PORT = 8088
+# webhook 模式沒有批次邊界，改為每隔幾秒存一次對話狀態
+STATE_FLUSH_SECONDS = 5
+# 港口風力觀測約 10 分鐘更新一次，短時間內重複查詢直接回覆上次結果
+PORT_WIND_CACHE_SECONDS = 60
+
+# ================= 🧰 工作腳本 (僅在啟動時載入一次) =================
+# 按鈕不再各自啟動 python3 子行程，改由常駐工作池直接呼叫函式
+import check_bt
+import clean_bt_nas
+import move_files
+import marine_monitor
+import disaster_monitor
+import stock_monitor_nas
+import ds_history
+
+job_runner = JobRunner(max_workers=2, max_queue=8)
 
 
 def get_config(key):
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM config WHERE key = ?", (key,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
-    except Exception as e:
-        logger.error(f"資料庫查詢失敗 (鍵名: {key}): {e}")
-        return None
+    return config_store.get_config(key, DB_PATH)
 
 
 def check_system_lock(lock_name):
@@ -73,205 +95,501 @@ TOKEN = get_config('tele_token')
 
 
 def send_with_keyboard(chat_id, text, custom_keyboard=None):
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
     default_keyboard = {
         "keyboard": [["查股價", "掃描BT"], ["整理檔案", "清理空間"], ["庫存管理", "氣象查詢"],
-                     ["全部執行", "回主選單"]],
+                     ["下載統計", "全部執行", "回主選單"]],
         "resize_keyboard": True
     }
     keyboard = custom_keyboard if custom_keyboard else default_keyboard
-    data = {'chat_id': chat_id, 'text': text, 'reply_markup': json.dumps(keyboard), 'parse_mode': 'HTML'}
-    requests.post(url, data=data, verify=False, timeout=10)
+    telegram_client.send_message(TOKEN, chat_id, text, reply_markup=keyboard)
+
+
+def run_fix_filenames_then_move():
+    """整理檔案：先修正檔名 (外部腳本，若存在) 再搬移檔案"""
+    fix_path = os.path.join(BASE_PATH, 'fix_filenames.py')
+    if os.path.exists(fix_path):
+        subprocess.run([sys.executable, fix_path], timeout=600)
+    return move_files.move_files()
+
+
+def submit_job(chat_id, name, func, args=(), timeout=600, paths=(), cache_ttl=0, forward=True):
+    """將工作丟進工作池；佇列已滿或失敗時通知使用者
+
+    相同工作已在排隊/執行中時直接合併 (只跑一次)；有 cache_ttl 的工作短時間內直接回覆上次結果。
+    只有新排入的工作回傳 job，呼叫端據此決定是否送出「正在執行」提示。
+    forward=False：結果含私人資料 (例如持股)，只推播到設定的聊天室，不轉送給其他發問者。
+    """
+    is_owner = chat_id == str(get_config('tele_chat_id'))
+
+    def on_done(job):
+        if job.status == 'timeout':
+            send_with_keyboard(chat_id, f"⏱️ <b>{name}</b> 執行逾時 ({timeout} 秒)，已放棄等待。")
+        elif job.status == 'failed':
+            send_with_keyboard(chat_id, f"❌ <b>{name}</b> 執行失敗：{job.error}")
+        elif forward and isinstance(job.result, str) and not is_owner:
+            # 腳本只推播到設定的聊天室，其他發問者另外轉送同一份結果
+            send_with_keyboard(chat_id, job.result)
+
+    job, how = job_runner.submit_or_attach(name, func, args=args, timeout=timeout, paths=paths,
+                                           on_done=on_done, cache_ttl=cache_ttl)
+    if job is None:
+        send_with_keyboard(chat_id, "⚠️ <b>目前排隊工作過多</b>\n請稍後再試。")
+        return None
+    if how == 'cached':
+        if (forward or is_owner) and isinstance(job.result, str):
+            send_with_keyboard(chat_id, job.result)
+        return None
+    if how == 'attached':
+        if forward or is_owner:
+            send_with_keyboard(chat_id, f"⏳ <b>{name}</b> 已在執行中，完成後一併回報。")
+        else:
+            send_with_keyboard(chat_id, f"⏳ <b>{name}</b> 已在執行中，請稍候。")
+        return None
+    return job
 
 
-def handle_updates():
-    offset = None
-    user_state = {}
-    CORE_COMMANDS = ["查股價", "掃描BT", "整理檔案", "清理空間", "全部執行", "氣象查詢", "查詢氣象", "港口風力"]
+# ================= 🧭 指令路由表 =================
+# 與舊版 if/elif 相同：選單按鈕可以打斷庫存輸入；NAS 工作類指令 (over_state=False)
+# 在等待輸入時交給對話狀態處理
+router = CommandRouter()
 
-    logger.info("機器人監聽服務已啟動")
+MANAGE_KB = {"keyboard": [["新增庫存", "刪除庫存"], ["查看庫存", "回主選單"]], "resize_keyboard": True}
+WEATHER_KB = {
+    "keyboard": [
+        [{"text": "📍 發送當前位置", "request_location": True}],
+        ["查詢氣象", "港口風力"],
+        ["回主選單"]
+    ],
+    "resize_keyboard": True
+}
 
-    while True:
-        try:
-            url = f"https://api.telegram.org/bot{TOKEN}/getUpdates"
-            params = {'timeout': 30, 'offset': offset}
-            response = requests.get(url, params=params, verify=False, timeout=35).json()
 
-            if not response.get("result"): continue
+@router.command("/start")
+def cmd_start(chat_id, text, user_state):
+    send_with_keyboard(chat_id, "👋 歡迎！\n請點擊「氣象查詢」來傳送位置或查詢預報。")
 
-            for update in response["result"]:
-                offset = update["update_id"] + 1
-                if "message" not in update: continue
-                msg = update["message"]
-                chat_id = str(msg["chat"]["id"])
-
-                # --- 🟢 核心修正：動態抓取傳入的位置並製作 JSON 存檔 ---
-                if "location" in msg:
-                    location_data = {
-                        "location": {
-                            "latitude": msg["location"]["latitude"],
-                            "longitude": msg["location"]["longitude"]
-                        },
-                        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    }
-                    json_file_path = os.path.join(BASE_PATH, 'current_location.json')
-                    with open(json_file_path, 'w', encoding='utf-8') as f:
-                        json.dump(location_data, f, ensure_ascii=False, indent=4)
-
-                    logger.info(f"✅ 已抓取即時位置並存檔：{json_file_path}")
-                    send_with_keyboard(chat_id,
-                                       "📍 <b>位置存檔已更新</b>\n座標已成功存入系統，現在點選「查詢氣象」即可獲得當地預報。")
-                    continue
-
-                if "text" not in msg: continue
-                msg_text = msg.get("text", "").strip()
-
-                if msg_text == "/start":
-                    send_with_keyboard(chat_id, "👋 歡迎！\n請點擊「氣象查詢」來傳送位置或查詢預報。")
-                    continue
-
-                if msg_text == "氣象查詢":
-                    weather_kb = {
-                        "keyboard": [
-                            [{"text": "📍 發送當前位置", "request_location": True}],
-                            ["查詢氣象", "港口風力"],
-                            ["回主選單"]
-                        ],
-                        "resize_keyboard": True
-                    }
-                    send_with_keyboard(chat_id, "🌤️ <b>氣象查詢選單</b>\n請點擊按鈕更新座標，或直接點選預報項目：",
-                                       weather_kb)
-                    continue
-
-                elif "查詢氣象" in msg_text:
-                    os.system(f"python3 {os.path.join(BASE_PATH, 'disaster_monitor.py')} &")
-                    send_with_keyboard(chat_id, "🌤️ 正在根據存檔位置獲取預報...")
-                    continue
-
-                # --- 4. 核心功能按鈕處理 ---
-                if msg_text == "查股價":
-                    script_path = os.path.join(BASE_PATH, 'stock_monitor_nas.py')
-                    subprocess.Popen([sys.executable, script_path, "manual"])
-                    send_with_keyboard(chat_id, "📈 收到指令：正在抓取最新行情回報...")
-                    continue
-
-                if msg_text == "庫存管理":
-                    is_locked, locker_id, _ = check_system_lock('accounting')
-                    if is_locked == 1 and str(locker_id) != chat_id:
-                        send_with_keyboard(chat_id, "⚠️ <b>有人正在管理中請稍等</b>\n請待前一位使用者完成後再試。")
-                        continue
-
-                    set_system_lock('accounting', chat_id, 1)
-                    manage_kb = {"keyboard": [["新增庫存", "刪除庫存"], ["查看庫存", "回主選單"]],
-                                 "resize_keyboard": True}
-                    send_with_keyboard(chat_id, "📊 <b>庫存與成本管理</b>\n請選擇操作：", manage_kb)
-                    continue
-
-                if msg_text == "查看庫存":
-                    try:
-                        conn = sqlite3.connect(DB_PATH)
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT stock_code, shares, cost_price FROM stock_assets WHERE user_id = ?",
-                                       (chat_id,))
-                        rows = cursor.fetchall()
-                        conn.close()
-                        if not rows:
-                            send_with_keyboard(chat_id, "📋 目前尚無庫存資料。")
-                        else:
-                            report = "📋 <b>您的持股庫存清單：</b>\n━━━━━━━━━━━━━━"
-                            for code, shares, cost in rows:
-                                report += f"\n代號：<code>{code}</code>\n持股：{shares} | 成本：{cost}\n"
-                            send_with_keyboard(chat_id, report)
-                    except Exception as e:
-                        logger.error(f"查看庫存失敗: {e}")
-                        send_with_keyboard(chat_id, "❌ 讀取資料庫失敗。")
-                    continue
-
-                if msg_text == "新增庫存":
-                    send_with_keyboard(chat_id,
-                                       "📝 請輸入：<code>代號 股數 成本</code>\n例如：<code>2330 1000 650.5</code>",
-                                       {"keyboard": [["回主選單"]]})
-                    user_state[chat_id] = "WAIT_STOCK_ADD"
-                    continue
-
-                if msg_text == "刪除庫存":
-                    send_with_keyboard(chat_id, "🗑️ 請輸入要刪除的<b>股票代號</b>：", {"keyboard": [["回主選單"]]})
-                    user_state[chat_id] = "WAIT_STOCK_DEL"
-                    continue
-
-                # --- 5. 處理狀態 (State) 輸入邏輯 ---
-                if chat_id in user_state:
-                    state = user_state[chat_id]
-
-                    if state == "WAIT_STOCK_ADD":
-                        try:
-                            parts = msg_text.split()
-                            if len(parts) != 3: raise ValueError
-                            code, shares, cost = parts
-                            conn = sqlite3.connect(DB_PATH)
-                            conn.execute(
-                                "INSERT OR REPLACE INTO stock_assets (user_id, stock_code, shares, cost_price) VALUES (?, ?, ?, ?)",
-                                (chat_id, code, int(shares), float(cost)))
-                            conn.commit()
-                            conn.close()
-                            send_with_keyboard(chat_id, f"✅ 已紀錄 <b>{code}</b>\n股數：{shares}\n成本：{cost}")
-                            user_state.pop(chat_id)
-                        except:
-                            send_with_keyboard(chat_id, "❌ 格式錯誤，請重新輸入：\n<code>代號 股數 成本</code>")
-
-                    elif state == "WAIT_STOCK_DEL":
-                        try:
-                            conn = sqlite3.connect(DB_PATH)
-                            cursor = conn.cursor()
-                            cursor.execute("DELETE FROM stock_assets WHERE user_id = ? AND stock_code = ?",
-                                           (chat_id, msg_text))
-                            if cursor.rowcount > 0:
-                                conn.commit()
-                                send_with_keyboard(chat_id, f"✅ 已成功刪除 <b>{msg_text}</b>")
-                                user_state.pop(chat_id)
-                            else:
-                                send_with_keyboard(chat_id, f"❓ 找不到代號 <b>{msg_text}</b> 的資料。")
-                            conn.close()
-                        except Exception as e:
-                            logger.error(f"刪除失敗: {e}")
-                            send_with_keyboard(chat_id, "❌ 執行刪除時發生錯誤。")
-                    continue
-
-                # --- 6. 其他 NAS 功能指令 ---
-                if "掃描BT" in msg_text:
-                    os.system(f"python3 {os.path.join(BASE_PATH, 'check_bt.py')} &")
-                    send_with_keyboard(chat_id, "🔍 正在掃描大檔案...")
-                elif "整理檔案" in msg_text:
-                    fix_path = os.path.join(BASE_PATH, 'fix_filenames.py')
-                    move_path = os.path.join(BASE_PATH, 'move_files.py')
-                    cmd = f"python3 {fix_path} ; python3 {move_path} &"
-                    os.system(cmd)
-                    send_with_keyboard(chat_id, "🚚 正在依序執行：修正檔名 ➔ 搬移檔案...")
-                elif "清理空間" in msg_text:
-                    os.system(f"python3 {os.path.join(BASE_PATH, 'clean_bt_nas.py')} &")
-                    send_with_keyboard(chat_id, "🧹 正在執行清理...")
-                elif msg_text.startswith("https://cn.javd.me/movie/"):
-                    send_with_keyboard(chat_id, "🔍 偵測到 JAVD 連結，正在解析並加入下載任務...")
-                    script_path = os.path.join(BASE_PATH, 'ds_download_manager.py')
-                    try:
-                        result = subprocess.check_output([sys.executable, script_path, msg_text], encoding='utf-8')
-                        send_with_keyboard(chat_id, result.strip())
-                    except Exception as e:
-                        send_with_keyboard(chat_id, f"❌ 下載任務調度失敗：{e}")
-                elif "查詢氣象" in msg_text:
-                    os.system(f"python3 {os.path.join(BASE_PATH, 'disaster_monitor.py')} &")
-                    send_with_keyboard(chat_id, "🌤️ 正在獲取最新氣象預報...")
-                elif "港口風力" in msg_text:
-                    os.system(f"python3 {os.path.join(BASE_PATH, 'marine_monitor.py')} &")
-                    send_with_keyboard(chat_id, "⚓ 正在連線氣象署讀取台中港區風力...")
 
+@router.command("氣象查詢")
+def cmd_weather_menu(chat_id, text, user_state):
+    send_with_keyboard(chat_id, "🌤️ <b>氣象查詢選單</b>\n請點擊按鈕更新座標，或直接點選預報項目：",
+                       WEATHER_KB)
+
+
+@router.command("查詢氣象")
+def cmd_weather_forecast(chat_id, text, user_state):
+    if submit_job(chat_id, "查詢氣象", disaster_monitor.monitor_weather_forecast, timeout=120):
+        send_with_keyboard(chat_id, "🌤️ 正在根據存檔位置獲取預報...")
+
+
+@router.command("港口風力", over_state=False)
+def cmd_port_wind(chat_id, text, user_state):
+    if submit_job(chat_id, "港口風力", marine_monitor.monitor_port_wind, timeout=120,
+                  cache_ttl=PORT_WIND_CACHE_SECONDS):
+        send_with_keyboard(chat_id, "⚓ 正在連線氣象署讀取台中港區風力...")
+
+
+# --- 核心功能按鈕 ---
+@router.command("查股價")
+def cmd_stock_report(chat_id, text, user_state):
+    if submit_job(chat_id, "查股價", stock_monitor_nas.fetch_stock_report, args=(True,), timeout=120,
+                  forward=False):
+        send_with_keyboard(chat_id, "📈 收到指令：正在抓取最新行情回報...")
+
+
+@router.command("掃描BT", over_state=False)
+def cmd_scan_bt(chat_id, text, user_state):
+    if submit_job(chat_id, "掃描BT", check_bt.scan_bt_daily, paths=(BT_ROOT,)):
+        send_with_keyboard(chat_id, "🔍 正在掃描大檔案...")
+
+
+@router.command("整理檔案", over_state=False)
+def cmd_move_files(chat_id, text, user_state):
+    if submit_job(chat_id, "整理檔案", run_fix_filenames_then_move, timeout=1800, paths=(BT_ROOT,)):
+        send_with_keyboard(chat_id, "🚚 正在依序執行：修正檔名 ➔ 搬移檔案...")
+
+
+@router.command("清理空間", over_state=False)
+def cmd_clean_bt(chat_id, text, user_state):
+    if submit_job(chat_id, "清理空間", clean_bt_nas.main, timeout=1800, paths=(BT_ROOT,)):
+        send_with_keyboard(chat_id, "🧹 正在執行清理...")
+
+
+@router.command("全部執行")
+def cmd_run_all(chat_id, text, user_state):
+    # 同一個 BT 資料夾的工作會依序執行，不會同時搬移與刪除
+    submit_job(chat_id, "查股價", stock_monitor_nas.fetch_stock_report, args=(True,), timeout=120,
+               forward=False)
+    submit_job(chat_id, "掃描BT", check_bt.scan_bt_daily, paths=(BT_ROOT,))
+    submit_job(chat_id, "整理檔案", run_fix_filenames_then_move, timeout=1800, paths=(BT_ROOT,))
+    submit_job(chat_id, "清理空間", clean_bt_nas.main, timeout=1800, paths=(BT_ROOT,))
+    send_with_keyboard(chat_id, "🚀 已排入全部工作：查股價 ➔ 掃描BT ➔ 整理檔案 ➔ 清理空間")
+
+
+@router.command("下載統計", over_state=False)
+def cmd_download_stats(chat_id, text, user_state):
+    # 只讀 ds_manager 留下的歷史紀錄，不連線 NAS
+    try:
+        send_with_keyboard(chat_id, ds_history.download_report())
+    except Exception as e:
+        logger.error(f"下載統計失敗: {e}")
+        send_with_keyboard(chat_id, "❌ 讀取下載紀錄失敗。")
+
+
+# 舊的輸入方式：訊息中包含按鈕文字也能觸發 (只在完全相符與狀態都不符合時才比對)
+for _word, _handler in (("掃描BT", cmd_scan_bt), ("整理檔案", cmd_move_files), ("清理空間", cmd_clean_bt),
+                        ("查詢氣象", cmd_weather_forecast), ("港口風力", cmd_port_wind)):
+    router.keyword(_word, _handler)
+
+
+# --- 庫存管理 ---
+@router.command("庫存管理")
+def cmd_manage_stock(chat_id, text, user_state):
+    is_locked, locker_id, _ = check_system_lock('accounting')
+    if is_locked == 1 and str(locker_id) != chat_id:
+        send_with_keyboard(chat_id, "⚠️ <b>有人正在管理中請稍等</b>\n請待前一位使用者完成後再試。")
+        return
+
+    set_system_lock('accounting', chat_id, 1)
+    send_with_keyboard(chat_id, "📊 <b>庫存與成本管理</b>\n請選擇操作：", MANAGE_KB)
+
+
+@router.command("查看庫存")
+def cmd_list_stock(chat_id, text, user_state):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute("SELECT stock_code, shares, cost_price FROM stock_assets WHERE user_id = ?",
+                       (chat_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        if not rows:
+            send_with_keyboard(chat_id, "📋 目前尚無庫存資料。")
+        else:
+            report = "📋 <b>您的持股庫存清單：</b>\n━━━━━━━━━━━━━━"
+            for code, shares, cost in rows:
+                report += f"\n代號：<code>{code}</code>\n持股：{shares} | 成本：{cost}\n"
+            send_with_keyboard(chat_id, report)
+    except Exception as e:
+        logger.error(f"查看庫存失敗: {e}")
+        send_with_keyboard(chat_id, "❌ 讀取資料庫失敗。")
+
+
+@router.command("新增庫存")
+def cmd_add_stock(chat_id, text, user_state):
+    send_with_keyboard(chat_id,
+                       "📝 請輸入：<code>代號 股數 成本</code>\n例如：<code>2330 1000 650.5</code>",
+                       {"keyboard": [["回主選單"]]})
+    user_state[chat_id] = "WAIT_STOCK_ADD"
+
+
+@router.command("刪除庫存")
+def cmd_del_stock(chat_id, text, user_state):
+    send_with_keyboard(chat_id, "🗑️ 請輸入要刪除的<b>股票代號</b>：", {"keyboard": [["回主選單"]]})
+    user_state[chat_id] = "WAIT_STOCK_DEL"
+
+
+# --- 對話狀態 ---
+@router.state("WAIT_STOCK_ADD")
+def state_stock_add(chat_id, text, user_state):
+    try:
+        parts = text.split()
+        if len(parts) != 3: raise ValueError
+        code, shares, cost = parts
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute(
+            "INSERT OR REPLACE INTO stock_assets (user_id, stock_code, shares, cost_price) VALUES (?, ?, ?, ?)",
+            (chat_id, code, int(shares), float(cost)))
+        conn.commit()
+        conn.close()
+        send_with_keyboard(chat_id, f"✅ 已紀錄 <b>{code}</b>\n股數：{shares}\n成本：{cost}")
+        user_state.pop(chat_id)
+    except:
+        send_with_keyboard(chat_id, "❌ 格式錯誤，請重新輸入：\n<code>代號 股數 成本</code>")
+
+
+@router.state("WAIT_STOCK_DEL")
+def state_stock_del(chat_id, text, user_state):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM stock_assets WHERE user_id = ? AND stock_code = ?",
+                       (chat_id, text))
+        if cursor.rowcount > 0:
+            conn.commit()
+            send_with_keyboard(chat_id, f"✅ 已成功刪除 <b>{text}</b>")
+            user_state.pop(chat_id)
+        else:
+            send_with_keyboard(chat_id, f"❓ 找不到代號 <b>{text}</b> 的資料。")
+        conn.close()
+    except Exception as e:
+        logger.error(f"刪除失敗: {e}")
+        send_with_keyboard(chat_id, "❌ 執行刪除時發生錯誤。")
+
+
+# --- 下載連結 ---
+@router.prefix("https://cn.javd.me/movie/")
+def link_javd(chat_id, text, user_state):
+    send_with_keyboard(chat_id, "🔍 偵測到 JAVD 連結，正在解析並加入下載任務...")
+    script_path = os.path.join(BASE_PATH, 'ds_download_manager.py')
+    try:
+        result = subprocess.check_output([sys.executable, script_path, text], encoding='utf-8')
+        send_with_keyboard(chat_id, result.strip())
+    except Exception as e:
+        send_with_keyboard(chat_id, f"❌ 下載任務調度失敗：{e}")
+
+
+def save_location(chat_id, location):
+    """動態抓取傳入的位置並製作 JSON 存檔"""
+    location_data = {
+        "location": {
+            "latitude": location["latitude"],
+            "longitude": location["longitude"]
+        },
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    json_file_path = os.path.join(BASE_PATH, 'current_location.json')
+    with open(json_file_path, 'w', encoding='utf-8') as f:
+        json.dump(location_data, f, ensure_ascii=False, indent=4)
+
+    logger.info(f"✅ 已抓取即時位置並存檔：{json_file_path}")
+    send_with_keyboard(chat_id,
+                       "📍 <b>位置存檔已更新</b>\n座標已成功存入系統，現在點選「查詢氣象」即可獲得當地預報。")
+
+
+def process_update(update, user_state):
+    """處理單一 update (同步執行，由 UpdateDispatcher 丟到 thread pool)"""
+    if "message" not in update: return
+    msg = update["message"]
+    chat_id = str(msg["chat"]["id"])
+
+    if "location" in msg:
+        save_location(chat_id, msg["location"])
+        return
+
+    if "text" not in msg: return
+    router.dispatch(chat_id, msg.get("text", "").strip(), user_state)
+
+
+# ================= ⚡ 非同步派發 =================
+class DispatchMetrics:
+    """佇列深度與處理延遲統計"""
+
+    def __init__(self):
+        self.handled = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_wait = 0.0
+        self.max_depth = 0
+
+    def record(self, wait, latency):
+        self.handled += 1
+        self.total_wait += wait
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def snapshot(self, depth):
+        self.max_depth = max(self.max_depth, depth)
+        avg = self.total_latency / self.handled if self.handled else 0.0
+        avg_wait = self.total_wait / self.handled if self.handled else 0.0
+        return {'handled': self.handled, 'queue_depth': depth, 'max_queue_depth': self.max_depth,
+                'avg_latency': round(avg, 3), 'max_latency': round(self.max_latency, 3),
+                'avg_wait': round(avg_wait, 3)}
+
+
+class UpdateDispatcher:
+    """每個聊天室一條有序佇列：同一位使用者的訊息依序處理，不同使用者之間並行
+
+    handler 是同步函式 (資料庫、HTTP、子行程)，放進 thread pool 執行，
+    所以某個聊天室卡在慢指令時不會擋住其他聊天室。
+    """
+
+    def __init__(self, loop, handler, max_workers=4):
+        self.loop = loop
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='update')
+        self.queues = {}
+        self.workers = {}
+        self.metrics = DispatchMetrics()
+
+    def queue_depth(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def submit(self, update):
+        """只能在事件迴圈的 thread 呼叫"""
+        chat_id = _chat_id_of(update)
+        queue = self.queues.setdefault(chat_id, deque())
+        queue.append((time.monotonic(), update))
+        self.metrics.snapshot(self.queue_depth())
+        if chat_id not in self.workers:
+            self.workers[chat_id] = self.loop.create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id):
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                enqueued_at, update = queue.popleft()
+                started = time.monotonic()
+                try:
+                    await self.loop.run_in_executor(self.executor, self.handler, update)
+                except Exception as e:
+                    logger.error(f"處理訊息失敗 (chat {chat_id}): {e}")
+                self.metrics.record(started - enqueued_at, time.monotonic() - started)
+        finally:
+            self.workers.pop(chat_id, None)
+            if not queue:
+                self.queues.pop(chat_id, None)
+
+    async def report_metrics(self, interval=60):
+        last_handled = 0
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.metrics.snapshot(self.queue_depth())
+            if stats['handled'] != last_handled:
+                last_handled = stats['handled']
+                logger.info(f"派發統計：已處理 {stats['handled']} 則，佇列 {stats['queue_depth']} "
+                            f"(最高 {stats['max_queue_depth']})，平均延遲 {stats['avg_latency']}s "
+                            f"(最高 {stats['max_latency']}s)，平均排隊 {stats['avg_wait']}s")
+                logger.info(f"指令耗時：{router.timing_report()}")
+
+
+def _chat_id_of(update):
+    for key in ("message", "edited_message", "callback_query"):
+        if key in update:
+            item = update[key]
+            chat = item.get("chat") or item.get("message", {}).get("chat") or {}
+            return str(chat.get("id"))
+    return None
+
+
+def fetch_updates(offset):
+    url = f"{telegram_client.API_BASE}/bot{TOKEN}/getUpdates"
+    params = {'timeout': 30, 'offset': offset}
+    return telegram_client.get_client(TOKEN).session.get(url, params=params, timeout=35).json()
+
+
+async def poll_updates(dispatcher, state_store, user_state, offset=None):
+    # long-poll 使用獨立的單一 thread，不佔用處理訊息的 thread pool
+    poll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='poll')
+    while True:
+        try:
+            response = await dispatcher.loop.run_in_executor(poll_executor, fetch_updates, offset)
+            for update in response.get("result") or []:
+                offset = update["update_id"] + 1
+                dispatcher.submit(update)
+            # 每批只寫一次：新的 offset 與上一批處理後的對話狀態
+            # (offset 先落地，重啟後不會重跑已收到的耗時指令)
+            await dispatcher.loop.run_in_executor(poll_executor, state_store.save, user_state, offset)
         except Exception as e:
             logger.error(f"監聽異常: {e}")
-            time.sleep(5)
+            await asyncio.sleep(5)
+
+
+# ================= 🌐 Webhook 模式 =================
+class WebhookHandler(BaseHTTPRequestHandler):
+    """接收 Telegram 推送的 update，交給與輪詢模式相同的派發邏輯"""
+    dispatcher = None
+    secret = None
+    recent_ids = deque(maxlen=1000)
+
+    def do_POST(self):
+        token = self.headers.get('X-Telegram-Bot-Api-Secret-Token') or ''
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.send_response(403)
+            self.end_headers()
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_response(400)
+            self.end_headers()
+            return
+        # 先回 200，Telegram 才不會重送；實際處理交給事件迴圈
+        self.dispatcher.loop.call_soon_threadsafe(self._submit, update)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    @classmethod
+    def _submit(cls, update):
+        # Telegram 逾時重送時可能收到同一個 update，依 update_id 去重
+        update_id = update.get("update_id")
+        if update_id is not None:
+            if update_id in cls.recent_ids:
+                return
+            cls.recent_ids.append(update_id)
+        cls.dispatcher.submit(update)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def serve_webhook(dispatcher, port):
+    secret = get_config('tele_webhook_secret')
+    if not secret:
+        # 沒有 secret 就無法分辨偽造的 update，任何人都能冒用聊天室觸發清理/搬移
+        logger.error("未設定 tele_webhook_secret，拒絕啟動 webhook 模式")
+        return
+    WebhookHandler.dispatcher = dispatcher
+    WebhookHandler.secret = secret
+    host = get_config('tele_webhook_host') or WEBHOOK_HOST
+    server = ThreadingHTTPServer((host, port), WebhookHandler)
+    threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    logger.info(f"Webhook 監聽中：{host}:{port}")
+
+    # 有設定對外網址時向 Telegram 註冊；否則假設已由反向代理/手動設定
+    webhook_url = get_config('tele_webhook_url')
+    if webhook_url:
+        data = {'url': webhook_url, 'secret_token': secret}
+        resp = await dispatcher.loop.run_in_executor(
+            None, telegram_client.get_client(TOKEN).call, 'setWebhook', data)
+        if resp is not None and resp.status_code == 200:
+            logger.info(f"已向 Telegram 註冊 webhook：{webhook_url}")
+        else:
+            logger.error("Webhook 註冊失敗")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.shutdown()
+
+
+async def flush_state_periodically(loop, state_store, user_state):
+    while True:
+        await asyncio.sleep(STATE_FLUSH_SECONDS)
+        await loop.run_in_executor(None, state_store.save, user_state)
+
+
+async def run_listener(mode='poll', port=WEBHOOK_PORT):
+    state_store = BotStateStore(DB_PATH)
+    user_state, offset = state_store.load()
+    loop = asyncio.get_running_loop()
+    dispatcher = UpdateDispatcher(loop, lambda update: process_update(update, user_state))
+    logger.info(f"機器人監聽服務已啟動 (模式：{mode})")
+    loop.create_task(dispatcher.report_metrics())
+    try:
+        if mode == 'webhook':
+            loop.create_task(flush_state_periodically(loop, state_store, user_state))
+            await serve_webhook(dispatcher, port)
+        else:
+            await poll_updates(dispatcher, state_store, user_state, offset)
+    finally:
+        state_store.save(user_state)
+        state_store.close()
+
+
+def handle_updates(mode='poll', port=WEBHOOK_PORT):
+    asyncio.run(run_listener(mode, port))
 
 
 if __name__ == "__main__":
+    # 用法：bot_listener.py             -> getUpdates 長輪詢
+    #       bot_listener.py webhook 8088 -> 本機 webhook 伺服器
     if TOKEN:
-        handle_updates()
+        if len(sys.argv) > 1 and sys.argv[1] == "webhook":
+            handle_updates('webhook', int(sys.argv[2]) if len(sys.argv) > 2 else WEBHOOK_PORT)
+        else:
+            handle_updates()
     else:
-        logger.critical("初始化中止：找不到 tele_token")
\ No newline at end of file
+        logger.critical("初始化中止：找不到 tele_token")
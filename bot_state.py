@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
+
+
+class BotStateStore:
+    """bot_listener 的對話狀態與 getUpdates offset
+
+    - 啟動時一次載入；之後由呼叫端在每批 update 之後呼叫 save()
+    - save() 只寫入與上次存檔不同的部分，整批一個交易
+    重新啟動後，進行中的「新增/刪除庫存」對話不會遺失，也不會再收到已處理過的 update。
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.conn = sqlite3.connect(db_path, timeout=20, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bot_user_state (
+                chat_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bot_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.conn.commit()
+        self._saved_states = {}
+        self._saved_offset = None
+
+    def load(self):
+        """回傳 (user_state, offset)；沒有紀錄時 offset 為 None"""
+        with self._lock:
+            self._saved_states = dict(self.conn.execute("SELECT chat_id, state FROM bot_user_state"))
+            row = self.conn.execute("SELECT value FROM bot_meta WHERE key = 'update_offset'").fetchone()
+            self._saved_offset = int(row[0]) if row and row[0] is not None else None
+        logger.info(f"載入對話狀態 {len(self._saved_states)} 筆，offset={self._saved_offset}")
+        return dict(self._saved_states), self._saved_offset
+
+    def save(self, user_state, offset=None):
+        """寫入有變動的狀態與 offset；沒有變動時不碰資料庫"""
+        current = dict(user_state)
+        changed = [(k, v) for k, v in current.items() if self._saved_states.get(k) != v]
+        removed = [(k,) for k in self._saved_states if k not in current]
+        offset_changed = offset is not None and offset != self._saved_offset
+        if not (changed or removed or offset_changed):
+            return
+        with self._lock:
+            try:
+                with self.conn:
+                    if changed:
+                        self.conn.executemany("INSERT OR REPLACE INTO bot_user_state (chat_id, state) VALUES (?, ?)",
+                                              changed)
+                    if removed:
+                        self.conn.executemany("DELETE FROM bot_user_state WHERE chat_id = ?", removed)
+                    if offset_changed:
+                        self.conn.execute("INSERT OR REPLACE INTO bot_meta (key, value) VALUES ('update_offset', ?)",
+                                          (str(offset),))
+            except sqlite3.Error as e:
+                logger.error(f"對話狀態存檔失敗: {e}")
+                return
+        self._saved_states = current
+        if offset_changed:
+            self._saved_offset = offset
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,203 @@
+import os
+import sys
+import hashlib
+import logging
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
+
+from bt_index import BTIndex, BT_ROOT
+from file_ops import FileOpEngine, FileOpPlan, OpJournal
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+
+# ================= 📝 LOGGING 系統設定 =================
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+# ================= 🔤 環境初始化 =================
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+ensure_utf8_stdout()
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
+
+# 小檔案交給 clean_bt_nas 處理，這裡只找有回收價值的重複檔
+MIN_DEDUP_BYTES = 1024 * 1024
+# 部分雜湊：讀取檔頭與檔尾各 64KB
+PARTIAL_CHUNK = 64 * 1024
+# 完整雜湊的讀取緩衝 (每個 thread 一份，重複使用)
+READ_BUFFER = 1024 * 1024
+HASH_WORKERS = 2
+
+
+def get_db_config():
+    """從資料庫讀取系統設定值 (行程內快取，只在設定表變動時重新載入)"""
+    return config_store.get_all(DB_PATH)
+
+
+def format_size(bytes_size):
+    size_mb = bytes_size / (1024 * 1024)
+    return f"{size_mb / 1024:.2f} GB" if size_mb >= 1024 else f"{size_mb:.1f} MB"
+
+
+# ================= #️⃣ 雜湊計算 =================
+def partial_hash(path, size):
+    """檔頭 + 檔尾各 64KB，先以便宜的方式排除大小相同但內容不同的檔案"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        h.update(f.read(PARTIAL_CHUNK))
+        if size > PARTIAL_CHUNK * 2:
+            f.seek(-PARTIAL_CHUNK, os.SEEK_END)
+            h.update(f.read(PARTIAL_CHUNK))
+        elif size > PARTIAL_CHUNK:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def full_hash(path):
+    """以固定緩衝 readinto 讀完整個檔案，避免大量配置記憶體"""
+    h = hashlib.blake2b(digest_size=32)
+    buf = bytearray(READ_BUFFER)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def _group(items, key_func):
+    groups = {}
+    for item in items:
+        groups.setdefault(key_func(item), []).append(item)
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def find_duplicates(index):
+    """回傳重複群組 [[(path, name, size, mtime, inode), ...], ...]，每組依 mtime 由舊到新
+
+    1. 依檔案大小分組 (直接查索引，不讀檔)
+    2. 同大小者比對檔頭檔尾的部分雜湊
+    3. 部分雜湊也相同者才讀完整內容
+    雜湊以 (inode, size, mtime) 快取在索引中，重複執行只會讀新檔案。
+    """
+    candidates = index.same_size_files(MIN_DEDUP_BYTES)
+    # 同一 inode 的硬連結只保留一筆
+    seen_inodes = set()
+    files = []
+    for row in candidates:
+        if row[4] in seen_inodes:
+            continue
+        seen_inodes.add(row[4])
+        files.append(row)
+
+    def key_of(row):
+        return row[4], row[2], row[3]
+
+    cache = index.cached_hashes([key_of(r) for r in files])
+    partials = {}
+    full = {}
+    read_partial = 0
+    for row in files:
+        cached = cache.get(key_of(row))
+        if cached and cached[0]:
+            partials[row[0]] = cached[0]
+        else:
+            try:
+                partials[row[0]] = partial_hash(row[0], row[2])
+            except OSError as e:
+                logger.error(f"讀取失敗 {row[1]}: {e}")
+                continue
+            index.store_hash(key_of(row), partial=partials[row[0]])
+            read_partial += 1
+        if cached and cached[1]:
+            full[row[0]] = cached[1]
+
+    by_partial = _group([r for r in files if r[0] in partials], lambda r: (r[2], partials[r[0]]))
+    need_full = [r for g in by_partial for r in g if r[0] not in full]
+    logger.info(f"重複檢查：{len(files)} 個同大小檔案，新讀取部分雜湊 {read_partial} 個，"
+                f"需完整雜湊 {len(need_full)} 個")
+
+    if need_full:
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            results = pool.map(lambda r: (r, _safe_full_hash(r[0])), need_full)
+            for row, digest in results:
+                if digest:
+                    full[row[0]] = digest
+                    index.store_hash(key_of(row), full=digest)
+    index.conn.commit()
+
+    duplicates = []
+    for group in by_partial:
+        duplicates.extend(_group([r for r in group if r[0] in full], lambda r: full[r[0]]))
+    return duplicates
+
+
+def _safe_full_hash(path):
+    try:
+        return full_hash(path)
+    except OSError as e:
+        logger.error(f"讀取失敗 {os.path.basename(path)}: {e}")
+        return None
+
+
+# ================= 🚀 主流程 =================
+def dedup_bt(reclaim=False):
+    """reclaim=False 只回報；True 時保留每組最早下載的一份，其餘刪除"""
+    configs = get_db_config()
+    token = configs.get('tele_token')
+    chat_id = configs.get('tele_chat_id')
+
+    if not os.path.exists(BT_ROOT):
+        logger.error(f"路徑錯誤：找不到資料夾 {BT_ROOT}")
+        return
+
+    with BTIndex(BT_ROOT) as index:
+        index.refresh()
+        index.prune_hashes()
+        groups = find_duplicates(index)
+
+        plan = FileOpPlan()
+        for group in groups:
+            for path, _, size, _, _ in group[1:]:
+                plan.deletes.append((path, size))
+        reclaimable = sum(size for _, size in plan.deletes)
+
+        result = None
+        if reclaim and plan.deletes:
+            with OpJournal('dedup') as journal:
+                journal.save_plan(plan, status='applying')
+                result = FileOpEngine().apply(plan, journal=journal, verify=True)
+                journal.set_status('done')
+            index.forget_files(result.done_deletes + result.missing)
+
+    if not groups:
+        logger.info("沒有發現重複檔案")
+        return
+
+    msg = f"🧬 <b>BT 重複檔案{'清理' if result else '檢查'}報告</b>\n"
+    msg += f"━━━━━━━━━━━━━━━━\n"
+    msg += f"📂 重複群組：<b>{len(groups)}</b> 組\n"
+    msg += f"💾 可回收空間：<b>{format_size(reclaimable)}</b>"
+    if result:
+        msg += f"\n🗑️ 已刪除：{len(result.done_deletes)} 個 ({format_size(result.bytes_done)})"
+        if result.failed:
+            msg += f"\n❌ 失敗：{len(result.failed)} 個"
+    for group in groups[:5]:
+        keep = group[0]
+        msg += f"\n\n✅ 保留 <code>{keep[1]}</code> ({format_size(keep[2])})"
+        for row in group[1:]:
+            msg += f"\n♻️ <code>{row[1]}</code>"
+
+    if telegram_client.send_message(token, chat_id, msg):
+        logger.info("重複檔案報告發送成功")
+
+
+if __name__ == "__main__":
+    dedup_bt(reclaim=len(sys.argv) > 1 and sys.argv[1] == "reclaim")
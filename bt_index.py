@@ -0,0 +1,269 @@
+import os
+import sqlite3
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ================= ⚙️ 路徑與參數 =================
+# 索引資料庫與 account_book.db 放在同一個資料夾，但獨立檔案避免與設定表互搶鎖
+INDEX_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bt_index.db")
+BT_ROOT = '/volume1/淳/BT/'
+# 排除 NAS 系統縮圖資料夾
+SKIP_DIR_NAMES = ('@eaDir',)
+
+
+class BTIndex:
+    """BT 資料夾的持久化檔案索引 (path, size, mtime, inode)
+
+    以 os.scandir 建立，之後依目錄 mtime 增量更新：目錄 mtime 沒變就不重新列出內容，
+    但其中已索引的檔案仍逐一 os.stat (原地續寫的檔案不會改變目錄 mtime)；
+    check_bt、clean_bt_nas、move_files 都改查這份索引，不再各自 os.walk。
+    """
+
+    def __init__(self, root=BT_ROOT, db_path=INDEX_DB_PATH):
+        self.root = os.path.normpath(root)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=20)
+        self._init_db()
+
+    def _init_db(self):
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bt_dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime REAL
+            );
+            CREATE TABLE IF NOT EXISTS bt_files (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                inode INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_bt_files_dir ON bt_files(dir);
+            CREATE INDEX IF NOT EXISTS idx_bt_files_mtime ON bt_files(mtime);
+            CREATE INDEX IF NOT EXISTS idx_bt_files_size ON bt_files(size);
+            CREATE TABLE IF NOT EXISTS bt_hashes (
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                partial TEXT,
+                full TEXT,
+                PRIMARY KEY (inode, size, mtime)
+            );
+            CREATE TABLE IF NOT EXISTS bt_scan_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ================= 🔄 增量更新 =================
+    def refresh(self):
+        """依目錄 mtime 增量同步索引；回傳本次掃描統計"""
+        started = time.time()
+        cur = self.conn.cursor()
+
+        known_dirs = dict(cur.execute("SELECT path, mtime FROM bt_dirs").fetchall())
+        children = {}
+        for path, parent in cur.execute("SELECT path, parent FROM bt_dirs").fetchall():
+            children.setdefault(parent, []).append(path)
+
+        # 已索引的檔案依目錄分組，目錄沒變時用來逐檔重新 stat
+        known_files = {}
+        for path, d, size, mtime, inode in cur.execute(
+                "SELECT path, dir, size, mtime, inode FROM bt_files").fetchall():
+            known_files.setdefault(d, []).append((path, size, mtime, inode))
+
+        stats = {'dirs_scanned': 0, 'dirs_skipped': 0, 'files_stat': 0, 'dirs_removed': 0}
+        seen_dirs = set()
+        stack = [(self.root, None)]
+
+        while stack:
+            d, parent = stack.pop()
+            try:
+                d_stat = os.stat(d)
+            except OSError:
+                continue
+            seen_dirs.add(d)
+
+            if known_dirs.get(d) == d_stat.st_mtime:
+                # 目錄內容沒有增減：沿用已知子目錄，不必 listdir，只重新 stat 已知檔案
+                stack.extend((c, d) for c in children.get(d, []))
+                self._restat_files(cur, known_files.get(d, []))
+                stats['files_stat'] += len(known_files.get(d, []))
+                stats['dirs_skipped'] += 1
+                continue
+
+            rows = []
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in SKIP_DIR_NAMES:
+                                    stack.append((entry.path, d))
+                            elif entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                rows.append((entry.path, d, entry.name, st.st_size, st.st_mtime, st.st_ino))
+                        except OSError:
+                            continue
+            except OSError as e:
+                logger.error(f"無法讀取資料夾 {d}: {e}")
+                continue
+
+            cur.execute("DELETE FROM bt_files WHERE dir = ?", (d,))
+            cur.executemany("INSERT OR REPLACE INTO bt_files (path, dir, name, size, mtime, inode) "
+                            "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            cur.execute("INSERT OR REPLACE INTO bt_dirs (path, parent, mtime) VALUES (?, ?, ?)",
+                        (d, parent, d_stat.st_mtime))
+            stats['dirs_scanned'] += 1
+            stats['files_stat'] += len(rows)
+
+        # 已消失的目錄連同其檔案一併移除
+        removed = [d for d in known_dirs if d not in seen_dirs]
+        if removed:
+            cur.executemany("DELETE FROM bt_files WHERE dir = ?", [(d,) for d in removed])
+            cur.executemany("DELETE FROM bt_dirs WHERE path = ?", [(d,) for d in removed])
+        stats['dirs_removed'] = len(removed)
+
+        self.conn.commit()
+        logger.info(f"索引更新完成：掃描 {stats['dirs_scanned']} 個資料夾，沿用 {stats['dirs_skipped']} 個，"
+                    f"stat {stats['files_stat']} 個檔案，耗時 {time.time() - started:.2f}s")
+        return stats
+
+    def _restat_files(self, cur, files):
+        """files: [(path, size, mtime, inode), ...]；只寫回有變動的檔案"""
+        for path, size, mtime, inode in files:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                cur.execute("DELETE FROM bt_files WHERE path = ?", (path,))
+                continue
+            except OSError:
+                continue
+            if (st.st_size, st.st_mtime, st.st_ino) == (size, mtime, inode):
+                continue
+            cur.execute("UPDATE bt_files SET size = ?, mtime = ?, inode = ? WHERE path = ?",
+                        (st.st_size, st.st_mtime, st.st_ino, path))
+
+    # ================= 🔍 查詢 =================
+    def modified_between(self, start_ts, end_ts, min_size=0):
+        """修改時間落在區間內且大於 min_size 的檔案 (排除隱藏檔)"""
+        return self.conn.execute(
+            "SELECT path, name, size, mtime FROM bt_files "
+            "WHERE mtime BETWEEN ? AND ? AND size > ? AND name NOT LIKE '.%' ORDER BY path",
+            (start_ts, end_ts, min_size)).fetchall()
+
+    def smaller_than(self, limit_bytes):
+        """小於 limit_bytes 的檔案 (排除隱藏檔)"""
+        return self.conn.execute(
+            "SELECT path, name, size FROM bt_files WHERE size < ? AND name NOT LIKE '.%' ORDER BY path",
+            (limit_bytes,)).fetchall()
+
+    def files_in_subdirs(self):
+        """所有不在根目錄的檔案"""
+        return self.conn.execute(
+            "SELECT path, dir, name, size FROM bt_files WHERE dir != ? ORDER BY path",
+            (self.root,)).fetchall()
+
+    def subdirs_bottom_up(self):
+        """根目錄以外的所有資料夾，由最深層開始排列"""
+        dirs = [row[0] for row in self.conn.execute("SELECT path FROM bt_dirs WHERE path != ?", (self.root,))]
+        return sorted(dirs, key=lambda p: p.count(os.sep), reverse=True)
+
+    def same_size_files(self, min_size=0):
+        """大小相同 (可能重複) 的檔案，排除隱藏檔與同一 inode 的硬連結"""
+        return self.conn.execute(
+            "SELECT path, name, size, mtime, inode FROM bt_files WHERE name NOT LIKE '.%' AND size >= ? AND size IN ("
+            "  SELECT size FROM bt_files WHERE name NOT LIKE '.%' AND size >= ? "
+            "  GROUP BY size HAVING COUNT(DISTINCT inode) > 1"
+            ") ORDER BY size, mtime",
+            (min_size, min_size)).fetchall()
+
+    # ================= #️⃣ 內容雜湊快取 =================
+    def cached_hashes(self, keys):
+        """keys: [(inode, size, mtime), ...] → {key: (partial, full)}"""
+        found = {}
+        for key in keys:
+            row = self.conn.execute("SELECT partial, full FROM bt_hashes WHERE inode = ? AND size = ? AND mtime = ?",
+                                    key).fetchone()
+            if row:
+                found[key] = row
+        return found
+
+    def store_hash(self, key, partial=None, full=None):
+        # 不用 UPSERT 語法，DSM 內建的 SQLite 版本可能不支援
+        self.conn.execute("INSERT OR IGNORE INTO bt_hashes (inode, size, mtime) VALUES (?, ?, ?)", key)
+        self.conn.execute("UPDATE bt_hashes SET partial = COALESCE(?, partial), full = COALESCE(?, full) "
+                          "WHERE inode = ? AND size = ? AND mtime = ?", (partial, full, *key))
+
+    def prune_hashes(self):
+        """移除已不在索引中的檔案雜湊"""
+        self.conn.execute("DELETE FROM bt_hashes WHERE NOT EXISTS ("
+                          "SELECT 1 FROM bt_files f WHERE f.inode = bt_hashes.inode AND f.size = bt_hashes.size "
+                          "AND f.mtime = bt_hashes.mtime)")
+        self.conn.commit()
+
+    # ================= 📌 掃描狀態 (高水位標記等) =================
+    def get_state(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM bt_scan_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO bt_scan_state (key, value) VALUES (?, ?)", (key, str(value)))
+        self.conn.commit()
+
+    # ================= ✏️ 操作後同步 =================
+    def upsert_file(self, path, st=None, commit=True):
+        """單一檔案寫入索引 (供即時監看使用)；檔案已不存在時回傳 None"""
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        self.conn.execute("INSERT OR REPLACE INTO bt_files (path, dir, name, size, mtime, inode) "
+                          "VALUES (?, ?, ?, ?, ?, ?)",
+                          (path, os.path.dirname(path), os.path.basename(path), st.st_size, st.st_mtime, st.st_ino))
+        if commit:
+            self.conn.commit()
+        return st
+
+    def forget_tree(self, dirpath):
+        """資料夾被刪除或移出時，移除它與底下所有項目"""
+        prefix = dirpath.rstrip(os.sep) + os.sep
+        like = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        self.conn.execute("DELETE FROM bt_files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (dirpath, like))
+        self.conn.execute("DELETE FROM bt_dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (dirpath, like))
+        self.conn.commit()
+
+    def all_dirs(self):
+        return [row[0] for row in self.conn.execute("SELECT path FROM bt_dirs")]
+
+    def forget_files(self, paths):
+        self.conn.executemany("DELETE FROM bt_files WHERE path = ?", [(p,) for p in paths])
+        self.conn.commit()
+
+    def record_moves(self, moves):
+        """moves: [(src, dst), ...]"""
+        self.conn.executemany(
+            "UPDATE OR REPLACE bt_files SET path = ?, dir = ?, name = ? WHERE path = ?",
+            [(dst, os.path.dirname(dst), os.path.basename(dst), src) for src, dst in moves])
+        self.conn.commit()
+
+    def forget_dirs(self, paths):
+        self.conn.executemany("DELETE FROM bt_files WHERE dir = ?", [(p,) for p in paths])
+        self.conn.executemany("DELETE FROM bt_dirs WHERE path = ?", [(p,) for p in paths])
+        self.conn.commit()
@@ -0,0 +1,451 @@
+import os
+import sys
+import time
+import errno
+import select
+import shutil
+import struct
+import ctypes
+import ctypes.util
+import sqlite3
+import logging
+import urllib3
+from collections import OrderedDict
+
+from bt_index import BTIndex, BT_ROOT, SKIP_DIR_NAMES
+from ds_history import TaskHistory, HISTORY_DB_PATH
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+
+# ================= 📝 LOGGING 系統設定 =================
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+# ================= 🔤 環境初始化 =================
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+ensure_utf8_stdout()
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
+
+# 大於此大小視為完成的大檔案 (推播通知)；小於則視為可清理的小檔案 (與 clean_bt_nas 相同門檻)
+LARGE_FILE_BYTES = 100 * 1024 * 1024
+# 檔案 mtime 超過幾秒沒變動才視為寫入完成，避免處理到下載中的檔案
+SETTLE_SECONDS = 60
+# inotify 不可用時的輪詢間隔 (監看數量不足時，未能監看的子資料夾也用這個間隔掃描)
+POLL_INTERVAL = 30
+# 已推播過的大檔案 inode 只記最近這麼多筆，避免常駐行程記憶體一直成長
+MAX_NOTIFIED = 1000
+# Download Station 任務狀態 (ds_manager 寫入 ds_history) 重新讀取的間隔
+TASK_REFRESH_SECONDS = 60
+# 最近一輪任務快照在這段時間內，才能斷定「不屬於任何任務」的檔案不是下載中
+TASK_FRESH_SECONDS = 30 * 60
+# 所屬任務尚未完成的檔案，隔多久再檢查一次
+TASK_RECHECK_SECONDS = 5 * 60
+DS_FINISHED_STATUSES = ('finished', 'seeding')
+
+# ================= 🔔 inotify 常數 (linux/inotify.h) =================
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def get_db_config():
+    """從資料庫讀取系統設定值 (行程內快取，只在設定表變動時重新載入)"""
+    return config_store.get_all(DB_PATH)
+
+
+# ================= 👀 inotify 事件來源 =================
+class InotifySource:
+    """以 ctypes 呼叫 libc inotify，遞迴監看整個 BT 資料夾"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "libc 不支援 inotify")
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失敗")
+        self.wd_to_path = {}
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # ENOSPC 代表 max_user_watches 用完，交由上層改用輪詢
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify 監看數量已達上限 (fs.inotify.max_user_watches)")
+            logger.warning(f"無法監看資料夾 {path}: {os.strerror(err)}")
+            return None
+        self.wd_to_path[wd] = path
+        return wd
+
+    def read_events(self, timeout):
+        """等待事件，回傳 [(mask, 完整路徑), ...]"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                events.append((mask, None))
+                continue
+            base = self.wd_to_path.get(wd)
+            if mask & IN_IGNORED:
+                self.wd_to_path.pop(wd, None)
+                continue
+            if base is None:
+                continue
+            path = os.path.join(base, os.fsdecode(name)) if name else base
+            events.append((mask, path))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+# ================= 📥 Download Station 任務狀態 =================
+class TaskTracker:
+    """依 ds_history 的最近一輪任務快照判斷檔案是否已下載完成
+
+    Download Station 會預先配置檔案大小，任務暫停時 mtime 也不再變動，
+    所以「一段時間沒寫入」不代表下載完成；只有所屬任務已 finished/seeding 才算。
+    """
+
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.db_path = db_path
+        self.loaded_at = 0
+        self.snapshot_ts = None
+        self.statuses = {}
+
+    def _refresh(self):
+        now = time.time()
+        if now - self.loaded_at < TASK_REFRESH_SECONDS:
+            return
+        self.loaded_at = now
+        if not os.path.exists(self.db_path):
+            self.snapshot_ts, self.statuses = None, {}
+            return
+        try:
+            with TaskHistory(self.db_path) as history:
+                self.snapshot_ts, self.statuses = history.latest_titles()
+        except sqlite3.Error as e:
+            logger.error(f"任務狀態讀取失敗: {e}")
+
+    def state(self, root, path, mtime):
+        """'finished'、'unfinished'、'unknown' (尚無法判斷)；沒有任何任務紀錄時回傳 None"""
+        self._refresh()
+        if self.snapshot_ts is None:
+            return None
+        top = os.path.relpath(path, root).split(os.sep)[0]
+        status = self.statuses.get(top)
+        if status is not None:
+            return 'finished' if status in DS_FINISHED_STATUSES else 'unfinished'
+        # 不屬於任何任務 (例如手動複製進來)：快照夠新且檔案在快照前就已寫完，才視為完成
+        if time.time() - self.snapshot_ts < TASK_FRESH_SECONDS and mtime < self.snapshot_ts:
+            return 'finished'
+        return 'unknown'
+
+
+# ================= 🚀 即時監看主邏輯 =================
+class BTWatcher:
+    """常駐監看 BT 資料夾，將事件即時寫入共用索引
+
+    - 完成的大檔案 (> 100MB) 推播到 Telegram
+    - clean=True 時，下載完成的小檔案直接刪除 (取代 clean_bt_nas 批次清理)
+    - flatten=True 時，子資料夾中下載完成的檔案直接搬到根目錄 (取代 move_files 批次整理)
+
+    「下載完成」以 Download Station 任務狀態為準 (TaskTracker)；沒有任務紀錄時 (未使用 ds_manager)，
+    改以 IN_CLOSE_WRITE / IN_MOVED_TO 事件加上一段時間沒再寫入判斷。暫停中的任務不會被推播、刪除或搬移。
+    """
+
+    def __init__(self, root=BT_ROOT, clean=False, flatten=False):
+        self.index = BTIndex(root)
+        self.root = self.index.root
+        self.clean = clean
+        self.flatten = flatten
+        self.pending = {}
+        # 收到 IN_CLOSE_WRITE / IN_MOVED_TO 的檔案 (沒有任務紀錄時的完成依據)
+        self.closed = set()
+        self.polling = False
+        self.tasks = TaskTracker()
+        self.notified = OrderedDict()
+        # 無法加入 inotify 監看 (通常是 ENOSPC) 的子資料夾，改為定期掃描
+        self.unwatched = set()
+        self._last_subtree_poll = time.time()
+        self._last_event_ts = time.time()
+        configs = get_db_config()
+        self.token = configs.get('tele_token')
+        self.chat_id = configs.get('tele_chat_id')
+
+    def send_alert(self, message):
+        telegram_client.send_message(self.token, self.chat_id, message)
+
+    def run(self):
+        logger.info(f"BT 即時監看啟動：{self.root} (清理={self.clean}，攤平={self.flatten})")
+        self._last_event_ts = time.time()
+        self.index.refresh()
+        try:
+            source = InotifySource()
+            for d in [self.root] + self.index.all_dirs():
+                source.add_watch(d)
+        except OSError as e:
+            logger.warning(f"inotify 無法使用 ({e})，改用輪詢模式")
+            self._run_polling()
+            return
+
+        logger.info(f"inotify 已監看 {len(source.wd_to_path)} 個資料夾")
+        try:
+            self._run_inotify(source)
+        finally:
+            source.close()
+
+    # ---------- inotify 模式 ----------
+    def _run_inotify(self, source):
+        while True:
+            # 這一批事件涵蓋的起點；溢出時要從上一批的起點開始補
+            read_started = time.time()
+            for mask, path in source.read_events(timeout=SETTLE_SECONDS / 4):
+                if path is None:
+                    self._resync(source)
+                    continue
+                self._handle_event(source, mask, path)
+            self._last_event_ts = read_started
+            self._poll_unwatched()
+            self._process_pending()
+
+    def _handle_event(self, source, mask, path):
+        name = os.path.basename(path)
+        if mask & IN_ISDIR:
+            if name in SKIP_DIR_NAMES:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(source, path, moved_in=bool(mask & IN_MOVED_TO))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.index.forget_tree(path)
+                prefix = path.rstrip(os.sep) + os.sep
+                self.unwatched = {d for d in self.unwatched if d != path and not d.startswith(prefix)}
+            return
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.index.forget_files([path])
+            self.pending.pop(path, None)
+            self.closed.discard(path)
+        elif mask & (IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO):
+            if self.index.upsert_file(path):
+                self.pending[path] = time.time()
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.closed.add(path)
+                else:
+                    self.closed.discard(path)
+
+    def _resync(self, source):
+        """inotify 事件佇列溢出：重新同步索引、補上新資料夾的監看，並補處理期間變動的檔案"""
+        logger.warning("inotify 事件佇列溢出，重新同步索引")
+        now = time.time()
+        self.index.refresh()
+        watched = set(source.wd_to_path.values())
+        for d in [self.root] + self.index.all_dirs():
+            if d in watched or any(d == u or d.startswith(u.rstrip(os.sep) + os.sep) for u in self.unwatched):
+                continue
+            try:
+                source.add_watch(d)
+            except OSError as e:
+                logger.warning(f"無法監看 {d} ({e})，此資料夾改用輪詢")
+                self.unwatched.add(d)
+        for path, _, _, _ in self.index.modified_between(self._last_event_ts - SETTLE_SECONDS, now, min_size=-1):
+            self.pending.setdefault(path, now)
+
+    def _add_tree(self, source, dirpath, moved_in=False):
+        """新建或移入的資料夾：加入監看並把既有內容寫入索引
+
+        moved_in：整個資料夾是移入的，裡面的檔案已寫完 (視同收到 IN_MOVED_TO)。
+
+        監看數量用完時不中斷監看迴圈，該資料夾 (含底下子資料夾) 改由 _poll_unwatched 定期掃描。
+        """
+        stack = [(dirpath, True)]
+        while stack:
+            d, watch = stack.pop()
+            if watch:
+                try:
+                    source.add_watch(d)
+                except OSError as e:
+                    logger.warning(f"無法監看 {d} ({e})，此資料夾改用輪詢")
+                    self.unwatched.add(d)
+                    watch = False
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in SKIP_DIR_NAMES:
+                                stack.append((entry.path, watch))
+                        elif entry.is_file(follow_symlinks=False):
+                            self.index.upsert_file(entry.path, entry.stat(follow_symlinks=False), commit=False)
+                            self.pending[entry.path] = time.time()
+                            if moved_in:
+                                self.closed.add(entry.path)
+            except OSError as e:
+                logger.error(f"無法讀取資料夾 {d}: {e}")
+        self.index.conn.commit()
+
+    def _poll_unwatched(self):
+        """定期掃描無法監看的子資料夾，有變動的檔案比照 inotify 事件處理"""
+        now = time.time()
+        if not self.unwatched or now - self._last_subtree_poll < POLL_INTERVAL:
+            return
+        since = self._last_subtree_poll - SETTLE_SECONDS
+        self._last_subtree_poll = now
+        for root in list(self.unwatched):
+            if not os.path.isdir(root):
+                self.unwatched.discard(root)
+                continue
+            stack = [root]
+            while stack:
+                d = stack.pop()
+                try:
+                    with os.scandir(d) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in SKIP_DIR_NAMES:
+                                    stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                if st.st_mtime >= since:
+                                    self.index.upsert_file(entry.path, st, commit=False)
+                                    self.pending.setdefault(entry.path, now)
+                except OSError as e:
+                    logger.error(f"無法讀取資料夾 {d}: {e}")
+        self.index.conn.commit()
+
+    # ---------- 輪詢模式 (inotify 不可用時的替代方案) ----------
+    def _run_polling(self):
+        self.polling = True
+        last_poll = time.time()
+        while True:
+            time.sleep(POLL_INTERVAL)
+            now = time.time()
+            self.index.refresh()
+            # 上次輪詢之後有變動的檔案，比照 inotify 事件處理
+            for path, _, _, _ in self.index.modified_between(last_poll - SETTLE_SECONDS, now, min_size=-1):
+                self.pending.setdefault(path, now)
+            last_poll = now
+            self._process_pending()
+
+    # ---------- 寫入完成後的處理 ----------
+    def _process_pending(self):
+        now = time.time()
+        for path, seen_at in list(self.pending.items()):
+            if now - seen_at < SETTLE_SECONDS:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.pending.pop(path, None)
+                continue
+            if now - st.st_mtime < SETTLE_SECONDS:
+                # 仍在寫入中，下一輪再看
+                self.pending[path] = now
+                continue
+            if not self._download_complete(path, st):
+                # 所屬任務未完成 (下載中或暫停)：不推播、不清理、不搬移，稍後再確認
+                self.pending[path] = now + TASK_RECHECK_SECONDS - SETTLE_SECONDS
+                continue
+            self.pending.pop(path, None)
+            self.closed.discard(path)
+            try:
+                self._handle_settled(path, st)
+            except Exception as e:
+                logger.error(f"處理檔案失敗 {path}: {e}")
+
+    def _download_complete(self, path, st):
+        state = self.tasks.state(self.root, path, st.st_mtime)
+        if state is not None:
+            return state == 'finished'
+        # 沒有任務紀錄：只有事件來源能確認檔案已關閉；輪詢 (含無法監看的子資料夾) 只能依 mtime
+        if self.polling or any(path.startswith(d.rstrip(os.sep) + os.sep) for d in self.unwatched):
+            return True
+        return path in self.closed
+
+    def _handle_settled(self, path, st):
+        name = os.path.basename(path)
+        if name.startswith('.'):
+            return
+        self.index.upsert_file(path, st)
+
+        if st.st_size > LARGE_FILE_BYTES:
+            if st.st_ino not in self.notified:
+                self.notified[st.st_ino] = True
+                if len(self.notified) > MAX_NOTIFIED:
+                    self.notified.popitem(last=False)
+                size_mb = st.st_size / (1024 * 1024)
+                size_str = f"{size_mb / 1024:.2f} GB" if size_mb >= 1024 else f"{size_mb:.0f} MB"
+                self.send_alert(f"✅ <b>BT 下載完成</b>\n📄 <code>{name}</code> ({size_str})")
+                logger.info(f"大檔案完成推播: {name}")
+        elif self.clean:
+            os.remove(path)
+            self.index.forget_files([path])
+            logger.info(f"即時清理小檔案: {name}")
+            self._remove_empty_parents(os.path.dirname(path))
+            return
+
+        if self.flatten and os.path.dirname(path) != self.root:
+            dst = os.path.join(self.root, name)
+            if os.path.exists(dst):
+                logger.warning(f"略過：目的地已有同名檔案 - {name}")
+                return
+            try:
+                os.rename(path, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(path, dst)
+            self.index.record_moves([(path, dst)])
+            logger.info(f"即時搬移：{name}")
+            self._remove_empty_parents(os.path.dirname(path))
+
+    def _remove_empty_parents(self, dirpath):
+        """由下往上刪除空資料夾，直到根目錄為止"""
+        removed = []
+        while dirpath != self.root and dirpath.startswith(self.root + os.sep):
+            try:
+                if os.listdir(dirpath):
+                    break
+                os.rmdir(dirpath)
+            except OSError:
+                break
+            removed.append(dirpath)
+            logger.info(f"已清理空資料夾：{os.path.basename(dirpath)}")
+            dirpath = os.path.dirname(dirpath)
+        if removed:
+            self.index.forget_dirs(removed)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    BTWatcher(clean='clean' in args, flatten='flatten' in args).run()
@@ -1,12 +1,14 @@
 import os
 import time
-import requests
-import sqlite3
 import sys
-import io
 import logging
 from datetime import datetime, timedelta
 
+from bt_index import BTIndex
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+
 # ================= 📝 LOGGING 系統設定 (中文化) =================
 logging.basicConfig(
     level=logging.INFO,
@@ -16,31 +18,48 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ================= 🔤 環境初始化 =================
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+ensure_utf8_stdout()
 # 資料庫路徑使用絕對路徑確保穩定
 DB_PATH = "/volume1/docker/ma/account_book.db"
 
 
 def get_config():
-    """從資料庫讀取 Telegram 設定"""
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM config")
-        res = dict(cursor.fetchall())
-        conn.close()
-        return res
-    except Exception as e:
-        logger.error(f"資料庫讀取失敗: {e}")
-        return {}
+    """從資料庫讀取 Telegram 設定 (行程內快取)"""
+    return config_store.get_all(DB_PATH)
 
 
 # ================= 🚀 核心結算邏輯 =================
+BT_PATH = '/volume1/淳/BT/'
+# 門檻：僅列出大於 100MB 的檔案
+MIN_REPORT_BYTES = 100 * 1024 * 1024
+# 增量模式的高水位標記 (存在 bt_index.db)
+WATERMARK_KEY = 'check_bt_last_report_ts'
+
+
+def format_file_list(rows):
+    file_list = []
+    for _, f, size_bytes, _ in rows:
+        size_mb = size_bytes / (1024 * 1024)
+        size_str = f"{size_mb / 1024:.2f} GB" if size_mb >= 1024 else f"{size_mb:.0f} MB"
+        # 格式化詳細檔名與大小
+        file_list.append(f"📄 <code>{f}</code> ({size_str})")
+    return file_list
+
+
+def send_report(token, chat_id, msg):
+    """發送 Telegram 報告，回傳是否成功"""
+    # 檔案清單很長時由 telegram_client 自動依 4096 字分段
+    if telegram_client.send_message(token, chat_id, msg):
+        logger.info("詳細檔名報告發送成功")
+        return True
+    return False
+
+
 def scan_bt_daily():
     conf = get_config()
     token = conf.get('tele_token')
     chat_id = conf.get('tele_chat_id')
-    path = '/volume1/淳/BT/'
+    path = BT_PATH
 
     if not os.path.exists(path):
         logger.error(f"路徑錯誤：找不到資料夾 {path}")
@@ -62,30 +81,13 @@ def scan_bt_daily():
     logger.info(
         f"開始掃描詳細檔名：從 {start_time_dt.strftime('%Y-%m-%d %H:%M')} 到 {end_time_dt.strftime('%Y-%m-%d %H:%M')}")
 
-    file_list = []
+    # 由共用索引查詢 (已排除 @eaDir 與隱藏檔)，不再整棵樹 os.walk
+    with BTIndex(path) as index:
+        index.refresh()
+        # 僅列出修改時間落在 17:00 ~ 17:00 區間的大檔案
+        rows = index.modified_between(start_ts, end_ts, min_size=MIN_REPORT_BYTES)
 
-    for root, _, files in os.walk(path):
-        # 排除 NAS 系統縮圖資料夾
-        if '@eaDir' in root: continue
-        for f in files:
-            # 排除隱藏檔
-            if f.startswith('.'): continue
-
-            f_path = os.path.join(root, f)
-            try:
-                # 取得檔案最後修改時間
-                mtime = os.path.getmtime(f_path)
-                # 檢查時間戳是否落在 17:00 ~ 17:00 區間
-                if start_ts <= mtime <= end_ts:
-                    size_bytes = os.path.getsize(f_path)
-                    size_mb = size_bytes / (1024 * 1024)
-                    # 門檻：僅列出大於 100MB 的檔案
-                    if size_mb > 100:
-                        size_str = f"{size_mb / 1024:.2f} GB" if size_mb >= 1024 else f"{size_mb:.0f} MB"
-                        # 格式化詳細檔名與大小
-                        file_list.append(f"📄 <code>{f}</code> ({size_str})")
-            except Exception:
-                continue
+    file_list = format_file_list(rows)
 
     # 準備 Telegram 訊息
     if file_list:
@@ -96,16 +98,63 @@ def scan_bt_daily():
     else:
         msg = f"📋 <b>BT 下載結算報告</b>\n在此時段內無新增大於 100MB 的檔案。"
 
-    # 發送通知
-    if token and chat_id:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        payload = {'chat_id': chat_id, 'text': msg, 'parse_mode': 'HTML'}
-        try:
-            requests.post(url, data=payload, verify=False, timeout=15)
-            logger.info("詳細檔名報告發送成功")
-        except Exception as e:
-            logger.error(f"Telegram 發送異常: {e}")
+    # 發送通知；報告內容也回傳給呼叫端 (bot 轉送給其他發問者)
+    send_report(token, chat_id, msg)
+    return msg
+
+
+def scan_bt_since_last():
+    """增量模式：只回報上次回報之後新增的大檔案
+
+    以高水位標記取代固定的 17:00 區間，可以每小時或隨時執行；
+    若中間有漏跑，下次會從上次成功回報的時間點補齊整段空窗。
+    索引本身依目錄 mtime 快照更新，只會進入有變動的資料夾。
+    """
+    conf = get_config()
+    token = conf.get('tele_token')
+    chat_id = conf.get('tele_chat_id')
+    path = BT_PATH
+
+    if not os.path.exists(path):
+        logger.error(f"路徑錯誤：找不到資料夾 {path}")
+        return
+
+    end_time_dt = datetime.now()
+    end_ts = end_time_dt.timestamp()
+
+    with BTIndex(path) as index:
+        last_ts = index.get_state(WATERMARK_KEY)
+        if last_ts is None:
+            # 第一次執行：從 24 小時前開始
+            start_ts = (end_time_dt - timedelta(days=1)).timestamp()
+        else:
+            start_ts = float(last_ts)
+        start_time_dt = datetime.fromtimestamp(start_ts)
+
+        logger.info(
+            f"增量掃描：從 {start_time_dt.strftime('%Y-%m-%d %H:%M')} 到 {end_time_dt.strftime('%Y-%m-%d %H:%M')}")
+        index.refresh()
+        # 下界不含：上次回報的邊界檔案不重複列出
+        rows = [r for r in index.modified_between(start_ts, end_ts, min_size=MIN_REPORT_BYTES) if r[3] > start_ts]
+
+        file_list = format_file_list(rows)
+        if not file_list:
+            logger.info("增量掃描：沒有新增的大檔案")
+            index.set_state(WATERMARK_KEY, end_ts)
+            return
+
+        msg = f"📂 <b>BT 新增檔案清單</b>\n"
+        msg += f"📅 區間：{start_time_dt.strftime('%m/%d %H:%M')} ➔ {end_time_dt.strftime('%m/%d %H:%M')}\n"
+        msg += f"━━━━━━━━━━━━━━━━\n"
+        msg += "\n".join(file_list)
+
+        # 只有成功送出才推進水位，失敗時下次會把這段一起補報
+        if send_report(token, chat_id, msg):
+            index.set_state(WATERMARK_KEY, end_ts)
 
 
 if __name__ == "__main__":
-    scan_bt_daily()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "since":
+        scan_bt_since_last()
+    else:
+        scan_bt_daily()
@@ -1,11 +1,14 @@
 import os
 import sys
-import requests
 import urllib3
-import io
-import sqlite3
 import logging
 
+from bt_index import BTIndex
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+from file_ops import FileOpEngine, OpJournal, plan_deletes, apply_unfinished
+
 # ================= 📝 LOGGING 系統設定 (中文化) =================
 # 設定格式：時間 - 層級 - 訊息 (嚴格禁止 Emoji)
 logging.basicConfig(
@@ -17,7 +20,7 @@ logger = logging.getLogger(__name__)
 
 # ================= 🔤 環境初始化 =================
 # 強制輸出使用 UTF-8 編碼，確保 NAS Log 顯示正常
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+ensure_utf8_stdout()
 # 關閉 SSL 安全警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -27,19 +30,8 @@ DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book
 
 # ================= 📦 資料庫工具 =================
 def get_db_config():
-    """從資料庫讀取系統設定值"""
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        # 開啟 WAL 模式確保並發存取穩定
-        conn.execute("PRAGMA journal_mode=WAL;")
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM config")
-        configs = dict(cursor.fetchall())
-        conn.close()
-        return configs
-    except Exception as e:
-        logger.error(f"資料庫讀取失敗: {e}")
-        return {}
+    """從資料庫讀取系統設定值 (行程內快取，只在設定表變動時重新載入)"""
+    return config_store.get_all(DB_PATH)
 
 
 # ================= 🚀 核心清理邏輯 =================
@@ -48,7 +40,17 @@ def format_size(bytes_size):
     return f"{bytes_size / (1024 * 1024):.2f} MB"
 
 
-def main():
+def send_report(token, chat_id, msg):
+    if telegram_client.send_message(token, chat_id, msg):
+        logger.info("Telegram 清理報告發送成功")
+
+
+def main(mode=None):
+    """mode：
+    None    - 若上次執行中斷，先把剩餘項目做完；之後照常掃描、規劃並執行
+    'plan'  - 只掃描並存下清理計畫，以 Telegram 回報待刪清單
+    'apply' - 執行最近一份尚未完成且未過期的計畫 (不重新掃描)
+    """
     # 1. 取得設定
     configs = get_db_config()
     TELEGRAM_TOKEN = configs.get('tele_token')
@@ -68,38 +70,53 @@ def main():
         logger.error(f"路徑錯誤：找不到目標資料夾 {TARGET_FOLDER}")
         return
 
-    logger.info(f"開始掃描資料夾：{TARGET_FOLDER}")
-    logger.info(f"清理門檻：小於 {SIZE_LIMIT_MB} MB")
-
-    deleted_files = []
-    total_freed_space = 0
-
-    # 遞迴遍歷資料夾
-    for root, dirs, files in os.walk(TARGET_FOLDER):
-        for filename in files:
-            # 排除 NAS 系統檔與暫存檔
-            if filename.startswith('.') or '@eaDir' in root:
-                continue
-
-            full_path = os.path.join(root, filename)
-            try:
-                file_size = os.path.getsize(full_path)
-
-                # 判斷大小是否小於門檻
-                if file_size < limit_bytes:
-                    file_info = f"<code>{filename}</code> ({format_size(file_size)})"
-                    deleted_files.append(file_info)
-                    total_freed_space += file_size
-
-                    # 執行刪除
-                    if not DRY_RUN:
-                        os.remove(full_path)
-                        logger.info(f"已刪除檔案: {filename}")
-                    else:
-                        logger.info(f"預計刪除(模擬): {filename}")
-
-            except Exception as e:
-                logger.error(f"處理檔案時發生錯誤 {filename}: {e}")
+    with BTIndex(TARGET_FOLDER) as index, OpJournal('clean') as journal:
+        engine = FileOpEngine()
+        if mode == 'apply':
+            result = apply_unfinished(journal, engine, ('planned', 'applying'))
+            if result is None:
+                logger.info("沒有待執行的清理計畫 (超過 24 小時的計畫已作廢，請重新規劃)")
+                return
+            index.forget_files(result.done_deletes + result.missing)
+        else:
+            previous = None
+            if mode is None and not DRY_RUN:
+                # 先把上次中斷的計畫做完，再照常掃描規劃這一輪
+                previous = apply_unfinished(journal, engine)
+                if previous:
+                    index.forget_files(previous.done_deletes + previous.missing)
+
+            logger.info(f"開始掃描資料夾：{TARGET_FOLDER}")
+            logger.info(f"清理門檻：小於 {SIZE_LIMIT_MB} MB")
+            index.refresh()
+            # 索引已排除 NAS 系統檔 (@eaDir) 與隱藏檔；先規劃再批次刪除
+            plan = plan_deletes(index.smaller_than(limit_bytes))
+
+            if mode == 'plan':
+                journal.save_plan(plan)
+                total = sum(size for _, size in plan.deletes)
+                msg = f"📝 <b>空間清理計畫 #{journal.plan_id}</b>\n"
+                msg += f"━━━━━━━━━━━━━━━━\n"
+                msg += f"📂 預計刪除：<b>{len(plan.deletes)}</b> 個檔案\n"
+                msg += f"💾 預計釋放：<b>{format_size(total)}</b>\n"
+                msg += f"📉 條件：小於 {SIZE_LIMIT_MB} MB"
+                examples = [f"<code>{os.path.basename(p)}</code> ({format_size(sz)})" for p, sz in plan.deletes[:10]]
+                if examples:
+                    msg += f"\n\n📝 <b>清單範例：</b>\n" + "\n".join(examples)
+                send_report(TELEGRAM_TOKEN, CHAT_ID, msg)
+                return
+
+            if not DRY_RUN:
+                journal.save_plan(plan, status='applying')
+            result = engine.apply(plan, dry_run=DRY_RUN, journal=None if DRY_RUN else journal)
+            if not DRY_RUN:
+                # 索引過期 (檔案已不存在) 的項目一併移除
+                index.forget_files(result.done_deletes + result.missing)
+                journal.set_status('done')
+            result.merge(previous)
+
+    deleted_files = result.done_deletes
+    total_freed_space = result.bytes_done
 
     # --- 發送 Telegram 報告 (訊息內含 Emoji) ---
     if deleted_files:
@@ -109,22 +126,18 @@ def main():
         msg += f"━━━━━━━━━━━━━━━━\n"
         msg += f"📂 清理數量：<b>{len(deleted_files)}</b> 個檔案\n"
         msg += f"💾 釋放空間：<b>{format_size(total_freed_space)}</b>\n"
-        msg += f"📉 條件：小於 {SIZE_LIMIT_MB} MB"
-
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        payload = {'chat_id': CHAT_ID, 'text': msg, 'parse_mode': 'HTML'}
-
-        try:
-            resp = requests.post(url, data=payload, verify=False, timeout=15)
-            if resp.status_code == 200:
-                logger.info("Telegram 清理報告發送成功")
-            else:
-                logger.error(f"Telegram 發送失敗，狀態碼: {resp.status_code}")
-        except Exception as e:
-            logger.error(f"發送 Telegram 通知時發生異常: {e}")
+        msg += f"📉 條件：小於 {SIZE_LIMIT_MB} MB\n"
+        msg += f"⚡ 處理速度：{result.throughput_text()}"
+        if result.failed:
+            msg += f"\n❌ 失敗檔案：{len(result.failed)} 個"
+
+        send_report(TELEGRAM_TOKEN, CHAT_ID, msg)
     else:
         logger.info("掃描完畢：無符合清理條件的檔案")
+        # 不推播，只回傳給 bot 的發問者
+        msg = f"🧹 <b>空間自動清理報告</b>\n掃描完畢：無符合清理條件的檔案 (小於 {SIZE_LIMIT_MB} MB)"
+    return msg
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,132 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 單一指令處理超過此秒數就記一筆警告
+SLOW_HANDLER_SECONDS = 2.0
+
+
+class PrefixTrie:
+    """以字元為節點的前綴樹，查詢時間只與前綴長度有關，與註冊數量無關"""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, prefix, value):
+        node = self.root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[None] = value
+
+    def longest_match(self, text):
+        """回傳符合的最長前綴所對應的值，沒有則 None"""
+        node = self.root
+        found = node.get(None)
+        for ch in text:
+            node = node.get(ch)
+            if node is None:
+                break
+            if None in node:
+                found = node[None]
+        return found
+
+
+class HandlerStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class CommandRouter:
+    """以表格註冊的指令路由
+
+    查詢順序：完全相符 (dict) ➔ 對話狀態 ➔ 完全相符但不打斷對話的指令 ➔ 前綴 (trie)
+    ➔ 關鍵字 (僅作為舊輸入方式的後備)。
+    等待輸入的對話狀態會吃掉下一則文字；只有以 over_state=True (預設) 註冊的指令可以打斷它。
+    handler 簽名皆為 handler(chat_id, text, user_state)。
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.after_state = {}
+        self.states = {}
+        self.prefixes = PrefixTrie()
+        self.keywords = []
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    # ---------- 註冊 ----------
+    def command(self, *texts, over_state=True):
+        """over_state=False：對話狀態等待輸入時，這些文字交給狀態處理而不是執行指令"""
+        table = self.exact if over_state else self.after_state
+
+        def decorator(func):
+            for text in texts:
+                if text in self.exact or text in self.after_state:
+                    raise ValueError(f"指令重複註冊：{text}")
+                table[text] = func
+            return func
+        return decorator
+
+    def state(self, name):
+        def decorator(func):
+            self.states[name] = func
+            return func
+        return decorator
+
+    def prefix(self, text):
+        def decorator(func):
+            self.prefixes.add(text, func)
+            return func
+        return decorator
+
+    def keyword(self, word, func):
+        """訊息中包含 word 即觸發 (線性比對，只在其他方式都找不到時才執行)"""
+        self.keywords.append((word, func))
+
+    # ---------- 派發 ----------
+    def resolve(self, chat_id, text, user_state):
+        handler = self.exact.get(text)
+        if handler:
+            return handler
+        state = user_state.get(chat_id)
+        if state is not None and state in self.states:
+            return self.states[state]
+        handler = self.after_state.get(text) or self.prefixes.longest_match(text)
+        if handler:
+            return handler
+        for word, func in self.keywords:
+            if word in text:
+                return func
+        return None
+
+    def dispatch(self, chat_id, text, user_state):
+        """找到對應 handler 並執行；沒有對應時回傳 False"""
+        handler = self.resolve(chat_id, text, user_state)
+        if handler is None:
+            return False
+        started = time.monotonic()
+        try:
+            handler(chat_id, text, user_state)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._stats_lock:
+                self.stats.setdefault(handler.__name__, HandlerStats()).record(elapsed)
+            if elapsed > SLOW_HANDLER_SECONDS:
+                logger.warning(f"指令處理較慢：{handler.__name__} 耗時 {elapsed:.2f}s")
+        return True
+
+    def timing_report(self, top=5):
+        """依總耗時排序的前幾名：'名稱 次數/平均/最高'"""
+        with self._stats_lock:
+            items = sorted(self.stats.items(), key=lambda kv: kv[1].total, reverse=True)[:top]
+            return "，".join(f"{name} {s.count}次/平均{s.total / s.count:.2f}s/最高{s.max:.2f}s"
+                            for name, s in items)
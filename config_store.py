@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
+
+
+class ConfigStore:
+    """config 表的行程內快取
+
+    - 每個行程只開一條長駐連線 (WAL 只在開啟時設定一次)
+    - 整張 config 表一次載入記憶體
+    - 每次讀取先查 PRAGMA data_version，其他連線有寫入時才重新載入
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._values = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=20, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        return conn
+
+    def _ensure_fresh(self):
+        """呼叫端需持有 _lock"""
+        try:
+            if self._conn is None:
+                self._conn = self._connect()
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._values = dict(self._conn.execute("SELECT key, value FROM config").fetchall())
+                self._data_version = version
+        except sqlite3.Error as e:
+            logger.error(f"資料庫讀取失敗: {e}")
+            # 下次重新連線，不把失敗結果快取起來
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._data_version = None
+            self._values = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._ensure_fresh()
+            return self._values.get(key, default)
+
+    def all(self):
+        with self._lock:
+            self._ensure_fresh()
+            return dict(self._values)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._data_version = None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path=DB_PATH):
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = _stores[db_path] = ConfigStore(db_path)
+        return store
+
+
+def get_config(key, db_path=DB_PATH):
+    return get_store(db_path).get(key)
+
+
+def get_all(db_path=DB_PATH):
+    return get_store(db_path).all()
@@ -0,0 +1,18 @@
+import sys
+import io
+
+
+# ================= 🔤 終端輸出編碼 =================
+def ensure_utf8_stdout():
+    """強制 stdout 使用 UTF-8，確保 NAS Log 不會亂碼
+
+    各腳本可單獨執行，也會被 bot_listener 以模組方式載入，因此會被呼叫很多次：
+    已是 UTF-8 就不動；能就地切換就不換掉物件 (換掉會讓舊的 wrapper 被回收並關閉 stdout)。
+    """
+    stream = sys.stdout
+    if (getattr(stream, 'encoding', None) or '').lower() == 'utf-8':
+        return
+    if hasattr(stream, 'reconfigure'):
+        stream.reconfigure(encoding='utf-8')
+    elif hasattr(stream, 'buffer'):
+        sys.stdout = io.TextIOWrapper(stream.buffer, encoding='utf-8')
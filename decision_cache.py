@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ds_decision_cache.json")
+# 決策沿用時間：超過就重新詢問，避免長期套用過時的判斷
+DEFAULT_TTL_SECONDS = 2 * 3600
+DEFAULT_MAX_ENTRIES = 64
+# 分桶大小：進度每 10% 一格，速度以 KB/s 分級
+PROGRESS_BUCKET = 10
+SPEED_BUCKETS_KB = (0, 50, 200, 1000, 5000)
+
+
+def _speed_bucket(speed_kb):
+    bucket = 0
+    for i, limit in enumerate(SPEED_BUCKETS_KB):
+        if speed_kb > limit:
+            bucket = i + 1
+    return bucket
+
+
+def fingerprint(summaries, *extra):
+    """任務集合的特徵值：id、狀態與分桶後的進度/速度；小幅波動不會改變結果"""
+    items = sorted(
+        (s['id'], s['status'], int(s['progress_pct'] // PROGRESS_BUCKET), _speed_bucket(s['speed_kb']))
+        for s in summaries)
+    raw = json.dumps([items, list(extra)], ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class DecisionCache:
+    """以任務特徵值快取 Gemini 決策
+
+    - TTL 內同樣的任務狀態直接沿用上次的決策
+    - 超過 max_entries 時淘汰最久未使用的項目 (LRU)
+    - 存成 JSON 檔，排程每次重新啟動也能沿用
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"決策快取讀取失敗，重新建立: {e}")
+            return
+        now = time.time()
+        # 檔案內依使用時間由舊到新排列
+        for key, entry in data:
+            if now - entry['created'] < self.ttl:
+                self._entries[key] = entry
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self._entries.items()), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"決策快取寫入失敗: {e}")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry['created'] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry['decisions']
+
+    def put(self, key, decisions):
+        with self._lock:
+            self._entries[key] = {'created': time.time(), 'decisions': decisions}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
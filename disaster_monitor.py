@@ -1,13 +1,15 @@
 import requests
-import sqlite3
 import os
 import logging
 import sys
-import io
 import urllib3
 import json
 from datetime import datetime
 
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+
 # ================= 🔧 環境路徑修正 =================
 # 確保 NAS 能找到使用者目錄下的 geopy 套件
 nas_local_path = "/volume1/homes/holiness/.local/lib/python3.8/site-packages"
@@ -30,7 +32,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+ensure_utf8_stdout()
 
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
 # 使用縣市級 API
@@ -38,29 +40,14 @@ CWA_API_URL = "https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001"
 
 
 def get_config(key):
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM config WHERE key = ?", (key,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
-    except Exception as e:
-        logger.error(f"資料庫讀取失敗: {e}")
-        return None
+    # 共用設定快取：同一行程內不會為每個鍵重開連線
+    return config_store.get_config(key, DB_PATH)
 
 
 def send_alert(message):
     token = get_config('tele_token')
     chat_id = get_config('tele_chat_id')
-    if not token or not chat_id:
-        return
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {'chat_id': chat_id, 'text': message, 'parse_mode': 'HTML'}
-    try:
-        requests.post(url, data=payload, timeout=15, verify=False)
-    except Exception as e:
-        logger.error(f"Telegram 發送異常: {e}")
+    telegram_client.send_message(token, chat_id, message)
 
 
 # ================= 📍 地理位置處理邏輯 (升級為縣市級) =================
@@ -146,6 +133,8 @@ def monitor_weather_forecast(input_param=None):
         msg += f"🕒 報告時間：{now.strftime('%H:%M')}"
 
         send_alert(msg)
+        # 回傳報告內容，讓 bot_listener 可以轉給其他發問者或作為短期快取
+        return msg
     except Exception as e:
         logger.error(f"氣象抓取異常: {e}")
 
@@ -0,0 +1,177 @@
+import os
+import re
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ds_admission.json")
+
+# 同時下載數的上下限 (DS120j：512MB RAM、單顆硬碟)
+MIN_ACTIVE = 1
+MAX_ACTIVE = 6
+# 壓力門檻：可用記憶體比例低於此值、或硬碟忙碌比例高於此值就降載
+LOW_MEM_RATIO = 0.15
+HIGH_DISK_BUSY = 0.85
+# 增加名額的門檻 (比降載門檻寬鬆一段距離，形成遲滯區間避免來回跳動)
+HEADROOM_MEM_RATIO = 0.30
+HEADROOM_DISK_BUSY = 0.50
+# 總下載速度已接近頻寬上限時，多開任務也不會更快 (bytes/s)
+BANDWIDTH_CAP = 8 * 1024 * 1024
+HEADROOM_BANDWIDTH_RATIO = 0.7
+# 連續幾次取樣都符合條件才調整
+LOWER_AFTER = 2
+RAISE_AFTER = 3
+
+_DISK_RE = re.compile(r'^(sd[a-z]+|sata\d+|nvme\d+n\d+|md\d+)$')
+
+
+# ================= 📄 /proc 解析 (吃文字，方便用錄下的快照測試) =================
+def parse_meminfo(text):
+    """回傳 {欄位: kB}"""
+    values = {}
+    for line in text.splitlines():
+        key, _, rest = line.partition(':')
+        parts = rest.split()
+        if parts:
+            try:
+                values[key.strip()] = int(parts[0])
+            except ValueError:
+                pass
+    return values
+
+
+def mem_available_ratio(meminfo):
+    total = meminfo.get('MemTotal')
+    if not total:
+        return None
+    available = meminfo.get('MemAvailable')
+    if available is None:
+        # 舊核心沒有 MemAvailable
+        available = meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)
+    return available / total
+
+
+def parse_diskstats(text):
+    """回傳 {裝置: io_ticks 毫秒}，只包含整顆硬碟 (不含分割區)
+
+    第 13 欄 (io_ticks) 是裝置有 I/O 在處理的累計毫秒數。
+    """
+    ticks = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 13 and _DISK_RE.match(parts[2]):
+            ticks[parts[2]] = int(parts[12])
+    return ticks
+
+
+def disk_busy_ratio(prev_ticks, prev_ts, ticks, ts):
+    """兩次取樣間最忙碌的硬碟忙碌比例 (0~1)；沒有前一次取樣時回傳 None
+
+    重開機後計數器歸零，差值為負時視為 0。
+    """
+    elapsed_ms = (ts - prev_ts) * 1000 if prev_ts else 0
+    if not prev_ticks or elapsed_ms <= 0:
+        return None
+    busy = [max(ticks[dev] - prev_ticks[dev], 0) / elapsed_ms for dev in ticks if dev in prev_ticks]
+    return min(max(busy), 1.0) if busy else None
+
+
+def total_download_speed(tasks):
+    return sum(int(t.get('additional', {}).get('transfer', {}).get('speed_download', 0))
+               for t in tasks if t.get('status') == 'downloading')
+
+
+# ================= 🚦 准入控制 =================
+class AdmissionController:
+    """依記憶體、硬碟忙碌度與總下載速度動態調整同時下載數
+
+    降載與增加使用不同門檻，並需連續多次取樣符合才調整，避免在門檻附近來回跳動。
+    """
+
+    def __init__(self, limit, min_active=MIN_ACTIVE, max_active=MAX_ACTIVE):
+        self.limit = limit
+        self.min_active = min_active
+        self.max_active = max_active
+        self.pressure_count = 0
+        self.headroom_count = 0
+        self.prev_ticks = {}
+        self.prev_ts = None
+        self.path = STATE_FILE
+
+    def evaluate(self, mem_ratio, disk_busy, total_speed):
+        """以一組指標更新並回傳目前的上限；指標為 None 代表無法取得，視為不影響"""
+        pressure = ((mem_ratio is not None and mem_ratio < LOW_MEM_RATIO)
+                    or (disk_busy is not None and disk_busy > HIGH_DISK_BUSY))
+        headroom = (mem_ratio is not None and mem_ratio > HEADROOM_MEM_RATIO
+                    and (disk_busy is None or disk_busy < HEADROOM_DISK_BUSY)
+                    and total_speed < BANDWIDTH_CAP * HEADROOM_BANDWIDTH_RATIO)
+
+        self.pressure_count = self.pressure_count + 1 if pressure else 0
+        self.headroom_count = self.headroom_count + 1 if headroom and not pressure else 0
+
+        if self.pressure_count >= LOWER_AFTER and self.limit > self.min_active:
+            self.limit -= 1
+            self.pressure_count = 0
+            logger.info(f"🚦 系統壓力偏高 (記憶體 {_pct(mem_ratio)}，硬碟 {_pct(disk_busy)})，同時下載降為 {self.limit}")
+        elif self.headroom_count >= RAISE_AFTER and self.limit < self.max_active:
+            self.limit += 1
+            self.headroom_count = 0
+            logger.info(f"🚦 系統有餘裕 (記憶體 {_pct(mem_ratio)}，硬碟 {_pct(disk_busy)})，同時下載增為 {self.limit}")
+        return self.limit
+
+    def update(self, meminfo_text, diskstats_text, tasks, ts=None):
+        """以 /proc 文字與任務清單取樣一次"""
+        ts = ts or time.time()
+        mem_ratio = mem_available_ratio(parse_meminfo(meminfo_text)) if meminfo_text else None
+        ticks = parse_diskstats(diskstats_text) if diskstats_text else {}
+        disk_busy = disk_busy_ratio(self.prev_ticks, self.prev_ts, ticks, ts)
+        self.prev_ticks, self.prev_ts = ticks, ts
+        return self.evaluate(mem_ratio, disk_busy, total_download_speed(tasks))
+
+    def sample(self, tasks, proc_root='/proc'):
+        """讀取本機 /proc 取樣；讀不到 (非 Linux) 時維持目前上限"""
+        return self.update(_read(os.path.join(proc_root, 'meminfo')),
+                           _read(os.path.join(proc_root, 'diskstats')), tasks)
+
+    # ---------- 存檔 (cron 模式每次重新啟動也能延續計數與上次取樣) ----------
+    def to_dict(self):
+        return {'limit': self.limit, 'pressure_count': self.pressure_count,
+                'headroom_count': self.headroom_count, 'prev_ticks': self.prev_ticks, 'prev_ts': self.prev_ts}
+
+    @classmethod
+    def load(cls, default_limit, path=STATE_FILE):
+        controller = cls(default_limit)
+        controller.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return controller
+        controller.limit = min(max(int(data.get('limit', default_limit)), controller.min_active),
+                               controller.max_active)
+        controller.pressure_count = data.get('pressure_count', 0)
+        controller.headroom_count = data.get('headroom_count', 0)
+        controller.prev_ticks = data.get('prev_ticks') or {}
+        controller.prev_ts = data.get('prev_ts')
+        return controller
+
+    def save(self, path=None):
+        try:
+            with open(path or self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f)
+        except OSError as e:
+            logger.warning(f"准入控制狀態存檔失敗: {e}")
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _pct(ratio):
+    return "—" if ratio is None else f"{ratio * 100:.0f}%"
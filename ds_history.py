@@ -0,0 +1,206 @@
+import os
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ds_history.db")
+
+# 保留幾天的快照
+HISTORY_DAYS = 7
+# 平均速度的計算視窗
+SPEED_WINDOW_SECONDS = 3600
+# 下載中但超過這麼久沒有新增任何位元組，視為卡住
+STALL_SECONDS = 30 * 60
+# 累計「等待/下載中仍為 0 位元組」的時間時，兩次快照間隔最多算這麼久
+# (排程停掉或 NAS 關機的空檔不算在任務頭上)
+MAX_SNAPSHOT_GAP_SECONDS = 2 * 3600
+
+# 狀態以整數存放，快照表只有數值欄位
+STATUS_CODES = {'waiting': 1, 'downloading': 2, 'paused': 3, 'finishing': 4, 'finished': 5,
+                'hash_checking': 6, 'seeding': 7, 'filehosting_waiting': 8, 'extracting': 9, 'error': 10}
+STATUS_NAMES = {v: k for k, v in STATUS_CODES.items()}
+
+
+class TaskHistory:
+    """Download Station 任務快照的時間序列
+
+    每次輪詢整批寫入一次；平均速度、ETA 與卡住判斷都以 SQL 彙總一次算完，
+    不必把整段歷史載入記憶體逐筆計算。
+    """
+
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.conn = sqlite3.connect(db_path, timeout=20)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ds_tasks (
+                task_key INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT UNIQUE NOT NULL,
+                title TEXT
+            );
+            CREATE TABLE IF NOT EXISTS ds_task_snapshots (
+                ts INTEGER NOT NULL,
+                task_key INTEGER NOT NULL,
+                status INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                downloaded INTEGER NOT NULL,
+                speed INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_ds_snap_task_ts ON ds_task_snapshots (task_key, ts);
+            CREATE INDEX IF NOT EXISTS idx_ds_snap_ts ON ds_task_snapshots (ts);
+        """)
+        self.conn.commit()
+        self._keys = dict(self.conn.execute("SELECT task_id, task_key FROM ds_tasks"))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _task_keys(self, tasks):
+        new = [(t['id'], t.get('title')) for t in tasks if t['id'] not in self._keys]
+        if new:
+            self.conn.executemany("INSERT OR IGNORE INTO ds_tasks (task_id, title) VALUES (?, ?)", new)
+            placeholders = ",".join("?" * len(new))
+            self._keys.update(self.conn.execute(
+                f"SELECT task_id, task_key FROM ds_tasks WHERE task_id IN ({placeholders})",
+                [task_id for task_id, _ in new]))
+        return self._keys
+
+    def record(self, tasks, ts=None):
+        """寫入一輪快照 (單一交易)；順便清除過期資料"""
+        ts = int(ts or time.time())
+        keys = self._task_keys(tasks)
+        rows = []
+        for t in tasks:
+            transfer = t.get('additional', {}).get('transfer', {})
+            rows.append((ts, keys[t['id']], STATUS_CODES.get(t['status'], 0), int(t['size']),
+                         int(transfer.get('size_downloaded', 0)), int(transfer.get('speed_download', 0))))
+        self.conn.executemany(
+            "INSERT INTO ds_task_snapshots (ts, task_key, status, size, downloaded, speed) VALUES (?, ?, ?, ?, ?, ?)",
+            rows)
+        self.conn.execute("DELETE FROM ds_task_snapshots WHERE ts < ?", (ts - HISTORY_DAYS * 86400,))
+        self.conn.commit()
+
+    def stats(self, now=None, window=SPEED_WINDOW_SECONDS):
+        """{task_id: {...}}，只包含最近一輪快照中仍存在的任務
+
+        avg_speed 為視窗內實際下載量 / 經過時間 (bytes/s)，樣本不足時退回瞬間速度；
+        eta 為剩餘秒數 (無速度時為 None)；stalled 為下載中卻長時間沒有進度；
+        zero_seconds 為任務處於等待/下載中 (不含暫停) 且仍為 0 位元組的累計秒數，死種判定用。
+        """
+        now = int(now or time.time())
+        latest_ts = self.conn.execute("SELECT MAX(ts) FROM ds_task_snapshots").fetchone()[0]
+        if latest_ts is None:
+            return {}
+        since = now - window
+
+        latest = self.conn.execute("""
+            SELECT t.task_id, t.title, s.task_key, s.status, s.size, s.downloaded, s.speed
+            FROM ds_task_snapshots s JOIN ds_tasks t ON t.task_key = s.task_key
+            WHERE s.ts = ?""", (latest_ts,)).fetchall()
+        windowed = {row[0]: row[1:] for row in self.conn.execute("""
+            SELECT task_key, MIN(ts), MAX(ts), MIN(downloaded), MAX(downloaded)
+            FROM ds_task_snapshots WHERE ts >= ? GROUP BY task_key""", (since,))}
+        # 每個任務第一次達到目前下載量的時間 = 最後一次有進度的時間
+        last_progress = dict(self.conn.execute("""
+            SELECT s.task_key, MIN(s.ts)
+            FROM ds_task_snapshots s
+            JOIN (SELECT task_key, MAX(downloaded) AS d FROM ds_task_snapshots GROUP BY task_key) m
+              ON s.task_key = m.task_key AND s.downloaded = m.d
+            GROUP BY s.task_key"""))
+        first_seen = dict(self.conn.execute(
+            "SELECT task_key, MIN(ts) FROM ds_task_snapshots GROUP BY task_key"))
+        # 每筆 0 位元組且在等待/下載中的快照，算到下一筆快照為止 (依 (task_key, ts) 索引查下一筆)
+        zero_seconds = dict(self.conn.execute("""
+            SELECT s.task_key, SUM(MIN(COALESCE(
+                (SELECT MIN(n.ts) FROM ds_task_snapshots n WHERE n.task_key = s.task_key AND n.ts > s.ts),
+                s.ts) - s.ts, ?))
+            FROM ds_task_snapshots s
+            WHERE s.downloaded = 0 AND s.status IN (?, ?)
+            GROUP BY s.task_key""",
+            (MAX_SNAPSHOT_GAP_SECONDS, STATUS_CODES['waiting'], STATUS_CODES['downloading'])))
+
+        result = {}
+        for task_id, title, key, status, size, downloaded, speed in latest:
+            avg_speed = float(speed)
+            if key in windowed:
+                t0, t1, d0, d1 = windowed[key]
+                if t1 > t0:
+                    avg_speed = (d1 - d0) / (t1 - t0)
+            remaining = max(size - downloaded, 0)
+            status_name = STATUS_NAMES.get(status, 'unknown')
+            stalled_since = last_progress.get(key, first_seen.get(key, latest_ts))
+            result[task_id] = {
+                'title': title,
+                'status': status_name,
+                'size': size,
+                'downloaded': downloaded,
+                'avg_speed': avg_speed,
+                'eta': remaining / avg_speed if avg_speed > 0 and size > 0 else None,
+                'stalled': (status_name == 'downloading' and remaining > 0
+                            and latest_ts - stalled_since >= STALL_SECONDS
+                            and latest_ts - first_seen.get(key, latest_ts) >= STALL_SECONDS),
+                'zero_seconds': zero_seconds.get(key, 0) if downloaded == 0 else 0,
+            }
+        return result
+
+    def latest_titles(self):
+        """最近一輪快照的 (時間, {任務標題: 狀態})；沒有紀錄時時間為 None
+
+        Download Station 以任務標題作為下載目的地底下的檔名或資料夾名稱，bt_watcher 據此判斷檔案是否下載完成。
+        """
+        latest_ts = self.conn.execute("SELECT MAX(ts) FROM ds_task_snapshots").fetchone()[0]
+        if latest_ts is None:
+            return None, {}
+        rows = self.conn.execute("""
+            SELECT t.title, s.status FROM ds_task_snapshots s JOIN ds_tasks t ON t.task_key = s.task_key
+            WHERE s.ts = ?""", (latest_ts,))
+        return latest_ts, {title: STATUS_NAMES.get(status, 'unknown') for title, status in rows if title}
+
+
+# ================= 📊 報告 =================
+def _format_eta(seconds):
+    if seconds is None:
+        return "—"
+    if seconds >= 86400:
+        return f"{seconds / 86400:.1f} 天"
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} 小時"
+    return f"{seconds / 60:.0f} 分"
+
+
+def format_report(stats, limit=10):
+    """給 bot 的「下載統計」訊息"""
+    if not stats:
+        return "📥 目前沒有下載紀錄。"
+    active = [s for s in stats.values() if s['status'] in ('downloading', 'waiting')]
+    total_speed = sum(s['avg_speed'] for s in active)
+    stalled = [s for s in stats.values() if s['stalled']]
+
+    msg = "📥 <b>下載統計</b>\n"
+    msg += "━━━━━━━━━━━━━━━━\n"
+    msg += f"📦 任務：{len(stats)} 個 (下載中 {len(active)} 個)\n"
+    msg += f"🚀 平均總速度：<b>{total_speed / 1024:.0f} KB/s</b>\n"
+    if stalled:
+        msg += f"🐢 卡住：{len(stalled)} 個\n"
+
+    ordered = sorted(stats.values(), key=lambda s: (s['status'] != 'downloading', -s['avg_speed']))
+    for s in ordered[:limit]:
+        progress = s['downloaded'] / s['size'] * 100 if s['size'] else 0
+        flag = "🐢" if s['stalled'] else ("⬇️" if s['status'] == 'downloading' else "⏸️")
+        msg += (f"\n{flag} <code>{(s['title'] or '')[:40]}</code>\n"
+                f"   {progress:.1f}% | {s['avg_speed'] / 1024:.0f} KB/s | 剩餘 {_format_eta(s['eta'])}")
+    return msg
+
+
+def download_report(db_path=HISTORY_DB_PATH):
+    if not os.path.exists(db_path):
+        return "📥 尚未有下載紀錄 (ds_manager 執行後才會產生)。"
+    with TaskHistory(db_path) as history:
+        return format_report(history.stats())
@@ -1,22 +1,45 @@
-import sqlite3
 import os
+import sys
 import json
+import sqlite3
 import requests
 import logging
 import time
+import textwrap
 import urllib3
 from datetime import datetime
 
+import config_store
+import ds_rules
+from decision_cache import DecisionCache, fingerprint
+from gemini_client import GeminiClient, compact_records
+from ds_history import TaskHistory
+from ds_admission import AdmissionController
+
 # ================= 設定區 =================
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # DS120j 記憶體保護限制：同時只允許幾個任務下載？
+# (初始值；實際上限由 ds_admission 依記憶體、硬碟與頻寬動態調整)
 MAX_ACTIVE_DOWNLOADS = 3
 
 # 死種判定：0MB 的任務如果超過幾小時沒動靜就刪除？
 DEAD_MAGNET_TIMEOUT_HOURS = 3
 
 SAFE_SIZE_THRESHOLD = 104857600
+# 批次動作的送出順序：先刪除與暫停騰出名額，再恢復下載
+ACTION_ORDER = ('delete', 'pause', 'resume')
+
+# SID 快取：DSM 閒置逾時預設 15 分鐘，排程間隔內可直接沿用
+SID_TTL_SECONDS = 15 * 60
+# 需要重新登入的錯誤碼：權限不足、逾時、被其他登入踢出、找不到 SID
+AUTH_ERROR_CODES = (105, 106, 107, 119)
+
+# 常駐模式的輪詢間隔：有任務在下載時較密，閒置時逐步拉長
+ACTIVE_POLL_SECONDS = 60
+IDLE_POLL_MAX_SECONDS = 15 * 60
+# 即使快照沒變也定期完整排程一次 (死種判定依賴時間經過)
+FULL_RESCHEDULE_SECONDS = 30 * 60
 DB_NAME = "account_book.db"
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_FILE = os.path.join(CURRENT_DIR, 'ds_pilot.log')
@@ -33,26 +56,88 @@ logger = logging.getLogger()
 
 
 class SynologyAIPilot:
-    def __init__(self):
+    def __init__(self, offline=False, state_dir=CURRENT_DIR):
+        # state_dir：設定資料庫與各種快取/歷史檔所在的資料夾 (測試時可指向暫存資料夾)
+        self.db_path = os.path.join(state_dir, DB_NAME)
         self.config = self._load_config()
         self.sid = None
+        # 所有 DSM 呼叫共用同一條 keep-alive 連線
+        self.session = requests.Session()
+        self.session.verify = False
         self.base_url = self.config.get('dsm_url', 'http://192.168.50.191:5000')
         self.gemini_key = self.config.get('gemini_api_key')
+        # 離線模式：完全不呼叫 Gemini，規則無法判斷的任務維持原狀
+        self.offline = offline or self.config.get('ds_offline_mode') == '1'
+        self.decision_cache = DecisionCache(os.path.join(state_dir, "ds_decision_cache.json"))
+        self.gemini = GeminiClient(self.gemini_key, state_file=os.path.join(state_dir, "gemini_state.json"))
+        # 常駐模式記住上次送出的動作，避免 DSM 狀態尚未更新時重複送出
+        self.last_actions = {}
+        self.history = TaskHistory(os.path.join(state_dir, "ds_history.db"))
+        self.admission = AdmissionController.load(MAX_ACTIVE_DOWNLOADS, os.path.join(state_dir, "ds_admission.json"))
 
     def _load_config(self):
-        db_path = os.path.join(CURRENT_DIR, DB_NAME)
+        db_path = self.db_path
         if not os.path.exists(db_path):
             logger.error("❌ 找不到資料庫")
             return {}
-        conn = sqlite3.connect(db_path)
+        return config_store.get_all(db_path)
+
+    # ---------- SID 快取 ----------
+    def _sid_key(self):
+        return f"{self.base_url}|{self.config.get('dsm_user')}"
+
+    def _load_cached_sid(self):
+        if not os.path.exists(self.db_path): return None
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT key, value FROM config")
-            return {key: value for key, value in cursor.fetchall()}
-        finally:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("CREATE TABLE IF NOT EXISTS dsm_session (key TEXT PRIMARY KEY, sid TEXT, expires REAL)")
+            row = conn.execute("SELECT sid, expires FROM dsm_session WHERE key = ?", (self._sid_key(),)).fetchone()
             conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"讀取 SID 快取失敗: {e}")
+            return None
+        if row and row[1] > time.time():
+            return row[0]
+        return None
+
+    def _save_sid(self, sid):
+        if not os.path.exists(self.db_path): return
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("CREATE TABLE IF NOT EXISTS dsm_session (key TEXT PRIMARY KEY, sid TEXT, expires REAL)")
+            if sid:
+                conn.execute("INSERT OR REPLACE INTO dsm_session (key, sid, expires) VALUES (?, ?, ?)",
+                             (self._sid_key(), sid, time.time() + SID_TTL_SECONDS))
+            else:
+                conn.execute("DELETE FROM dsm_session WHERE key = ?", (self._sid_key(),))
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"寫入 SID 快取失敗: {e}")
+
+    def _sid_is_valid(self, sid):
+        """以最輕量的 Download Station 查詢確認 SID 仍有效"""
+        try:
+            resp = self.session.get(
+                f"{self.base_url}/webapi/DownloadStation/info.cgi",
+                params={'api': 'SYNO.DownloadStation.Info', 'version': '1', 'method': 'getinfo', '_sid': sid},
+                timeout=10)
+            return bool(resp.json().get('success'))
+        except Exception as e:
+            logger.warning(f"SID 驗證失敗: {e}")
+            return False
+
+    def login(self, force=False):
+        """優先沿用快取的 SID，只有快取失效或 force=True 時才完整登入"""
+        if not force:
+            sid = self._load_cached_sid()
+            if sid and self._sid_is_valid(sid):
+                self.sid = sid
+                # 每次成功使用都延長快取期限 (DSM 端的閒置計時也同步重置)
+                self._save_sid(sid)
+                logger.info("♻️ 沿用既有 DSM 連線")
+                return True
 
-    def login(self):
         api_path = "/webapi/auth.cgi"
         params = {
             'api': 'SYNO.API.Auth', 'version': '3', 'method': 'login',
@@ -61,9 +146,10 @@ class SynologyAIPilot:
             'session': 'DownloadStation', 'format': 'cookie'
         }
         try:
-            resp = requests.get(f"{self.base_url}{api_path}", params=params, timeout=30, verify=False)
+            resp = self.session.get(f"{self.base_url}{api_path}", params=params, timeout=30)
             if resp.json().get('success'):
                 self.sid = resp.json()['data']['sid']
+                self._save_sid(self.sid)
                 return True
             logger.error(f"登入失敗: {resp.text}")
             return False
@@ -71,73 +157,83 @@ class SynologyAIPilot:
             logger.error(f"連線錯誤: {e}")
             return False
 
+    def _call(self, http_method, params, timeout):
+        """呼叫 task.cgi；遇到 SID 失效的錯誤碼時重新登入並重送一次"""
+        url = f"{self.base_url}/webapi/DownloadStation/task.cgi"
+        for attempt in range(2):
+            params = dict(params, _sid=self.sid)
+            if http_method == 'post':
+                resp = self.session.post(url, data=params, timeout=timeout)
+            else:
+                resp = self.session.get(url, params=params, timeout=timeout)
+            body = resp.json()
+            code = (body.get('error') or {}).get('code')
+            if body.get('success') or code not in AUTH_ERROR_CODES or attempt == 1:
+                return resp, body
+            logger.warning(f"DSM 連線已失效 (錯誤碼 {code})，重新登入")
+            self._save_sid(None)
+            if not self.login(force=True):
+                return resp, body
+        return resp, body
+
     def get_tasks(self):
         if not self.sid: return []
         try:
-            resp = requests.get(
-                f"{self.base_url}/webapi/DownloadStation/task.cgi",
-                params={'api': 'SYNO.DownloadStation.Task', 'version': '1', 'method': 'list',
-                        'additional': 'detail,transfer', '_sid': self.sid},
-                timeout=30,
-                verify=False
-            )
-            return resp.json()['data']['tasks'] if resp.json().get('success') else []
+            _, body = self._call('get', {'api': 'SYNO.DownloadStation.Task', 'version': '1', 'method': 'list',
+                                         'additional': 'detail,transfer'}, timeout=30)
+            return body['data']['tasks'] if body.get('success') else []
         except Exception as e:
             logger.error(f"獲取任務錯誤: {e}")
             return []
 
     def execute_action(self, task_id, action, reason):
-        api_path = "/webapi/DownloadStation/task.cgi"
-        method = action
-        params = {}
+        return self.execute_actions({action: [(task_id, reason)]}).get(task_id) == 0
 
-        if action == "delete":
-            params = {'force_complete': 'false'}
+    def execute_actions(self, batches):
+        """batches: {action: [(task_id, reason), ...]}
 
-        # 組合參數
-        final_params = {
-            'api': 'SYNO.DownloadStation.Task', 'version': '1',
-            'method': method, 'id': task_id, '_sid': self.sid
-        }
-        final_params.update(params)
+        DSM 的 pause/resume/delete 接受以逗號分隔的多個 id，每種動作只送一次請求。
+        回傳 {task_id: 錯誤碼}，0 代表成功；整批請求失敗時該批任務皆為 None。
+        """
+        results = {}
+        for action in sorted(batches, key=lambda a: ACTION_ORDER.index(a) if a in ACTION_ORDER else len(ACTION_ORDER)):
+            items = batches[action]
+            if not items: continue
+            reasons = dict(items)
+            data = {
+                'api': 'SYNO.DownloadStation.Task', 'version': '1',
+                'method': action, 'id': ",".join(reasons)
+            }
+            if action == "delete":
+                data['force_complete'] = 'false'
 
-        try:
-            resp = requests.get(f"{self.base_url}{api_path}", params=final_params, timeout=10, verify=False)
-            if resp.json().get('success'):
-                logger.info(f"✨ 執行 [{action.upper()}]: {reason}")
-            else:
+            try:
+                # id 清單可能很長，用 POST 表單避免網址過長
+                resp, body = self._call('post', data, timeout=10)
+            except Exception as e:
+                logger.warning(f"⚠️ 失敗 [{action}] {len(reasons)} 個任務: {e}")
+                results.update({task_id: None for task_id in reasons})
+                continue
+
+            if not body.get('success'):
                 logger.warning(f"⚠️ 失敗 [{action}]: {resp.text}")
-        except:
-            pass
-
-    def ask_gemini_for_decision(self, tasks):
-        if not self.gemini_key or not tasks: return None
-
-        # 1. 整理數據，加入「存在時間」計算
-        current_ts = time.time()
-        task_summary = []
-
-        for t in tasks:
-            size_mb = int(t['size']) / 1048576
-            downloaded = float(t['additional']['transfer']['size_downloaded'])
-            speed = t['additional']['transfer']['speed_download']
-
-            # 計算加入多久了 (小時)
-            create_time = t['additional']['detail']['create_time']
-            age_hours = round((current_ts - create_time) / 3600, 1)
-
-            # 計算進度
-            progress = (downloaded / int(t['size']) * 100) if int(t['size']) > 0 else 0
-
-            task_summary.append({
-                "id": t['id'],
-                "name": t['title'],
-                "size_mb": round(size_mb, 1),
-                "status": t['status'],  # waiting, downloading, paused, error
-                "speed_kb": round(speed / 1024, 1),
-                "progress_pct": round(progress, 1),
-                "age_hours": age_hours  # 這很重要，讓 AI 知道它卡多久了
-            })
+                results.update({task_id: None for task_id in reasons})
+                continue
+
+            # 每個任務各自的結果：[{"id": "...", "error": 0}, ...]
+            per_task = {item.get('id'): item.get('error', 0) for item in body.get('data') or []}
+            for task_id, reason in reasons.items():
+                error = per_task.get(task_id, 0)
+                results[task_id] = error
+                if error == 0:
+                    logger.info(f"✨ 執行 [{action.upper()}]: {reason}")
+                else:
+                    logger.warning(f"⚠️ 失敗 [{action}] {task_id}: 錯誤碼 {error}")
+        return results
+
+    def ask_gemini_for_decision(self, task_summary, max_active=MAX_ACTIVE_DOWNLOADS):
+        """task_summary 為 ds_rules.summarize_task 的結果；max_active 為尚可分配的下載名額"""
+        if not self.gemini_key or not task_summary: return None
 
         # 2. 進階版 Prompt：交通指揮官模式
         prompt = f"""
@@ -145,17 +241,17 @@ class SynologyAIPilot:
         你的目標是：最大化下載效率，並清除無效任務。
 
         【環境限制】：
-        1. **同時下載上限**：只能有 **{MAX_ACTIVE_DOWNLOADS}** 個任務處於 "downloading" 或 "waiting" 狀態。其他的必須 "pause"。
+        1. **同時下載上限**：只能有 **{max_active}** 個任務處於 "downloading" 或 "waiting" 狀態。其他的必須 "pause"。
         2. **死種判定**：如果檔案大小為 0MB (或進度 0%) 且存在時間超過 {DEAD_MAGNET_TIMEOUT_HOURS} 小時，代表是死種，必須 "delete"。
 
         【決策邏輯】：
         1. **DELETE**: 針對死種 (0MB + age > {DEAD_MAGNET_TIMEOUT_HOURS}h) 或廣告檔。
-        2. **RESUME**: 從剩下的任務中，選出 **最有希望完成的前 {MAX_ACTIVE_DOWNLOADS} 名** (依據速度、進度、或是否快完成了)。
+        2. **RESUME**: 從剩下的任務中，選出 **最有希望完成的前 {max_active} 名** (依據速度、進度、或是否快完成了)。
         3. **PAUSE**: 所有沒被選上 RESUME 的任務，通通設為 PAUSE，以釋放資源。
         4. **KEEP**: 如果任務已經是理想狀態 (例如該暫停的已經暫停了)，就回傳 keep。
 
-        【目前任務列表】：
-        {json.dumps(task_summary, ensure_ascii=False)}
+        【目前任務列表】(cols 為欄位名稱，rows 每列一個任務)：
+        {compact_records(task_summary)}
 
         請回傳 JSON 格式 (不要 Markdown)：
         [
@@ -165,22 +261,88 @@ class SynologyAIPilot:
         ]
         """
 
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-flash-latest:generateContent?key={self.gemini_key}"
+        # 去掉縮排空白，任務多時 prompt 也不會無謂膨脹
+        text = self.gemini.generate(textwrap.dedent(prompt).strip())
+        if not text:
+            return None
+        text = text.replace("```json", "").replace("```", "").strip()
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            logger.warning(f"AI 回應不是合法 JSON: {e}")
+            return None
 
-        for attempt in range(2):  # 簡單重試
-            try:
-                response = requests.post(
-                    url, headers={'Content-Type': 'application/json'},
-                    json={"contents": [{"parts": [{"text": prompt}]}]}, timeout=60
-                )
-                if response.status_code == 200:
-                    text = response.json()['candidates'][0]['content']['parts'][0]['text']
-                    text = text.replace("```json", "").replace("```", "").strip()
-                    return json.loads(text)
-                time.sleep(5)
-            except:
+    def record_history(self, tasks):
+        try:
+            self.history.record(tasks)
+        except sqlite3.Error as e:
+            logger.warning(f"任務歷史寫入失敗: {e}")
+
+    def update_admission(self, tasks):
+        """依目前系統負載更新同時下載上限"""
+        limit = self.admission.sample(tasks)
+        self.admission.save()
+        return limit
+
+    def _apply_history(self, summaries, now):
+        """以歷史平均速度取代單次瞬間速度，並標記卡住的任務"""
+        try:
+            stats = self.history.stats(now)
+        except sqlite3.Error as e:
+            logger.warning(f"任務歷史讀取失敗: {e}")
+            return
+        for s in summaries:
+            h = stats.get(s['id'])
+            if h:
+                s['speed_kb'] = round(h['avg_speed'] / 1024, 1)
+                s['stalled'] = h['stalled']
+                s['zero_hours'] = round(h['zero_seconds'] / 3600, 1)
+
+    def decide(self, tasks):
+        """先用本地規則決定 (微秒等級)，只有規則無法判斷的任務才詢問 Gemini"""
+        started = time.perf_counter()
+        now = time.time()
+        summaries = [ds_rules.summarize_task(t, now) for t in tasks]
+        self._apply_history(summaries, now)
+        max_active = self.admission.limit
+        # 大檔不刪：先排除在死種判定之外，讓它照常參與恢復/暫停與名額計算
+        protected = {t['id'] for t in tasks if int(t['size']) > SAFE_SIZE_THRESHOLD}
+        decisions, unclassified = ds_rules.plan_decisions(summaries, max_active, DEAD_MAGNET_TIMEOUT_HOURS,
+                                                          protected)
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        logger.info(f"📏 規則決策 {len(decisions)} 個任務 ({elapsed_us:.0f} µs)，待判斷 {len(unclassified)} 個")
+
+        if not unclassified:
+            return decisions
+        if self.offline:
+            logger.info("📴 離線模式：無法分類的任務維持原狀")
+            return decisions
+
+        slots = ds_rules.free_slots(decisions, max_active)
+        # 任務狀態跟上次差不多時直接沿用，不必再花一次配額與等待時間
+        cache_key = fingerprint(unclassified, slots)
+        ai_decisions = self.decision_cache.get(cache_key)
+        if ai_decisions is not None:
+            logger.info("🗂️ 任務狀態未明顯變化，沿用快取的 AI 決策")
+        else:
+            ai_decisions = self.ask_gemini_for_decision(unclassified, max_active=slots)
+            if not ai_decisions:
+                logger.warning("❌ 無法取得 AI 決策，無法分類的任務維持原狀。")
+                return decisions
+            self.decision_cache.put(cache_key, ai_decisions)
+
+        allowed = {s['id'] for s in unclassified}
+        for d in ai_decisions:
+            if d.get('id') not in allowed:
                 continue
-        return None
+            # 同時下載上限由規則掌控，AI 不能超額恢復
+            if d.get('action') == 'resume':
+                if slots <= 0:
+                    d = dict(d, action='pause', reason="已達同時下載上限")
+                else:
+                    slots -= 1
+            decisions.append(d)
+        return decisions
 
     def run(self):
         logger.info(">>> AI 調度員啟動 (流量管制模式) <<<")
@@ -190,12 +352,18 @@ class SynologyAIPilot:
         if not tasks:
             logger.info("💤 無任務。")
             return
+        self.record_history(tasks)
+        self.update_admission(tasks)
+        self.schedule(tasks)
 
+    def schedule(self, tasks, changed=None):
+        """依決策批次送出動作；changed 為本輪有變化的任務 id (常駐模式)，None 代表全部重新套用"""
         task_map = {t['id']: t for t in tasks}
-        decisions = self.ask_gemini_for_decision(tasks)
+        decisions = self.decide(tasks)
 
         if decisions:
-            logger.info("🤖 AI 決策執行中...")
+            logger.info("🤖 決策執行中...")
+            batches = {action: [] for action in ACTION_ORDER}
             for decision in decisions:
                 task_id = decision['id']
                 action = decision.get('action')
@@ -204,6 +372,10 @@ class SynologyAIPilot:
                 original_task = task_map.get(task_id)
                 if not original_task: continue
 
+                # 0. 增量套用：任務沒變化且上次已送出相同動作，就不再重送
+                if changed is not None and task_id not in changed and self.last_actions.get(task_id) == action:
+                    continue
+
                 # === 安全檢查 ===
                 original_size = int(original_task['size'])
                 current_status = original_task['status']
@@ -214,29 +386,82 @@ class SynologyAIPilot:
                         logger.warning(f"⛔ [攔截刪除] 保留大檔: {original_task['title']}")
                         continue
                     else:
-                        self.execute_action(task_id, action, reason)
+                        batches[action].append((task_id, reason))
 
                 # 2. 狀態優化 (如果已經是 pause 就不用再發送 pause 指令，節省 API 呼叫)
                 elif action == 'pause':
                     if current_status == 'paused':
                         logger.info(f"維持暫停: {original_task['title']}")
                     else:
-                        self.execute_action(task_id, action, reason)
+                        batches[action].append((task_id, reason))
 
                 # 3. 狀態優化 (如果已經是 downloading 就不用再 resume)
                 elif action == 'resume':
                     if current_status in ['downloading', 'seeding', 'extracting']:
                         logger.info(f"維持下載: {original_task['title']}")
                     else:
-                        self.execute_action(task_id, action, reason)
+                        batches[action].append((task_id, reason))
 
                 else:
-                    logger.info(f"AI 建議維持: {original_task['title']}")
-
-            logger.info("✅ 調度完成。")
+                    logger.info(f"建議維持: {original_task['title']}")
+
+            # 每種動作只送一次請求
+            results = self.execute_actions(batches)
+            for action, items in batches.items():
+                for task_id, _ in items:
+                    if results.get(task_id) == 0:
+                        self.last_actions[task_id] = action
+            failed = sum(1 for error in results.values() if error != 0)
+            logger.info(f"✅ 調度完成。(送出 {len(results)} 個動作，失敗 {failed} 個)")
         else:
-            logger.warning("❌ 無法取得 AI 決策。")
+            logger.warning("❌ 沒有可執行的決策。")
+
+    def run_daemon(self):
+        """常駐模式：連線與狀態留在記憶體，依下載活動調整輪詢間隔，只在任務有變化時重新排程"""
+        logger.info(">>> AI 調度員常駐模式啟動 <<<")
+        snapshot = {}
+        last_full = 0
+        interval = ACTIVE_POLL_SECONDS
+        while True:
+            try:
+                if not self.sid and not self.login():
+                    time.sleep(interval)
+                    interval = min(interval * 2, IDLE_POLL_MAX_SECONDS)
+                    continue
+
+                tasks = self.get_tasks()
+                if tasks:
+                    self.record_history(tasks)
+                    # 上限改變時即使任務沒變化也要重新排程
+                    previous_limit = self.admission.limit
+                    if self.update_admission(tasks) != previous_limit:
+                        last_full = 0
+                now = time.time()
+                new_snapshot = {t['id']: ds_rules.task_state(ds_rules.summarize_task(t, now)) for t in tasks}
+                changed = ds_rules.diff_snapshots(snapshot, new_snapshot)
+                snapshot = new_snapshot
+                self.last_actions = {tid: a for tid, a in self.last_actions.items() if tid in snapshot}
+
+                if tasks and (changed or now - last_full > FULL_RESCHEDULE_SECONDS):
+                    full = now - last_full > FULL_RESCHEDULE_SECONDS
+                    logger.info(f"🔄 {len(changed)} 個任務有變化，{'完整' if full else '增量'}排程")
+                    self.schedule(tasks, changed=None if full else changed)
+                    if full:
+                        last_full = now
+
+                active = any(t['status'] in ('downloading', 'waiting') for t in tasks)
+                if changed or active:
+                    interval = ACTIVE_POLL_SECONDS
+                else:
+                    interval = min(interval * 2, IDLE_POLL_MAX_SECONDS)
+            except Exception as e:
+                logger.error(f"常駐模式異常: {e}")
+            time.sleep(interval)
 
 
 if __name__ == "__main__":
-    SynologyAIPilot().run()
\ No newline at end of file
+    pilot = SynologyAIPilot(offline='--offline' in sys.argv)
+    if '--daemon' in sys.argv:
+        pilot.run_daemon()
+    else:
+        pilot.run()
\ No newline at end of file
@@ -0,0 +1,100 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 可以參與排程 (恢復/暫停) 的狀態
+SCHEDULABLE_STATUSES = ('waiting', 'downloading', 'paused')
+# 已完成或系統處理中的狀態，一律維持原狀
+SETTLED_STATUSES = ('finished', 'seeding', 'finishing', 'extracting', 'hash_checking', 'filehosting_waiting')
+
+
+def summarize_task(t, now=None):
+    """把 DSM 任務整理成排程用的精簡資料 (也是送給 Gemini 的格式)"""
+    now = now or time.time()
+    size = int(t['size'])
+    transfer = t.get('additional', {}).get('transfer', {})
+    detail = t.get('additional', {}).get('detail', {})
+    downloaded = int(transfer.get('size_downloaded', 0))
+    speed = float(transfer.get('speed_download', 0))
+    create_time = detail.get('create_time') or now
+    progress = (downloaded / size * 100) if size > 0 else 0
+
+    return {
+        "id": t['id'],
+        "name": t['title'],
+        "size_mb": round(size / 1048576, 1),
+        "downloaded": downloaded,
+        "status": t['status'],  # waiting, downloading, paused, error
+        "speed_kb": round(speed / 1024, 1),
+        "progress_pct": round(progress, 1),
+        "age_hours": round((now - create_time) / 3600, 1)  # 讓排程知道它卡多久了
+    }
+
+
+def is_dead(summary, dead_hours):
+    """死種：一個位元組都還沒下載，且實際在等待/下載中 (不含暫停) 的時間超過 dead_hours 小時
+
+    zero_hours 由 ds_history 的快照累計 (見 TaskHistory.stats 的 zero_seconds)；
+    沒有歷史紀錄時不判定為死種。暫停中的任務是排程讓出名額，不是死種。
+    """
+    if summary['downloaded'] > 0 or summary['status'] == 'paused' or summary['status'] in SETTLED_STATUSES:
+        return False
+    return summary.get('zero_hours', 0) > dead_hours
+
+
+def score_task(summary):
+    """越有希望完成分數越高：進度為主，速度次之，放太久的稍微扣分；長時間沒進度的大幅扣分"""
+    return (summary['progress_pct']
+            + min(summary['speed_kb'] / 10, 50)
+            - min(summary['age_hours'], 72) * 0.2
+            - (50 if summary.get('stalled') else 0))
+
+
+def plan_decisions(summaries, max_active, dead_hours, protected=()):
+    """依固定規則產生決策
+
+    protected：不可刪除的任務 id (大檔)，即使符合死種條件也照常參與排程
+    回傳 (decisions, unclassified)：
+    - decisions 與 Gemini 回傳格式相同 [{"id", "action", "reason"}, ...]
+    - unclassified 為規則無法判斷的任務 (例如 error 但仍有進度)，可再交給 Gemini
+    """
+    decisions = []
+    unclassified = []
+    candidates = []
+    for s in summaries:
+        if is_dead(s, dead_hours) and s['id'] not in protected:
+            decisions.append({"id": s['id'], "action": "delete",
+                              "reason": f"死種：等待/下載 {s['zero_hours']} 小時仍為 0 位元組"})
+        elif s['status'] in SETTLED_STATUSES:
+            decisions.append({"id": s['id'], "action": "keep", "reason": f"狀態為 {s['status']}"})
+        elif s['status'] in SCHEDULABLE_STATUSES:
+            candidates.append(s)
+        else:
+            unclassified.append(s)
+
+    # 同分時以 id 排序，讓每次結果一致
+    candidates.sort(key=lambda s: (-score_task(s), s['id']))
+    for rank, s in enumerate(candidates):
+        if rank < max_active:
+            decisions.append({"id": s['id'], "action": "resume",
+                              "reason": f"優先度第 {rank + 1} 名 (進度 {s['progress_pct']}%，{s['speed_kb']} KB/s)"})
+        else:
+            decisions.append({"id": s['id'], "action": "pause", "reason": "資源禮讓給高優先級任務"})
+    return decisions, unclassified
+
+
+def free_slots(decisions, max_active):
+    return max(0, max_active - sum(1 for d in decisions if d.get('action') == 'resume'))
+
+
+def task_state(summary):
+    """快照比對用的狀態：狀態、進度每 10% 一格、是否有在傳輸"""
+    return summary['status'], int(summary['progress_pct'] // 10), summary['speed_kb'] > 0
+
+
+def diff_snapshots(old, new):
+    """old/new 為 {task_id: task_state}；回傳新增、移除或狀態改變的任務 id"""
+    changed = {tid for tid, state in new.items() if old.get(tid) != state}
+    changed.update(tid for tid in old if tid not in new)
+    return changed
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from console import ensure_utf8_stdout
+
+# ================= 📝 LOGGING 系統設定 =================
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+# ================= 🔤 環境初始化 =================
+ensure_utf8_stdout()
+
+FAKE_PORT = 5055
+DEFAULT_TASKS = 200
+# 每個請求的模擬延遲 (毫秒)，DS120j 實測 list 約數百毫秒
+DEFAULT_LATENCY_MS = 50
+BENCH_SIZES = (100, 1000, 5000)
+
+# DSM 錯誤碼
+ERR_NO_SUCH_TASK = 544
+ERR_SID_NOT_FOUND = 119
+ERR_UNKNOWN_METHOD = 103
+
+
+class FakeDSM:
+    """本機模擬 DSM 的 auth.cgi 與 Download Station task.cgi / info.cgi
+
+    - 產生指定數量的假任務 (固定亂數種子，結果可重現)
+    - 每個請求可加上延遲，模擬 NAS 的回應時間
+    - 記錄各 API 方法的呼叫次數，方便比較批次化前後的請求數
+    """
+
+    def __init__(self, task_count=DEFAULT_TASKS, latency_ms=DEFAULT_LATENCY_MS, seed=42):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.sids = set()
+        self._lock = threading.Lock()
+        self.tasks = self._make_tasks(task_count, random.Random(seed))
+
+    @staticmethod
+    def _make_tasks(count, rng):
+        now = time.time()
+        tasks = {}
+        for i in range(count):
+            task_id = f"dbid_{i + 1}"
+            size = rng.choice([0, rng.randint(50, 800) * 1048576, rng.randint(1, 40) * 1073741824])
+            status = rng.choice(['downloading', 'waiting', 'paused', 'paused', 'finished', 'seeding', 'error'])
+            downloaded = int(size * rng.random()) if status != 'finished' else size
+            speed = rng.randint(0, 2000) * 1024 if status == 'downloading' else 0
+            tasks[task_id] = {
+                "id": task_id, "title": f"synthetic.task.{i + 1:05d}.mkv", "type": "bt",
+                "username": "admin", "size": size, "status": status,
+                "additional": {
+                    "detail": {"create_time": int(now - rng.randint(0, 72 * 3600))},
+                    "transfer": {"size_downloaded": downloaded, "speed_download": speed,
+                                 "size_uploaded": 0, "speed_upload": 0}
+                }
+            }
+        return tasks
+
+    # ---------- API ----------
+    def handle(self, path, params):
+        time.sleep(self.latency)
+        method = params.get('method', '')
+        with self._lock:
+            self.calls[f"{os.path.basename(path)}:{method}"] += 1
+            if path.endswith('auth.cgi'):
+                return self._auth(method)
+            if params.get('_sid') not in self.sids:
+                return {"success": False, "error": {"code": ERR_SID_NOT_FOUND}}
+            if path.endswith('info.cgi'):
+                return {"success": True, "data": {"version": 3, "is_manager": True}}
+            if path.endswith('task.cgi'):
+                return self._task(method, params)
+        return {"success": False, "error": {"code": ERR_UNKNOWN_METHOD}}
+
+    def _auth(self, method):
+        if method == 'login':
+            sid = f"fake-sid-{len(self.sids) + 1}"
+            self.sids.add(sid)
+            return {"success": True, "data": {"sid": sid}}
+        return {"success": True}
+
+    def _task(self, method, params):
+        if method == 'list':
+            tasks = list(self.tasks.values())
+            return {"success": True, "data": {"offset": 0, "total": len(tasks), "tasks": tasks}}
+        if method not in ('pause', 'resume', 'delete'):
+            return {"success": False, "error": {"code": ERR_UNKNOWN_METHOD}}
+        results = []
+        for task_id in params.get('id', '').split(','):
+            task = self.tasks.get(task_id)
+            if task is None:
+                results.append({"id": task_id, "error": ERR_NO_SUCH_TASK})
+                continue
+            if method == 'delete':
+                del self.tasks[task_id]
+            else:
+                task['status'] = 'paused' if method == 'pause' else 'waiting'
+            results.append({"id": task_id, "error": 0})
+        return {"success": True, "data": results}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def _dispatch(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length', 0))
+            if length:
+                params.update({k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()})
+            body = json.dumps(fake.handle(url.path, params)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(fake, port=FAKE_PORT):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ================= ⏱️ 效能測試 =================
+def _timed(stats, name, func):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats[name] += time.perf_counter() - started
+    return wrapper
+
+
+def seed_config(state_dir, port):
+    """在暫存資料夾建立只有 config 表的 account_book.db，讓 SynologyAIPilot 連到假 DSM"""
+    conn = sqlite3.connect(os.path.join(state_dir, "account_book.db"))
+    conn.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", [
+        ('dsm_url', f"http://127.0.0.1:{port}"),
+        ('dsm_user', 'bench'),
+        ('dsm_pass', 'bench'),
+        ('ds_offline_mode', '1'),
+    ])
+    conn.commit()
+    conn.close()
+
+
+def bench_run(task_count, latency_ms=DEFAULT_LATENCY_MS, port=FAKE_PORT):
+    """對指定數量的假任務跑一次 SynologyAIPilot.run()，回傳各階段耗時與請求數"""
+    from ds_manager import SynologyAIPilot
+
+    fake = FakeDSM(task_count, latency_ms)
+    server = start_server(fake, port)
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            seed_config(state_dir, port)
+            # 離線模式：只量測本地決策與 DSM 往返，不呼叫 Gemini
+            pilot = SynologyAIPilot(offline=True, state_dir=state_dir)
+            stats = Counter()
+            for name in ('login', 'get_tasks', 'record_history', 'update_admission', 'decide', 'execute_actions'):
+                setattr(pilot, name, _timed(stats, name, getattr(pilot, name)))
+            started = time.perf_counter()
+            pilot.run()
+            stats['total'] = time.perf_counter() - started
+            pilot.history.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return stats, fake.calls
+
+
+def run_benchmark(sizes=BENCH_SIZES, latency_ms=DEFAULT_LATENCY_MS):
+    # 每個任務都會記一行決策日誌，測試時只保留警告以上，避免輸出淹沒結果
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"📊 SynologyAIPilot.run() 效能測試 (每個請求延遲 {latency_ms} ms)")
+    for n in sizes:
+        stats, calls = bench_run(n, latency_ms)
+        phases = "，".join(f"{k} {v * 1000:.0f}ms" for k, v in stats.items() if k != 'total')
+        print(f"\n🔹 任務數 {n}：總耗時 {stats['total'] * 1000:.0f} ms")
+        print(f"   {phases}")
+        print(f"   DSM 請求 {sum(calls.values())} 次：" + "，".join(f"{k}×{v}" for k, v in sorted(calls.items())))
+
+
+if __name__ == "__main__":
+    # 用法：fake_dsm.py serve [任務數] [延遲ms]   -> 常駐假 DSM (dsm_url 設為 http://127.0.0.1:5055)
+    #       fake_dsm.py bench [延遲ms] [任務數...] -> 效能測試
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if mode == 'serve':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_TASKS
+        latency = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_LATENCY_MS
+        start_server(FakeDSM(count, latency))
+        logger.info(f"假 DSM 已啟動：http://127.0.0.1:{FAKE_PORT} ({count} 個任務，延遲 {latency} ms)")
+        while True:
+            time.sleep(3600)
+    else:
+        latency = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LATENCY_MS
+        sizes = [int(x) for x in sys.argv[3:]] or BENCH_SIZES
+        run_benchmark(sizes, latency)
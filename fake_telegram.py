@@ -0,0 +1,213 @@
+import sys
+import json
+import time
+import logging
+import threading
+import requests
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from console import ensure_utf8_stdout
+
+# ================= 📝 LOGGING 系統設定 =================
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+# ================= 🔤 環境初始化 =================
+ensure_utf8_stdout()
+
+# 假 Telegram 監聽埠；bot_listener 需以 TELEGRAM_API_BASE=http://127.0.0.1:8081 啟動
+FAKE_PORT = 8081
+DEFAULT_WEBHOOK_URL = 'http://127.0.0.1:8088/'
+# 未提供錄製檔時產生的測試訊息數量與聊天室數
+SYNTHETIC_UPDATES = 200
+SYNTHETIC_CHATS = 20
+# 最後一則回覆後等待多久沒有新回覆就結束統計
+IDLE_SECONDS = 10
+
+
+class FakeTelegram:
+    """本機模擬 Telegram Bot API，比較 getUpdates 輪詢與 webhook 兩種模式
+
+    - poll 模式：update 放進佇列，由 bot_listener 的 getUpdates 長輪詢取走
+    - webhook 模式：update 直接 POST 到 bot_listener 的 webhook 伺服器
+    - 兩種模式都記錄 sendMessage，以「送出 update → 該聊天室收到第一則回覆」計算延遲
+    建議使用單一回覆的指令 (例如 /start、氣象查詢)，避免真的觸發耗時的工作。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.updates = []
+        self.sent_at = {}       # chat_id -> deque[送出時間]
+        self.latencies = []
+        self.replies = 0
+        self.last_reply = None
+
+    # ---------- Bot API ----------
+    def get_updates(self, offset, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                result = [u for u in self.updates if u["update_id"] >= offset]
+                remaining = deadline - time.time()
+                if result or remaining <= 0:
+                    # 已確認 (offset 之前) 的 update 不再保留
+                    self.updates = result
+                    return result
+                self._cond.wait(remaining)
+
+    def record_reply(self, chat_id):
+        now = time.time()
+        with self._cond:
+            self.replies += 1
+            self.last_reply = now
+            pending = self.sent_at.get(chat_id)
+            if pending:
+                self.latencies.append(now - pending.popleft())
+
+    # ---------- 注入 update ----------
+    def mark_sent(self, update):
+        chat_id = str(update["message"]["chat"]["id"])
+        with self._cond:
+            self.sent_at.setdefault(chat_id, deque()).append(time.time())
+
+    def enqueue(self, update):
+        self.mark_sent(update)
+        with self._cond:
+            self.updates.append(update)
+            self._cond.notify_all()
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def _params(self):
+            query = urlparse(self.path).query
+            params = {k: v[0] for k, v in parse_qs(query).items()}
+            length = int(self.headers.get('Content-Length', 0))
+            if length:
+                body = self.rfile.read(length).decode('utf-8')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params.update(json.loads(body))
+                else:
+                    params.update({k: v[0] for k, v in parse_qs(body).items()})
+            return params
+
+        def _reply(self, result):
+            body = json.dumps({"ok": True, "result": result}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def _dispatch(self):
+            method = urlparse(self.path).path.rsplit('/', 1)[-1]
+            params = self._params()
+            if method == 'getUpdates':
+                offset = int(params.get('offset') or 0)
+                timeout = float(params.get('timeout') or 0)
+                self._reply(fake.get_updates(offset, timeout))
+            elif method == 'sendMessage':
+                fake.record_reply(str(params.get('chat_id')))
+                self._reply({"message_id": fake.replies})
+            else:
+                self._reply(True)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# ================= 📼 測試資料 =================
+def load_updates(path):
+    """錄製檔：每行一個 update JSON；缺少 update_id 時依序補上"""
+    updates = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                updates.append(json.loads(line))
+    for i, update in enumerate(updates, start=1):
+        update.setdefault("update_id", i)
+    return updates
+
+
+def synthetic_updates(count=SYNTHETIC_UPDATES, chats=SYNTHETIC_CHATS):
+    return [{"update_id": i + 1,
+             "message": {"message_id": i + 1, "chat": {"id": 1000 + i % chats}, "text": "/start"}}
+            for i in range(count)]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# ================= 🚀 主流程 =================
+def run_benchmark(mode, updates, webhook_url=DEFAULT_WEBHOOK_URL, secret=''):
+    fake = FakeTelegram()
+    server = ThreadingHTTPServer(('127.0.0.1', FAKE_PORT), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"假 Telegram 已啟動：http://127.0.0.1:{FAKE_PORT} (模式：{mode}，{len(updates)} 則 update)")
+
+    started = time.time()
+    if mode == 'webhook':
+        session = requests.Session()
+        # 需與 bot_listener 的 tele_webhook_secret 相同，否則會被拒絕
+        session.headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+        for update in updates:
+            fake.mark_sent(update)
+            try:
+                session.post(webhook_url, json=update, timeout=10)
+            except requests.RequestException as e:
+                logger.error(f"Webhook 推送失敗: {e}")
+                server.shutdown()
+                return
+    else:
+        for update in updates:
+            fake.enqueue(update)
+    logger.info(f"注入完成，耗時 {time.time() - started:.2f}s，等待回覆中...")
+
+    while True:
+        time.sleep(1)
+        with fake._cond:
+            answered = len(fake.latencies)
+            last_reply = fake.last_reply
+        if answered >= len(updates):
+            break
+        if time.time() - (last_reply or started) > IDLE_SECONDS:
+            logger.warning(f"超過 {IDLE_SECONDS} 秒沒有新回覆，提前結束")
+            break
+    server.shutdown()
+
+    elapsed = (fake.last_reply or time.time()) - started
+    latencies = fake.latencies
+    print(f"📊 模式：{mode}")
+    print(f"   已回覆：{len(latencies)}/{len(updates)} 則 (sendMessage 共 {fake.replies} 次)")
+    if latencies and elapsed > 0:
+        print(f"   吞吐量：{len(latencies) / elapsed:.1f} 則/秒")
+        print(f"   延遲 p50：{percentile(latencies, 50) * 1000:.0f} ms，"
+              f"p95：{percentile(latencies, 95) * 1000:.0f} ms，"
+              f"最大：{max(latencies) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    # 用法：fake_telegram.py poll|webhook [錄製檔.jsonl] [webhook 網址] [webhook secret]
+    bench_mode = sys.argv[1] if len(sys.argv) > 1 else 'poll'
+    data = load_updates(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] else synthetic_updates()
+    url = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_WEBHOOK_URL
+    run_benchmark(bench_mode, data, url, sys.argv[4] if len(sys.argv) > 4 else '')
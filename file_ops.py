@@ -0,0 +1,350 @@
+import os
+import time
+import errno
+import shutil
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bt_index import INDEX_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# 跨裝置複製時同時進行的檔案數 (DS120j 單顆硬碟，太多反而互搶磁頭)
+DEFAULT_COPY_WORKERS = 2
+# 執行紀錄每累積幾筆提交一次 (操作本身可重複執行，當機時最多重做這麼多筆)
+JOURNAL_FLUSH_EVERY = 200
+# 只規劃未執行的計畫超過這個時間即作廢 (檔案狀態可能早已不同，需重新規劃)
+PLAN_MAX_AGE_SECONDS = 24 * 3600
+
+
+# ================= 📋 操作計畫 =================
+class FileOpPlan:
+    """先規劃所有搬移與刪除，衝突在記憶體中以目標檔名集合判斷"""
+
+    def __init__(self):
+        self.moves = []     # [(src, dst, size), ...]
+        self.deletes = []   # [(path, size), ...]
+        self.skipped = []   # [(path, 原因), ...]
+
+    def __len__(self):
+        return len(self.moves) + len(self.deletes)
+
+
+def plan_flatten(files, root, existing_names):
+    """把子資料夾內的檔案搬到根目錄
+
+    files: [(src, dir, name, size), ...] (BTIndex.files_in_subdirs 的格式)
+    existing_names: 根目錄目前已有的名稱 (一次 os.listdir 取得)
+    """
+    plan = FileOpPlan()
+    taken = set(existing_names)
+    for src, _, name, size in files:
+        # 處理同名衝突：目的地已存在或已被本次計畫佔用，則略過
+        if name in taken:
+            plan.skipped.append((src, "目的地已有同名檔案"))
+            continue
+        taken.add(name)
+        plan.moves.append((src, os.path.join(root, name), size))
+    return plan
+
+
+def plan_deletes(files):
+    """files: [(path, name, size), ...] (BTIndex.smaller_than 的格式)"""
+    plan = FileOpPlan()
+    for path, _, size in files:
+        plan.deletes.append((path, size))
+    return plan
+
+
+# ================= 🚀 執行引擎 =================
+class FileOpResult:
+    def __init__(self):
+        self.done_moves = []     # [(src, dst), ...]
+        self.done_deletes = []   # [path, ...]
+        self.missing = []        # 執行時已不存在的檔案
+        self.failed = []         # [(path, 錯誤訊息), ...]
+        self.bytes_done = 0
+        self.elapsed = 0.0
+
+    @property
+    def files_done(self):
+        return len(self.done_moves) + len(self.done_deletes)
+
+    @property
+    def files_per_sec(self):
+        return self.files_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def mb_per_sec(self):
+        return self.bytes_done / (1024 * 1024) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def throughput_text(self):
+        return f"{self.files_per_sec:.1f} 檔/秒，{self.mb_per_sec:.1f} MB/s"
+
+    def merge(self, other):
+        """把另一次執行 (例如先續跑的中斷計畫) 的結果併入報告"""
+        if other is None:
+            return self
+        self.done_moves += other.done_moves
+        self.done_deletes += other.done_deletes
+        self.missing += other.missing
+        self.failed += other.failed
+        self.bytes_done += other.bytes_done
+        self.elapsed += other.elapsed
+        return self
+
+
+class FileOpEngine:
+    """批次執行檔案計畫
+
+    - 刪除與同檔案系統搬移直接走 os.remove / os.rename (只改目錄項，不搬資料)
+    - 遇到 EXDEV (跨裝置) 的搬移才交給小型 thread pool 複製，並限制同時數量
+    """
+
+    def __init__(self, copy_workers=DEFAULT_COPY_WORKERS):
+        self.copy_workers = copy_workers
+        self._lock = threading.Lock()
+
+    def apply(self, plan, dry_run=False, journal=None, verify=False):
+        """執行計畫
+
+        每個檔案在刪除/搬移前都會重新確認：要刪除的檔案大小必須與規劃時相同
+        (索引可能過期，檔案在規劃後也可能繼續寫入)，搬移的目的地必須不存在。
+
+        journal: OpJournal，逐筆記錄完成狀態，中斷後可從未完成的項目續跑
+        verify: 執行舊計畫 (續跑) 時，來源已不在但目的地存在的搬移視為上次已完成
+        """
+        result = FileOpResult()
+        started = time.time()
+        try:
+            self._apply_deletes(plan, result, dry_run, journal, verify)
+            self._apply_moves(plan, result, dry_run, journal, verify)
+        finally:
+            if journal:
+                journal.flush()
+
+        result.elapsed = time.time() - started
+        logger.info(f"檔案操作完成：{result.files_done} 個，失敗 {len(result.failed)} 個，"
+                    f"耗時 {result.elapsed:.2f}s ({result.throughput_text()})")
+        return result
+
+    def _apply_deletes(self, plan, result, dry_run, journal, verify):
+        for path, size in plan.deletes:
+            if dry_run:
+                logger.info(f"預計刪除(模擬): {os.path.basename(path)}")
+                result.done_deletes.append(path)
+                result.bytes_done += size
+                continue
+            try:
+                if os.stat(path).st_size != size:
+                    result.failed.append((path, "檔案大小已變動"))
+                    _record(journal, path, 'failed', "檔案大小已變動")
+                    logger.warning(f"略過刪除：{os.path.basename(path)} 大小已與規劃時不同")
+                    continue
+                os.remove(path)
+                result.done_deletes.append(path)
+                result.bytes_done += size
+                _record(journal, path, 'done')
+                logger.info(f"已刪除檔案: {os.path.basename(path)}")
+            except FileNotFoundError:
+                result.missing.append(path)
+                _record(journal, path, 'missing')
+            except OSError as e:
+                result.failed.append((path, str(e)))
+                _record(journal, path, 'failed', str(e))
+                logger.error(f"刪除失敗：{os.path.basename(path)}，原因：{e}")
+
+    def _apply_moves(self, plan, result, dry_run, journal, verify):
+        cross_device = []
+        for src, dst, size in plan.moves:
+            if dry_run:
+                logger.info(f"模擬搬移：{src} -> {dst}")
+                result.done_moves.append((src, dst))
+                result.bytes_done += size
+                continue
+            # os.rename 會直接覆蓋目的地，每次都要重新確認
+            if os.path.lexists(dst):
+                if verify and not os.path.lexists(src):
+                    # 上次中斷前已搬移完成，只是尚未寫入紀錄
+                    result.done_moves.append((src, dst))
+                    _record(journal, src, 'done')
+                else:
+                    result.failed.append((src, "目的地已有同名檔案"))
+                    _record(journal, src, 'failed', "目的地已有同名檔案")
+                continue
+            try:
+                os.rename(src, dst)
+                result.done_moves.append((src, dst))
+                result.bytes_done += size
+                _record(journal, src, 'done')
+                logger.info(f"執行搬移：{os.path.basename(src)}")
+            except FileNotFoundError:
+                result.missing.append(src)
+                _record(journal, src, 'missing')
+            except OSError as e:
+                if e.errno == errno.EXDEV:
+                    cross_device.append((src, dst, size))
+                else:
+                    result.failed.append((src, str(e)))
+                    _record(journal, src, 'failed', str(e))
+                    logger.error(f"搬移失敗：{os.path.basename(src)}，原因：{e}")
+
+        if cross_device:
+            logger.info(f"跨裝置搬移 {len(cross_device)} 個檔案 (同時 {self.copy_workers} 個)")
+            with ThreadPoolExecutor(max_workers=self.copy_workers) as pool:
+                # 執行紀錄只在主執行緒寫入
+                for src, status, error in pool.map(lambda item: self._copy_move(item, result), cross_device):
+                    _record(journal, src, status, error)
+
+    def _copy_move(self, item, result):
+        src, dst, size = item
+        try:
+            # 排隊等待複製期間目的地可能已出現
+            if os.path.lexists(dst):
+                with self._lock:
+                    result.failed.append((src, "目的地已有同名檔案"))
+                return src, 'failed', "目的地已有同名檔案"
+            shutil.move(src, dst)
+        except FileNotFoundError:
+            with self._lock:
+                result.missing.append(src)
+            return src, 'missing', None
+        except Exception as e:
+            with self._lock:
+                result.failed.append((src, str(e)))
+            logger.error(f"搬移失敗：{os.path.basename(src)}，原因：{e}")
+            return src, 'failed', str(e)
+        with self._lock:
+            result.done_moves.append((src, dst))
+            result.bytes_done += size
+        logger.info(f"執行搬移 (跨裝置)：{os.path.basename(src)}")
+        return src, 'done', None
+
+
+def _record(journal, src, status, error=None):
+    if journal:
+        journal.record(src, status, error)
+
+
+def apply_unfinished(journal, engine=None, statuses=('applying',)):
+    """執行最近一份尚未完成的計畫剩餘項目 (預設只續跑上次執行中斷的計畫)；沒有則回傳 None
+
+    來源已不在但目的地存在的搬移視為已完成，重複呼叫不會重做任何操作。
+    """
+    plan = journal.open_unfinished(statuses)
+    if plan is None:
+        return None
+    logger.info(f"執行未完成的計畫 #{journal.plan_id}：剩餘 {len(plan)} 筆")
+    journal.set_status('applying')
+    result = (engine or FileOpEngine()).apply(plan, journal=journal, verify=True)
+    journal.set_status('done')
+    return result
+
+
+# ================= 📒 可續跑的執行紀錄 =================
+class OpJournal:
+    """把操作計畫存進 bt_index.db，執行時逐筆標記完成狀態
+
+    plan 模式只產生計畫 (可先用 Telegram 檢視)，apply 模式再執行；
+    中途當機時，下一次執行只會處理仍是 pending 的項目，不需重新掃描。
+    只規劃未執行的計畫超過 PLAN_MAX_AGE_SECONDS 即作廢，不會被 apply 執行。
+    """
+
+    def __init__(self, kind, db_path=INDEX_DB_PATH):
+        self.kind = kind
+        self.conn = sqlite3.connect(db_path, timeout=20)
+        self.plan_id = None
+        self._buffer = []
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bt_op_plans (
+                plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                created REAL NOT NULL,
+                status TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bt_op_entries (
+                plan_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                op TEXT NOT NULL,
+                src TEXT NOT NULL,
+                dst TEXT,
+                size INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                PRIMARY KEY (plan_id, src)
+            );
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def save_plan(self, plan, status='planned'):
+        """寫入新計畫；同類型尚未執行完的舊計畫一律作廢"""
+        cur = self.conn.cursor()
+        cur.execute("UPDATE bt_op_plans SET status = 'superseded' WHERE kind = ? AND status IN ('planned', 'applying')",
+                    (self.kind,))
+        cur.execute("INSERT INTO bt_op_plans (kind, created, status) VALUES (?, ?, ?)",
+                    (self.kind, time.time(), status))
+        self.plan_id = cur.lastrowid
+        rows = [(self.plan_id, i, 'delete', path, None, size) for i, (path, size) in enumerate(plan.deletes)]
+        offset = len(rows)
+        rows += [(self.plan_id, offset + i, 'move', src, dst, size) for i, (src, dst, size) in enumerate(plan.moves)]
+        cur.executemany("INSERT INTO bt_op_entries (plan_id, seq, op, src, dst, size) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        return self.plan_id
+
+    def open_unfinished(self, statuses=('planned', 'applying')):
+        """載入最近一份尚未完成的計畫，只包含 pending 項目；沒有則回傳 None"""
+        # 執行到一半中斷的計畫照常續跑；過舊的待執行計畫先作廢
+        self.conn.execute("UPDATE bt_op_plans SET status = 'expired' WHERE kind = ? AND status = 'planned' AND created < ?",
+                          (self.kind, time.time() - PLAN_MAX_AGE_SECONDS))
+        self.conn.commit()
+        marks = ",".join("?" * len(statuses))
+        row = self.conn.execute(
+            f"SELECT plan_id FROM bt_op_plans WHERE kind = ? AND status IN ({marks}) ORDER BY plan_id DESC LIMIT 1",
+            (self.kind, *statuses)).fetchone()
+        if not row:
+            return None
+        self.plan_id = row[0]
+        plan = FileOpPlan()
+        for op, src, dst, size in self.conn.execute(
+                "SELECT op, src, dst, size FROM bt_op_entries WHERE plan_id = ? AND status = 'pending' ORDER BY seq",
+                (self.plan_id,)):
+            if op == 'delete':
+                plan.deletes.append((src, size))
+            else:
+                plan.moves.append((src, dst, size))
+        return plan
+
+    def set_status(self, status):
+        self.conn.execute("UPDATE bt_op_plans SET status = ? WHERE plan_id = ?", (status, self.plan_id))
+        self.conn.commit()
+
+    def record(self, src, status, error=None):
+        self._buffer.append((status, error, self.plan_id, src))
+        if len(self._buffer) >= JOURNAL_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self.conn.executemany("UPDATE bt_op_entries SET status = ?, error = ? WHERE plan_id = ? AND src = ?",
+                              self._buffer)
+        self.conn.commit()
+        self._buffer = []
+
+    def summary(self):
+        """目前計畫各狀態的筆數與大小：{status: (count, bytes)}"""
+        return {status: (count, total or 0) for status, count, total in self.conn.execute(
+            "SELECT status, COUNT(*), SUM(size) FROM bt_op_entries WHERE plan_id = ? GROUP BY status",
+            (self.plan_id,))}
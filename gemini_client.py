@@ -0,0 +1,243 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import requests
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gemini_state.json")
+
+DEFAULT_MODEL = "gemini-flash-latest"
+# 模型清單快取多久 (秒)
+MODEL_LIST_TTL = 24 * 3600
+# 偏好模型之外最多再備援幾個 flash 模型 (其餘模型免費額度極低，試了也只是多收幾個 429)
+MAX_FALLBACK_MODELS = 3
+# 只輸出語音/圖片或即時串流的特殊版本，不適合拿來產生文字
+SPECIAL_VARIANTS = ('tts', 'image', 'live', 'audio')
+# 每個模型的本地配額 (免費方案等級)：每分鐘請求、每分鐘 token、每日請求
+DEFAULT_LIMITS = {'rpm': 10, 'tpm': 250000, 'rpd': 250}
+# 所有模型都在冷卻時，最多原地等待幾秒再試一次
+MAX_WAIT_SECONDS = 30
+# 429 沒有附等待時間時的預設冷卻
+DEFAULT_RETRY_DELAY = 30
+
+_RETRY_IN_RE = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+
+
+# ================= 🧮 工具函式 =================
+def estimate_tokens(text):
+    """粗估 token 數：中日文約 1 字 1 token，英數約 4 字元 1 token"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+
+def parse_retry_delay(resp):
+    """從 429 回應取出建議等待秒數 (RetryInfo.retryDelay 或訊息中的 "retry in Ns")"""
+    try:
+        error = resp.json().get('error', {})
+    except ValueError:
+        return DEFAULT_RETRY_DELAY
+    for detail in error.get('details') or []:
+        delay = detail.get('retryDelay')
+        if delay:
+            try:
+                return float(str(delay).rstrip('s'))
+            except ValueError:
+                pass
+    match = _RETRY_IN_RE.search(error.get('message', ''))
+    if match:
+        return float(match.group(1))
+    return DEFAULT_RETRY_DELAY
+
+
+def compact_records(records, max_text=40):
+    """把 [{...}, ...] 轉成欄位表 {"cols": [...], "rows": [[...]]}，省去重複的鍵名與空白
+
+    過長的字串 (例如檔名) 截斷到 max_text 字，任務越多省下的 token 越可觀。
+    """
+    if not records:
+        return "[]"
+    cols = list(records[0].keys())
+    rows = []
+    for r in records:
+        row = []
+        for c in cols:
+            v = r.get(c)
+            if isinstance(v, str) and len(v) > max_text:
+                v = v[:max_text] + "…"
+            row.append(v)
+        rows.append(row)
+    return json.dumps({"cols": cols, "rows": rows}, ensure_ascii=False, separators=(',', ':'))
+
+
+def list_models(api_key, session=None, timeout=10):
+    """查詢此 API Key 可用、且支援 generateContent 的模型 (名稱不含 models/ 前綴)"""
+    http = session or requests
+    resp = http.get(f"{API_BASE}/models", params={'key': api_key}, timeout=timeout)
+    resp.raise_for_status()
+    return [m['name'].split('/', 1)[-1] for m in resp.json().get('models', [])
+            if 'generateContent' in m.get('supportedGenerationMethods', [])]
+
+
+# ================= 🤖 Gemini 用戶端 =================
+class GeminiClient:
+    """共用的 Gemini 呼叫端
+
+    - 429 依 retryDelay 讓該模型冷卻，改用下一個模型
+    - 每個模型在本地記錄每分鐘請求/token 與每日請求數，預估會超額就先跳過
+    - 可用模型清單快取一天 (與 1.py 查到的清單相同)，只在偏好模型與少數 flash 模型間備援
+    - 配額與冷卻狀態存檔，cron 每次重新啟動也不會一開始就撞 429
+    """
+
+    def __init__(self, api_key, preferred=DEFAULT_MODEL, limits=None, state_file=STATE_FILE):
+        self.api_key = api_key
+        self.preferred = preferred
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.state_file = state_file
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+
+    # ---------- 狀態存檔 ----------
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('models', {'fetched': 0, 'names': []})
+        state.setdefault('usage', {})
+        return state
+
+    def _save_state(self):
+        tmp_path = self.state_file + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logger.warning(f"Gemini 狀態存檔失敗: {e}")
+
+    # ---------- 模型清單 ----------
+    def set_models(self, names):
+        self._state['models'] = {'fetched': time.time(), 'names': list(names)}
+        self._save_state()
+
+    def candidate_models(self):
+        """偏好模型 (清單中有才用) 加上最多 MAX_FALLBACK_MODELS 個 flash 模型，正式版優先於預覽版"""
+        if time.time() - self._state['models']['fetched'] > MODEL_LIST_TTL:
+            try:
+                self.set_models(list_models(self.api_key, self.session))
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"無法取得模型清單，沿用舊清單: {e}")
+        names = self._state['models']['names']
+        if not names:
+            # 還沒取得過清單：只能先試偏好模型
+            return [self.preferred]
+        flash = [n for n in names if 'flash' in n and n != self.preferred
+                 and not any(v in n for v in SPECIAL_VARIANTS)]
+        flash.sort(key=lambda n: 'preview' in n or 'exp' in n)
+        head = [self.preferred] if self.preferred in names else []
+        return head + flash[:MAX_FALLBACK_MODELS]
+
+    # ---------- 本地配額 ----------
+    def _usage(self, model):
+        usage = self._state['usage'].setdefault(
+            model, {'day': '', 'requests_today': 0, 'recent': [], 'cooldown_until': 0})
+        today = date.today().isoformat()
+        if usage['day'] != today:
+            usage['day'] = today
+            usage['requests_today'] = 0
+        now = time.time()
+        usage['recent'] = [(ts, tokens) for ts, tokens in usage['recent'] if now - ts < 60]
+        return usage
+
+    def _wait_needed(self, model, tokens):
+        """回傳此模型要等幾秒才能送出；0 代表可立即送出，None 代表今日額度已用完"""
+        usage = self._usage(model)
+        if usage['requests_today'] >= self.limits['rpd']:
+            return None
+        now = time.time()
+        wait = max(0.0, usage['cooldown_until'] - now)
+        recent = usage['recent']
+        if len(recent) >= self.limits['rpm']:
+            wait = max(wait, 60 - (now - recent[0][0]))
+        if sum(t for _, t in recent) + tokens > self.limits['tpm'] and recent:
+            wait = max(wait, 60 - (now - recent[0][0]))
+        return wait
+
+    def _record(self, model, tokens):
+        usage = self._usage(model)
+        usage['requests_today'] += 1
+        usage['recent'].append((time.time(), tokens))
+
+    # ---------- 呼叫 ----------
+    def generate(self, prompt, timeout=60):
+        """送出 prompt 並回傳文字結果；所有模型都失敗時回傳 None"""
+        if not self.api_key:
+            return None
+        estimated = estimate_tokens(prompt)
+        unavailable = set()
+        for _ in range(2):
+            shortest_wait = None
+            for model in self.candidate_models():
+                if model in unavailable:
+                    continue
+                with self._lock:
+                    wait = self._wait_needed(model, estimated)
+                if wait is None:
+                    continue
+                if wait > 0:
+                    shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                    continue
+
+                text, status = self._post(model, prompt, estimated, timeout)
+                if text is not None:
+                    return text
+                if status in (400, 403, 404):
+                    unavailable.add(model)
+
+            # 全部模型都在冷卻中：等待時間不長就原地等一次
+            if shortest_wait is None or shortest_wait > MAX_WAIT_SECONDS:
+                break
+            logger.info(f"Gemini 所有模型冷卻中，等待 {shortest_wait:.0f} 秒")
+            time.sleep(shortest_wait)
+        logger.warning("Gemini 所有模型皆無法使用")
+        return None
+
+    def _post(self, model, prompt, estimated, timeout):
+        url = f"{API_BASE}/models/{model}:generateContent"
+        try:
+            resp = self.session.post(url, params={'key': self.api_key},
+                                     json={"contents": [{"parts": [{"text": prompt}]}]}, timeout=timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Gemini 連線失敗 ({model}): {e}")
+            return None, None
+
+        with self._lock:
+            if resp.status_code == 429:
+                delay = parse_retry_delay(resp)
+                self._usage(model)['cooldown_until'] = time.time() + delay
+                self._save_state()
+                logger.warning(f"Gemini 配額不足 ({model})，{delay:.0f} 秒後再試，改用其他模型")
+                return None, 429
+            if resp.status_code != 200:
+                logger.warning(f"Gemini 呼叫失敗 ({model}): {resp.status_code} {resp.text[:200]}")
+                return None, resp.status_code
+
+            try:
+                data = resp.json()
+                text = data['candidates'][0]['content']['parts'][0]['text']
+            except (ValueError, KeyError, IndexError) as e:
+                logger.warning(f"Gemini 回應格式異常 ({model}): {e}")
+                return None, resp.status_code
+            tokens = data.get('usageMetadata', {}).get('totalTokenCount', estimated)
+            self._record(model, tokens)
+            self._save_state()
+        logger.info(f"Gemini 回應 ({model})，約 {tokens} tokens")
+        return text, 200
@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# ================= ⚙️ 預設參數 =================
+# DS120j 只有 512MB RAM，同時執行的工作數量不宜過多
+DEFAULT_MAX_WORKERS = 2
+# 排隊中的工作上限，超過就直接拒絕，避免按鈕連點把記憶體塞爆
+DEFAULT_MAX_QUEUE = 8
+# 單一工作預設逾時 (秒)
+DEFAULT_TIMEOUT = 600
+
+
+def job_key(name, args=(), kwargs=None):
+    """相同名稱與參數視為同一個工作；參數無法雜湊時不合併"""
+    key = (name, tuple(args), tuple(sorted((kwargs or {}).items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _paths_overlap(a, b):
+    """判斷兩個路徑是否為同一資料夾或互為上下層"""
+    a = os.path.normpath(a)
+    b = os.path.normpath(b)
+    if a == b:
+        return True
+    return a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep)
+
+
+class Job:
+    """單一背景工作：記錄執行函式、逾時、會動到的資料夾與執行結果"""
+
+    def __init__(self, name, func, args=(), kwargs=None, timeout=DEFAULT_TIMEOUT, paths=(), on_done=None,
+                 key=None, cache_ttl=0):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.timeout = timeout
+        self.paths = tuple(paths)
+        # 合併後所有發問者的回呼都掛在同一個工作上
+        self.callbacks = [on_done] if on_done else []
+        self.key = key
+        self.cache_ttl = cache_ttl
+        self.status = 'queued'  # queued, running, done, failed, timeout
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done_event = threading.Event()
+
+    def cache_valid(self, now):
+        return self.status == 'done' and self.cache_ttl > 0 and now - self.finished_at < self.cache_ttl
+
+    def conflicts_with(self, paths):
+        return any(_paths_overlap(p, q) for p in self.paths for q in paths)
+
+    def wait(self, timeout=None):
+        self.done_event.wait(timeout)
+        return self.result
+
+
+class JobRunner:
+    """常駐於 bot_listener 的工作池
+
+    - 固定數量的 worker thread，腳本只在啟動時 import 一次
+    - 排隊數量上限，超過時 submit 回傳 None
+    - 每個工作各自的逾時設定
+    - 宣告相同 (或上下層) 資料夾的工作不會同時執行
+    - 相同的工作已在排隊或執行中時直接合併，完成後通知所有發問者
+    - 逾時的工作 thread 無法強制結束：真正結束前仍佔用一個名額，相同的請求也會併入它
+    - 設定 cache_ttl 的工作，完成後短時間內再次要求直接回傳上次結果
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_queue=DEFAULT_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._running = []
+        # 逾時後仍在背景跑的工作：資料夾鎖與執行名額都要等它真正結束才釋放
+        self._zombies = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._results = {}
+        self._workers = []
+        for i in range(max_workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    # ---------- 對外介面 ----------
+    def submit(self, name, func, args=(), kwargs=None, timeout=DEFAULT_TIMEOUT, paths=(), on_done=None,
+               cache_ttl=0):
+        job, _ = self.submit_or_attach(name, func, args, kwargs, timeout, paths, on_done, cache_ttl)
+        return job
+
+    def submit_or_attach(self, name, func, args=(), kwargs=None, timeout=DEFAULT_TIMEOUT, paths=(), on_done=None,
+                         cache_ttl=0):
+        """回傳 (job, 方式)，方式為 'new'、'attached' (併入既有工作) 或 'cached' (直接使用上次結果)
+
+        'cached' 時不會呼叫 on_done，由呼叫端直接讀取 job.result；佇列已滿時回傳 (None, None)。
+        """
+        key = job_key(name, args, kwargs)
+        with self._cond:
+            if self._stopped:
+                return None, None
+            if key is not None:
+                cached = self._results.get(key)
+                if cached and cached.cache_valid(time.time()):
+                    logger.info(f"使用 {cached.cache_ttl}s 內的結果: {name}")
+                    return cached, 'cached'
+                for existing in list(self._queue) + self._running + self._zombies:
+                    if existing.key == key:
+                        if on_done:
+                            existing.callbacks.append(on_done)
+                        logger.info(f"工作已在{'排隊' if existing.status == 'queued' else '執行'}中，合併請求: {name}")
+                        return existing, 'attached'
+            if len(self._queue) >= self.max_queue:
+                logger.warning(f"工作佇列已滿 ({self.max_queue})，拒絕工作: {name}")
+                return None, None
+            job = Job(name, func, args, kwargs, timeout, paths, on_done, key, cache_ttl)
+            self._queue.append(job)
+            self._cond.notify_all()
+        logger.info(f"工作已排入佇列: {name} (排隊中 {len(self._queue)})")
+        return job, 'new'
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def running_jobs(self):
+        with self._cond:
+            return [j.name for j in self._running]
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait:
+            for t in self._workers:
+                t.join()
+
+    # ---------- 內部邏輯 ----------
+    def _busy_paths(self):
+        paths = []
+        for j in self._running + self._zombies:
+            paths.extend(j.paths)
+        return paths
+
+    def _next_runnable(self):
+        """挑出第一個資料夾沒被佔用的工作 (呼叫端需持有 _cond)"""
+        # 逾時仍在跑的 thread 也算在同時執行數內，避免重送的工作無限疊加
+        if len(self._running) + len(self._zombies) >= self.max_workers:
+            return None
+        busy = self._busy_paths()
+        for job in self._queue:
+            if not busy or not job.paths or not job.conflicts_with(busy):
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = self._next_runnable()
+                while job is None:
+                    if self._stopped:
+                        return
+                    self._cond.wait()
+                    job = self._next_runnable()
+                job.status = 'running'
+                job.started_at = time.time()
+                self._running.append(job)
+
+            self._execute(job)
+
+            with self._cond:
+                self._running.remove(job)
+                if job.key is not None and job.cache_valid(time.time()):
+                    self._store_result(job)
+                # 回呼清單到此固定；仍在背景跑的逾時工作，之後併入的請求改在它結束時通知
+                callbacks = list(job.callbacks)
+                if job in self._zombies:
+                    job.callbacks = []
+                self._cond.notify_all()
+
+            for callback in callbacks:
+                try:
+                    callback(job)
+                except Exception as e:
+                    logger.error(f"工作回呼失敗 ({job.name}): {e}")
+
+    def _store_result(self, job):
+        """保存可快取的結果，順便清掉過期項目 (呼叫端需持有 _cond)"""
+        now = time.time()
+        for key in [k for k, j in self._results.items() if not j.cache_valid(now)]:
+            del self._results[key]
+        self._results[job.key] = job
+
+    def _execute(self, job):
+        """在獨立 thread 執行工作並等待逾時；回傳工作是否已真正結束"""
+
+        def target():
+            status = 'failed'
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+                status = 'done'
+            except Exception as e:
+                job.error = e
+                logger.error(f"工作執行失敗 ({job.name}): {e}")
+            finally:
+                late_callbacks = []
+                with self._cond:
+                    job.finished_at = time.time()
+                    if job in self._zombies:
+                        self._zombies.remove(job)
+                        job.status = status
+                        late_callbacks = job.callbacks
+                        job.callbacks = []
+                        if job.key is not None and job.cache_valid(job.finished_at):
+                            self._store_result(job)
+                        logger.info(f"逾時工作已於背景結束，釋放資料夾與名額: {job.name}")
+                        self._cond.notify_all()
+                    elif job.status == 'running':
+                        job.status = status
+                # 逾時期間才併入的請求，以真正的結果通知
+                for callback in late_callbacks:
+                    try:
+                        callback(job)
+                    except Exception as e:
+                        logger.error(f"工作回呼失敗 ({job.name}): {e}")
+
+        t = threading.Thread(target=target, name=f"job-{job.name}", daemon=True)
+        t.start()
+        t.join(job.timeout)
+        with self._cond:
+            timed_out = job.finished_at is None
+            if timed_out:
+                # thread 無法強制結束：保留資料夾鎖與名額直到它真正跑完
+                job.status = 'timeout'
+                self._zombies.append(job)
+        if timed_out:
+            logger.error(f"工作逾時 ({job.timeout}s): {job.name}")
+            job.done_event.set()
+            return False
+        elapsed = job.finished_at - job.started_at
+        logger.info(f"工作結束 [{job.status}] {job.name}，耗時 {elapsed:.1f}s")
+        job.done_event.set()
+        return True
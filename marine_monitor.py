@@ -1,12 +1,14 @@
 import requests
-import sqlite3
 import os
 import logging
 import sys
-import io
 import urllib3
 from datetime import datetime
 
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+
 # ================= 📝 LOGGING 系統設定 =================
 logging.basicConfig(
     level=logging.INFO,
@@ -17,7 +19,7 @@ logger = logging.getLogger(__name__)
 
 # ================= 🔤 環境初始化 =================
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+ensure_utf8_stdout()
 
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
 
@@ -36,17 +38,8 @@ PRIORITY_STATIONS = [
 
 # ================= 📦 資料庫工具 =================
 def get_config(key):
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        conn.execute("PRAGMA journal_mode=WAL;")
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM config WHERE key = ?", (key,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
-    except Exception as e:
-        logger.error(f"資料庫讀取失敗 (鍵名: {key}): {e}")
-        return None
+    # 共用設定快取：同一行程內不會為每個鍵重開連線
+    return config_store.get_config(key, DB_PATH)
 
 
 # ================= 🤖 Telegram 發送邏輯 =================
@@ -57,16 +50,8 @@ def send_alert(message):
         logger.error("發送中止：資料庫中缺少 Telegram 設定")
         return
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {'chat_id': chat_id, 'text': message, 'parse_mode': 'HTML'}
-    try:
-        resp = requests.post(url, data=payload, timeout=15, verify=False)
-        if resp.status_code == 200:
-            logger.info("Telegram 風力報告推播成功")
-        else:
-            logger.error(f"Telegram 推播失敗，狀態碼: {resp.status_code}")
-    except Exception as e:
-        logger.error(f"Telegram 連線異常: {e}")
+    if telegram_client.send_message(token, chat_id, message):
+        logger.info("Telegram 風力報告推播成功")
 
 
 # ================= 🌬️ 風力強度換算 =================
@@ -189,6 +174,8 @@ def monitor_port_wind():
     msg += f"\n🕒 觀測時間：{time_str}"
 
     send_alert(msg)
+    # 回傳報告內容，讓 bot_listener 可以轉給其他發問者或作為短期快取
+    return msg
 
 
 if __name__ == "__main__":
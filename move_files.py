@@ -1,12 +1,14 @@
 import os
-import shutil
-import requests
 import urllib3
 import sys
-import io
-import sqlite3
 import logging
 
+from bt_index import BTIndex
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+from file_ops import FileOpEngine, OpJournal, plan_flatten, apply_unfinished
+
 # ================= 📝 LOGGING 系統設定 (中文化) =================
 # 設定格式：時間 - 層級 - 訊息 (嚴格禁止 Emoji)
 logging.basicConfig(
@@ -18,7 +20,7 @@ logger = logging.getLogger(__name__)
 
 # ================= 🔤 環境初始化 =================
 # 強制輸出使用 UTF-8，解決 NAS Log 亂碼
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+ensure_utf8_stdout()
 # 關閉 SSL 安全警告 (加入相容性保護)
 try:
     if hasattr(urllib3, 'disable_warnings'):
@@ -36,23 +38,22 @@ DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book
 
 # ================= 📦 資料庫工具 =================
 def get_db_config():
-    """從資料庫讀取系統設定值"""
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        # 開啟 WAL 模式確保穩定性
-        conn.execute("PRAGMA journal_mode=WAL;")
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM config")
-        configs = dict(cursor.fetchall())
-        conn.close()
-        return configs
-    except Exception as e:
-        logger.error(f"資料庫讀取失敗: {e}")
-        return {}
+    """從資料庫讀取系統設定值 (行程內快取，只在設定表變動時重新載入)"""
+    return config_store.get_all(DB_PATH)
 
 
 # ================= 🚀 核心整理邏輯 =================
-def move_files():
+def send_report(token, chat_id, msg):
+    if telegram_client.send_message(token, chat_id, msg):
+        logger.info("Telegram 執行報告發送成功")
+
+
+def move_files(mode=None):
+    """mode：
+    None    - 若上次執行中斷，先把剩餘項目做完；之後照常掃描、規劃並執行
+    'plan'  - 只掃描並存下搬移計畫，以 Telegram 回報
+    'apply' - 執行最近一份尚未完成且未過期的計畫 (不重新掃描)
+    """
     # 1. 取得設定
     configs = get_db_config()
     TELEGRAM_TOKEN = configs.get('tele_token')
@@ -69,55 +70,78 @@ def move_files():
         logger.error(f"目錄不存在：{ROOT}")
         return
 
-    logger.info(f"開始整理資料夾，根目錄：{ROOT}")
-
-    moved = 0
-    failed = 0
-    examples = []
-
-    # 第一階段：搬移檔案
-    for dirpath, dirnames, filenames in os.walk(ROOT):
-        # 排除根目錄本身與系統資料夾
-        if os.path.abspath(dirpath) == os.path.abspath(ROOT) or '@eaDir' in dirpath:
-            continue
-
-        for fname in filenames:
-            src = os.path.join(dirpath, fname)
-            dst = os.path.join(ROOT, fname)
-
-            # 處理同名衝突：若目的地已存在，則加上時間戳記或略過
-            if os.path.exists(dst):
-                logger.warning(f"略過：目的地已有同名檔案 - {fname}")
-                continue
-
+    index = BTIndex(ROOT)
+    journal = OpJournal('flatten')
+    try:
+        engine = FileOpEngine()
+        if mode == 'apply':
+            result = apply_unfinished(journal, engine, ('planned', 'applying'))
+            if result is None:
+                logger.info("沒有待執行的搬移計畫 (超過 24 小時的計畫已作廢，請重新規劃)")
+                return
+            index.record_moves(result.done_moves)
+            index.forget_files(result.missing)
+        else:
+            previous = None
+            if mode is None and not DRY_RUN:
+                # 先把上次中斷的計畫做完，再照常掃描規劃這一輪
+                previous = apply_unfinished(journal, engine)
+                if previous:
+                    index.record_moves(previous.done_moves)
+                    index.forget_files(previous.missing)
+
+            logger.info(f"開始整理資料夾，根目錄：{ROOT}")
+            index.refresh()
+
+            # 第一階段：先規劃再批次搬移 (索引已排除根目錄本身與 @eaDir 系統資料夾)
+            # 同名衝突以根目錄現有名稱集合在記憶體中判斷，不再逐檔 os.path.exists
+            plan = plan_flatten(index.files_in_subdirs(), index.root, os.listdir(index.root))
+            for src, reason in plan.skipped:
+                logger.warning(f"略過：{reason} - {os.path.basename(src)}")
+
+            if mode == 'plan':
+                journal.save_plan(plan)
+                msg = f"📝 <b>檔案整理計畫 #{journal.plan_id}</b>\n"
+                msg += f"━━━━━━━━━━━━━━━━\n"
+                msg += f"📦 預計搬移：{len(plan.moves)} 個\n"
+                msg += f"⏭️ 同名略過：{len(plan.skipped)} 個"
+                examples = [f"📄 {os.path.basename(src)}" for src, _, _ in plan.moves[:10]]
+                if examples:
+                    msg += f"\n\n📝 <b>搬移清單範例：</b>\n" + "\n".join(examples)
+                send_report(TELEGRAM_TOKEN, CHAT_ID, msg)
+                return
+
+            if not DRY_RUN:
+                journal.save_plan(plan, status='applying')
+            result = engine.apply(plan, dry_run=DRY_RUN, journal=None if DRY_RUN else journal)
+            if not DRY_RUN:
+                index.record_moves(result.done_moves)
+                index.forget_files(result.missing)
+                journal.set_status('done')
+            result.merge(previous)
+
+        moved = len(result.done_moves)
+        failed = len(result.failed)
+        examples = [f"📄 {os.path.basename(src)}" for src, _ in result.done_moves[:5]]
+
+        # 第二階段：刪除空資料夾 (由最深層往上)
+        removed_dirs = 0
+        removed_paths = []
+        for dirpath in index.subdirs_bottom_up():
             try:
-                if DRY_RUN:
-                    logger.info(f"模擬搬移：{src} -> {dst}")
-                else:
-                    shutil.move(src, dst)
-                    logger.info(f"執行搬移：{fname}")
-
-                moved += 1
-                if len(examples) < 5:
-                    examples.append(f"📄 {fname}")
-            except Exception as e:
-                failed += 1
-                logger.error(f"搬移失敗：{fname}，原因：{e}")
-
-    # 第二階段：刪除空資料夾
-    removed_dirs = 0
-    for dirpath, dirnames, filenames in os.walk(ROOT, topdown=False):
-        if os.path.abspath(dirpath) == os.path.abspath(ROOT) or '@eaDir' in dirpath:
-            continue
-
-        try:
-            if not os.listdir(dirpath):
-                if not DRY_RUN:
-                    os.rmdir(dirpath)
-                removed_dirs += 1
-                logger.info(f"已清理空資料夾：{os.path.basename(dirpath)}")
-        except Exception:
-            pass
+                if not os.listdir(dirpath):
+                    if not DRY_RUN:
+                        os.rmdir(dirpath)
+                        removed_paths.append(dirpath)
+                    removed_dirs += 1
+                    logger.info(f"已清理空資料夾：{os.path.basename(dirpath)}")
+            except Exception:
+                pass
+
+        index.forget_dirs(removed_paths)
+    finally:
+        journal.close()
+        index.close()
 
     # --- 發送 Telegram 報告 (訊息內含 Emoji) ---
     status_label = "測試模式" if DRY_RUN else "正式執行"
@@ -126,23 +150,15 @@ def move_files():
     msg += f"━━━━━━━━━━━━━━━━\n"
     msg += f"📦 搬移檔案：{moved} 個\n"
     msg += f"🗑️ 清理空夾：{removed_dirs} 個\n"
-    msg += f"❌ 失敗檔案：{failed} 個"
+    msg += f"❌ 失敗檔案：{failed} 個\n"
+    msg += f"⚡ 處理速度：{result.throughput_text()}"
 
     if examples:
         msg += f"\n\n📝 <b>搬移清單範例：</b>\n" + "\n".join(examples)
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {'chat_id': CHAT_ID, 'text': msg, 'parse_mode': 'HTML'}
-
-    try:
-        resp = requests.post(url, data=payload, verify=False, timeout=15)
-        if resp.status_code == 200:
-            logger.info("Telegram 執行報告發送成功")
-        else:
-            logger.error(f"Telegram 發送失敗，狀態碼: {resp.status_code}")
-    except Exception as e:
-        logger.error(f"發送 Telegram 通知時發生異常: {e}")
+    send_report(TELEGRAM_TOKEN, CHAT_ID, msg)
+    return msg
 
 
 if __name__ == "__main__":
-    move_files()
\ No newline at end of file
+    move_files(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,14 +1,16 @@
-import requests
 import json
 import datetime
 import urllib3
 import os
 import sys
-import time
-import io
 import sqlite3
 import logging
 
+import config_store
+import telegram_client
+from console import ensure_utf8_stdout
+import twse_quotes
+
 # ================= 📝 LOGGING 系統設定 =================
 logging.basicConfig(
     level=logging.INFO,
@@ -18,10 +20,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ================= 🔤 環境初始化 =================
-try:
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-except Exception:
-    pass
+ensure_utf8_stdout()
 
 try:
     if hasattr(urllib3, 'disable_warnings'):
@@ -49,18 +48,8 @@ def safe_float(value):
 
 
 def get_db_config():
-    """從資料庫讀取系統設定值"""
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=20)
-        conn.execute("PRAGMA journal_mode=WAL;")
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM config")
-        configs = dict(cursor.fetchall())
-        conn.close()
-        return configs
-    except Exception as e:
-        logger.error(f"資料庫設定讀取失敗: {e}")
-        return {}
+    """從資料庫讀取系統設定值 (行程內快取，只在設定表變動時重新載入)"""
+    return config_store.get_all(DB_PATH)
 
 
 def get_stock_assets():
@@ -151,9 +140,11 @@ def delete_inventory(user_id, stock_code):
 
 
 # ================= 🚀 核心監控與損益計算 (原有功能) =================
-def fetch_stock_report():
-    logger.info(f"啟動參數檢查 (sys.argv): {sys.argv}")
-    is_manual = len(sys.argv) > 1 and sys.argv[1] == "manual"
+def fetch_stock_report(is_manual=None):
+    # 由 bot_listener 直接呼叫時會帶入 is_manual，命令列執行時才看 sys.argv
+    if is_manual is None:
+        logger.info(f"啟動參數檢查 (sys.argv): {sys.argv}")
+        is_manual = len(sys.argv) > 1 and sys.argv[1] == "manual"
 
     configs = get_db_config()
     token = configs.get('tele_token')
@@ -179,20 +170,18 @@ def fetch_stock_report():
             return
 
     codes = list(assets_data.keys())
-    # 組合 API 請求
-    query_string = "|".join([f"tse_{c}.tw" for c in codes])
-    url = f"https://mis.twse.com.tw/stock/api/getStockInfo.jsp?ex_ch={query_string}&_={int(time.time() * 1000)}"
 
     try:
-        res = requests.get(url, verify=False, timeout=20)
-        data = res.json()
+        # 上市/上櫃自動判斷，代號多時自動分批並同時查詢
+        quotes = twse_quotes.fetch_quotes(codes, DB_PATH)
 
         msg = "📈 <b>台股庫存即時損益回報</b>\n━━━━━━━━━━━━━━━━"
         total_profit = 0
         found_count = 0
 
-        for stock in data.get('msgArray', []):
-            code = stock.get('c')
+        for code in codes:
+            stock = quotes.get(code)
+            if not stock: continue
             name = stock.get('n')
 
             # --- [修正核心] 價格解析邏輯 ---
@@ -230,10 +219,8 @@ def fetch_stock_report():
 
         if found_count > 0:
             msg += f"━━━━━━━━━━━━━━━━\n總計即時損益：<b>{total_profit:,.0f}</b>"
-            api_url = f"https://api.telegram.org/bot{token}/sendMessage"
-            requests.post(api_url, data={'chat_id': chat_id, 'text': msg, 'parse_mode': 'HTML'}, verify=False,
-                          timeout=15)
-            logger.info("損益回報發送成功")
+            if telegram_client.send_message(token, chat_id, msg):
+                logger.info("損益回報發送成功")
         else:
             logger.warning("證交所回傳無數據，可能非服務時段")
 
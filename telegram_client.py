@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import logging
+import threading
+import requests
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# 可用環境變數指向本機的假 Telegram (fake_telegram.py) 做離線測試
+API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+
+# ================= ⚙️ Telegram 限制 =================
+# 單則訊息長度上限
+MAX_MESSAGE_LENGTH = 4096
+# 同一聊天室約每秒 1 則，全域約每秒 30 則
+PER_CHAT_RATE = 1.0
+PER_CHAT_BURST = 3
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """簡單的令牌桶：rate 為每秒補充數量，capacity 為可累積的上限"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """取走一個令牌，回傳需要等待的秒數 (呼叫端需持有鎖)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """依換行切割長訊息，避免把同一行內的 HTML 標籤切斷；單行過長才硬切"""
+    if len(text) <= limit:
+        return [text]
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class TelegramClient:
+    """所有腳本共用的 Telegram 發送端
+
+    - 持久 requests.Session (keep-alive，不必每則訊息重做 TCP+TLS)
+    - 每個聊天室與全域各一個令牌桶，避免觸發 Telegram 流量限制
+    - 遇到 429 依 retry_after 等待後重送
+    - 超過 4096 字自動分段
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.session = requests.Session()
+        self.session.verify = False
+        self._lock = threading.Lock()
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chat_buckets = {}
+
+    def _wait_for_slot(self, chat_id):
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+            delay = max(bucket.reserve(), self._global_bucket.reserve())
+        if delay > 0:
+            time.sleep(delay)
+
+    def call(self, method, data, timeout=15):
+        """呼叫任意 Bot API 方法，處理 429 重送；回傳 Response 或 None"""
+        url = f"{API_BASE}/bot{self.token}/{method}"
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                resp = self.session.post(url, data=data, timeout=timeout)
+            except requests.RequestException as e:
+                logger.error(f"Telegram 連線異常 ({method}): {e}")
+                if attempt == MAX_RETRIES:
+                    return None
+                time.sleep(2 ** attempt)
+                continue
+
+            if resp.status_code == 429:
+                try:
+                    retry_after = resp.json().get('parameters', {}).get('retry_after', 1)
+                except ValueError:
+                    retry_after = 1
+                logger.warning(f"Telegram 流量限制，{retry_after} 秒後重送")
+                time.sleep(retry_after)
+                continue
+            return resp
+        return None
+
+    def send_message(self, chat_id, text, reply_markup=None, parse_mode='HTML'):
+        """發送訊息 (自動分段)；鍵盤只掛在最後一段。全部成功回傳 True"""
+        chunks = split_message(text)
+        ok = True
+        for i, chunk in enumerate(chunks):
+            data = {'chat_id': chat_id, 'text': chunk}
+            if parse_mode:
+                data['parse_mode'] = parse_mode
+            if reply_markup and i == len(chunks) - 1:
+                data['reply_markup'] = reply_markup if isinstance(reply_markup, str) else json.dumps(reply_markup)
+            self._wait_for_slot(str(chat_id))
+            resp = self.call('sendMessage', data)
+            if resp is None or resp.status_code != 200:
+                status = resp.status_code if resp is not None else '連線失敗'
+                logger.error(f"Telegram 發送失敗，狀態碼: {status}")
+                ok = False
+        return ok
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token):
+    """同一個 token 在同一個行程內共用一個 client (連線與限流狀態)"""
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = _clients[token] = TelegramClient(token)
+        return client
+
+
+def send_message(token, chat_id, text, reply_markup=None, parse_mode='HTML'):
+    if not token or not chat_id:
+        return False
+    return get_client(token).send_message(chat_id, text, reply_markup, parse_mode)
@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ds_admission
+from ds_admission import AdmissionController
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proc_samples")
+# 錄製快照的取樣間隔 (秒)
+INTERVAL = 60
+
+
+def read_sample(name, filename):
+    with open(os.path.join(SAMPLES, name, filename), 'r') as f:
+        return f.read()
+
+
+def replay(controller, name, count):
+    """依序餵入錄下的 /proc 快照，回傳每次取樣後的上限"""
+    meminfo = read_sample(name, 'meminfo')
+    limits = []
+    for i in range(count):
+        diskstats = read_sample(name, f'diskstats.{i}')
+        limits.append(controller.update(meminfo, diskstats, [], ts=1000000 + i * INTERVAL))
+    return limits
+
+
+class ProcParsingTest(unittest.TestCase):
+    def test_meminfo_ratio(self):
+        ratio = ds_admission.mem_available_ratio(ds_admission.parse_meminfo(read_sample('pressure', 'meminfo')))
+        self.assertAlmostEqual(ratio, 48212 / 505032)
+
+    def test_diskstats_whole_disks_only(self):
+        ticks = ds_admission.parse_diskstats(read_sample('pressure', 'diskstats.0'))
+        self.assertEqual(set(ticks), {'sata1', 'md0'})
+        self.assertEqual(ticks['sata1'], 1000000)
+
+    def test_disk_busy_after_counter_reset(self):
+        before = ds_admission.parse_diskstats(read_sample('reboot', 'diskstats.0'))
+        after = ds_admission.parse_diskstats(read_sample('reboot', 'diskstats.1'))
+        self.assertEqual(ds_admission.disk_busy_ratio(before, 0.5, after, 0.5 + INTERVAL), 0.0)
+
+
+class HysteresisTest(unittest.TestCase):
+    def test_lowers_after_consecutive_pressure(self):
+        # 第一次取樣沒有前一次 diskstats，但記憶體已不足；需連續 LOWER_AFTER 次才降
+        self.assertEqual(replay(AdmissionController(4), 'pressure', 4), [4, 3, 3, 2])
+
+    def test_raises_after_consecutive_headroom(self):
+        self.assertEqual(replay(AdmissionController(2), 'headroom', 5), [2, 2, 3, 3, 3])
+
+    def test_steady_between_thresholds(self):
+        self.assertEqual(replay(AdmissionController(3), 'steady', 4), [3, 3, 3, 3])
+
+    def test_pressure_resets_headroom_count(self):
+        controller = AdmissionController(2)
+        replay(controller, 'headroom', 2)
+        self.assertEqual(controller.headroom_count, 2)
+        controller.update(read_sample('pressure', 'meminfo'), None, [])
+        self.assertEqual(controller.headroom_count, 0)
+        self.assertEqual(controller.limit, 2)
+
+    def test_bounded_by_min_and_max(self):
+        self.assertEqual(replay(AdmissionController(ds_admission.MIN_ACTIVE), 'pressure', 4)[-1],
+                         ds_admission.MIN_ACTIVE)
+        self.assertEqual(replay(AdmissionController(ds_admission.MAX_ACTIVE), 'headroom', 5)[-1],
+                         ds_admission.MAX_ACTIVE)
+
+    def test_reboot_is_not_pressure(self):
+        controller = AdmissionController(3)
+        replay(controller, 'reboot', 2)
+        self.assertEqual(controller.pressure_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ds_rules
+from ds_history import TaskHistory
+
+NOW = 1700000000
+DEAD_HOURS = 3
+MB = 1048576
+
+
+def make_task(task_id, status, size, downloaded=0, speed=0, age_hours=0.0):
+    return {
+        'id': task_id, 'title': task_id, 'size': size, 'status': status,
+        'additional': {
+            'transfer': {'size_downloaded': downloaded, 'speed_download': speed},
+            'detail': {'create_time': NOW - age_hours * 3600},
+        },
+    }
+
+
+def summarize(task, zero_hours=None):
+    s = ds_rules.summarize_task(task, NOW)
+    if zero_hours is not None:
+        s['zero_hours'] = zero_hours
+    return s
+
+
+def actions(decisions):
+    return {d['id']: d['action'] for d in decisions}
+
+
+class DeadTaskTest(unittest.TestCase):
+    def test_slow_download_rounding_to_zero_is_not_dead(self):
+        # 5GB、300KB/s、進度四捨五入為 0.0%、建立 3.5 小時：有在下載，不是死種
+        s = summarize(make_task('big', 'downloading', 5 * 1024 * MB, downloaded=2 * MB, speed=300 * 1024,
+                                age_hours=3.5), zero_hours=0)
+        self.assertEqual(s['progress_pct'], 0.0)
+        self.assertFalse(ds_rules.is_dead(s, DEAD_HOURS))
+
+    def test_paused_task_is_not_dead(self):
+        # 排程自己暫停、從沒拿到名額的小任務
+        s = summarize(make_task('paused', 'paused', 50 * MB, age_hours=5), zero_hours=4)
+        self.assertFalse(ds_rules.is_dead(s, DEAD_HOURS))
+
+    def test_age_alone_is_not_enough(self):
+        # 建立很久，但實際等待/下載的時間還不到門檻
+        s = summarize(make_task('young', 'waiting', 0, age_hours=10), zero_hours=1)
+        self.assertFalse(ds_rules.is_dead(s, DEAD_HOURS))
+
+    def test_without_history_is_not_dead(self):
+        s = summarize(make_task('nohist', 'waiting', 0, age_hours=10))
+        self.assertFalse(ds_rules.is_dead(s, DEAD_HOURS))
+
+    def test_zero_bytes_while_active_is_dead(self):
+        s = summarize(make_task('dead', 'waiting', 0, age_hours=10), zero_hours=4)
+        self.assertTrue(ds_rules.is_dead(s, DEAD_HOURS))
+        decisions, _ = ds_rules.plan_decisions([s], 2, DEAD_HOURS)
+        self.assertEqual(actions(decisions), {'dead': 'delete'})
+
+
+class ProtectedDeleteTest(unittest.TestCase):
+    def test_vetoed_delete_stays_in_candidates(self):
+        summaries = [
+            summarize(make_task('big_dead', 'downloading', 2048 * MB, age_hours=10), zero_hours=5),
+            summarize(make_task('a', 'downloading', 500 * MB, downloaded=400 * MB, speed=500 * 1024), zero_hours=0),
+            summarize(make_task('b', 'paused', 500 * MB, downloaded=100 * MB), zero_hours=0),
+        ]
+        decisions, _ = ds_rules.plan_decisions(summaries, 1, DEAD_HOURS, protected={'big_dead'})
+        result = actions(decisions)
+        self.assertNotEqual(result['big_dead'], 'delete')
+        # 受保護的任務也算在同時下載上限內
+        self.assertEqual(sum(1 for a in result.values() if a == 'resume'), 1)
+        self.assertEqual(result['big_dead'], 'pause')
+        self.assertEqual(ds_rules.free_slots(decisions, 1), 0)
+
+    def test_vetoed_delete_can_take_free_slot(self):
+        s = summarize(make_task('big_dead', 'waiting', 2048 * MB, age_hours=10), zero_hours=5)
+        decisions, _ = ds_rules.plan_decisions([s], 2, DEAD_HOURS, protected={'big_dead'})
+        self.assertEqual(actions(decisions), {'big_dead': 'resume'})
+        self.assertEqual(ds_rules.free_slots(decisions, 2), 1)
+
+
+class ZeroSecondsHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.history = TaskHistory(':memory:')
+
+    def tearDown(self):
+        self.history.close()
+
+    def test_counts_only_waiting_or_downloading_time(self):
+        hour = 3600
+        timeline = [('waiting', 0), ('downloading', hour), ('paused', 2 * hour), ('paused', 5 * hour),
+                    ('waiting', 6 * hour), ('waiting', 7 * hour)]
+        for status, offset in timeline:
+            self.history.record([make_task('t', status, 0)], NOW + offset)
+        stats = self.history.stats(NOW + 7 * hour)
+        # 0~1h 等待、1~2h 下載、6~7h 等待；暫停的 4 小時不算
+        self.assertEqual(stats['t']['zero_seconds'], 3 * hour)
+
+    def test_gap_between_snapshots_is_capped(self):
+        self.history.record([make_task('t', 'waiting', 0)], NOW)
+        self.history.record([make_task('t', 'waiting', 0)], NOW + 24 * 3600)
+        stats = self.history.stats(NOW + 24 * 3600)
+        self.assertEqual(stats['t']['zero_seconds'], 2 * 3600)
+
+    def test_any_downloaded_bytes_reset(self):
+        self.history.record([make_task('t', 'waiting', 0)], NOW)
+        self.history.record([make_task('t', 'downloading', 100 * MB, downloaded=1)], NOW + 3600)
+        stats = self.history.stats(NOW + 3600)
+        self.assertEqual(stats['t']['zero_seconds'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_ops
+
+
+def write(path, data=b"x" * 10):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class FileOpTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        self.engine = file_ops.FileOpEngine()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+
+class DeleteTest(FileOpTestCase):
+    def test_deletes_file_with_planned_size(self):
+        path = write(self.path("a.txt"))
+        result = self.engine.apply(file_ops.plan_deletes([(path, "a.txt", 10)]))
+        self.assertEqual(result.done_deletes, [path])
+        self.assertEqual(result.bytes_done, 10)
+        self.assertFalse(os.path.exists(path))
+
+    def test_skips_file_that_changed_since_planning(self):
+        path = write(self.path("growing.part"))
+        plan = file_ops.plan_deletes([(path, "growing.part", 10)])
+        # 規劃後檔案仍在寫入
+        write(path, b"x" * 4096)
+        result = self.engine.apply(plan)
+        self.assertEqual(result.done_deletes, [])
+        self.assertEqual(result.failed, [(path, "檔案大小已變動")])
+        self.assertTrue(os.path.exists(path))
+
+    def test_counts_missing_file(self):
+        path = self.path("gone.txt")
+        result = self.engine.apply(file_ops.plan_deletes([(path, "gone.txt", 10)]))
+        self.assertEqual(result.missing, [path])
+        self.assertEqual(result.failed, [])
+        self.assertEqual(result.files_done, 0)
+
+    def test_dry_run_keeps_file(self):
+        path = write(self.path("a.txt"))
+        result = self.engine.apply(file_ops.plan_deletes([(path, "a.txt", 10)]), dry_run=True)
+        self.assertEqual(result.done_deletes, [path])
+        self.assertTrue(os.path.exists(path))
+
+
+class MoveTest(FileOpTestCase):
+    def test_flattens_subdir_files(self):
+        src = write(self.path("sub", "a.mkv"))
+        plan = file_ops.plan_flatten([(src, "sub", "a.mkv", 10)], self.root, os.listdir(self.root))
+        result = self.engine.apply(plan)
+        dst = self.path("a.mkv")
+        self.assertEqual(result.done_moves, [(src, dst)])
+        self.assertTrue(os.path.exists(dst))
+        self.assertFalse(os.path.exists(src))
+
+    def test_plan_skips_name_taken_twice(self):
+        a = self.path("x", "same.mkv")
+        b = self.path("y", "same.mkv")
+        plan = file_ops.plan_flatten([(a, "x", "same.mkv", 1), (b, "y", "same.mkv", 1)], self.root, [])
+        self.assertEqual([m[0] for m in plan.moves], [a])
+        self.assertEqual(plan.skipped, [(b, "目的地已有同名檔案")])
+
+    def test_never_overwrites_destination_created_after_planning(self):
+        src = write(self.path("sub", "a.mkv"), b"new")
+        plan = file_ops.plan_flatten([(src, "sub", "a.mkv", 3)], self.root, os.listdir(self.root))
+        dst = write(self.path("a.mkv"), b"old")
+        result = self.engine.apply(plan)
+        self.assertEqual(result.done_moves, [])
+        self.assertEqual(result.failed, [(src, "目的地已有同名檔案")])
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertTrue(os.path.exists(src))
+
+    def test_existing_destination_counts_as_done_only_when_resuming(self):
+        dst = write(self.path("a.mkv"))
+        src = self.path("sub", "a.mkv")
+        plan = file_ops.FileOpPlan()
+        plan.moves.append((src, dst, 10))
+
+        fresh = self.engine.apply(plan)
+        self.assertEqual(fresh.done_moves, [])
+        self.assertEqual(fresh.failed, [(src, "目的地已有同名檔案")])
+
+        resumed = self.engine.apply(plan, verify=True)
+        self.assertEqual(resumed.done_moves, [(src, dst)])
+        self.assertEqual(resumed.failed, [])
+
+    def test_counts_missing_source(self):
+        src = self.path("sub", "gone.mkv")
+        plan = file_ops.FileOpPlan()
+        plan.moves.append((src, self.path("gone.mkv"), 10))
+        result = self.engine.apply(plan)
+        self.assertEqual(result.missing, [src])
+        self.assertEqual(result.failed, [])
+
+
+class JournalResumeTest(FileOpTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = file_ops.OpJournal('flatten', db_path=self.path("journal.db"))
+        self.bt = self.path("bt")
+        os.makedirs(self.bt)
+
+    def tearDown(self):
+        self.journal.close()
+        super().tearDown()
+
+    def flatten_plan(self, count):
+        files = []
+        for i in range(count):
+            name = f"ep{i}.mkv"
+            files.append((write(os.path.join(self.bt, "show", name)), "show", name, 10))
+        return file_ops.plan_flatten(files, self.bt, os.listdir(self.bt))
+
+    def test_resume_after_interrupt_finishes_plan_once(self):
+        plan = self.flatten_plan(4)
+        self.journal.save_plan(plan, status='applying')
+
+        # 中斷前：前兩筆已完成並寫入紀錄，第三筆已搬移但紀錄尚未提交
+        first = file_ops.FileOpPlan()
+        first.moves = plan.moves[:2]
+        self.engine.apply(first, journal=self.journal)
+        src, dst, _ = plan.moves[2]
+        os.rename(src, dst)
+
+        result = file_ops.apply_unfinished(self.journal, self.engine)
+        self.assertEqual(result.done_moves, [(s, d) for s, d, _ in plan.moves[2:]])
+        self.assertEqual(result.failed, [])
+        self.assertEqual(self.journal.summary(), {'done': (4, 40)})
+
+        # 再次執行不會重做任何操作
+        self.assertIsNone(file_ops.apply_unfinished(self.journal, self.engine))
+        self.assertEqual(sorted(os.listdir(self.bt)), ["ep0.mkv", "ep1.mkv", "ep2.mkv", "ep3.mkv", "show"])
+        self.assertEqual(os.listdir(os.path.join(self.bt, "show")), [])
+
+    def test_default_resume_ignores_planned_only(self):
+        self.journal.save_plan(self.flatten_plan(1))
+        self.assertIsNone(file_ops.apply_unfinished(self.journal, self.engine))
+        result = file_ops.apply_unfinished(self.journal, self.engine, ('planned', 'applying'))
+        self.assertEqual(len(result.done_moves), 1)
+
+    def test_old_planned_plan_expires(self):
+        plan_id = self.journal.save_plan(self.flatten_plan(1))
+        self.journal.conn.execute("UPDATE bt_op_plans SET created = ? WHERE plan_id = ?",
+                                  (time.time() - file_ops.PLAN_MAX_AGE_SECONDS - 1, plan_id))
+        self.assertIsNone(self.journal.open_unfinished())
+        status = self.journal.conn.execute("SELECT status FROM bt_op_plans WHERE plan_id = ?", (plan_id,)).fetchone()
+        self.assertEqual(status, ('expired',))
+
+    def test_new_plan_supersedes_older_ones(self):
+        old_id = self.journal.save_plan(self.flatten_plan(1))
+        new_id = self.journal.save_plan(file_ops.FileOpPlan())
+        self.assertNotEqual(old_id, new_id)
+        plan = self.journal.open_unfinished()
+        self.assertEqual(self.journal.plan_id, new_id)
+        self.assertEqual(len(plan), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gemini_client
+
+LISTING = [
+    "gemini-2.5-pro",
+    "gemini-2.5-flash-preview-05-20",
+    "gemini-2.5-flash",
+    "gemini-2.5-flash-preview-tts",
+    "gemini-2.0-flash-exp",
+    "gemini-2.0-flash",
+    "gemini-2.0-flash-lite",
+    "gemini-flash-latest",
+]
+
+
+class CandidateModelsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self._tmp.name, "gemini_state.json")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def client(self, preferred=gemini_client.DEFAULT_MODEL, names=LISTING):
+        client = gemini_client.GeminiClient("key", preferred=preferred, state_file=self.state_file)
+        client.set_models(names)
+        return client
+
+    def test_preferred_then_limited_stable_flash(self):
+        self.assertEqual(self.client().candidate_models(),
+                         ["gemini-flash-latest", "gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.0-flash-lite"])
+
+    def test_preferred_missing_from_listing_is_dropped(self):
+        candidates = self.client(preferred="gemini-1.5-flash").candidate_models()
+        self.assertNotIn("gemini-1.5-flash", candidates)
+        self.assertEqual(len(candidates), gemini_client.MAX_FALLBACK_MODELS)
+
+    def test_non_flash_and_special_variants_are_never_tried(self):
+        candidates = self.client().candidate_models()
+        self.assertNotIn("gemini-2.5-pro", candidates)
+        self.assertNotIn("gemini-2.5-flash-preview-tts", candidates)
+
+    def test_without_listing_only_preferred(self):
+        client = gemini_client.GeminiClient("key", state_file=self.state_file)
+        client._state['models']['fetched'] = time.time()
+        self.assertEqual(client.candidate_models(), [gemini_client.DEFAULT_MODEL])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import twse_quotes
+
+# 2024-03-06 是星期三
+TRADING = datetime(2024, 3, 6, 10, 0)
+AFTER_CLOSE = datetime(2024, 3, 6, 14, 0)
+FRIDAY_EVENING = datetime(2024, 3, 8, 18, 0)
+
+
+def expires_after(stock, now):
+    fetched = now.timestamp()
+    return twse_quotes.quote_expires(stock, fetched) - fetched
+
+
+class QuoteExpiresTest(unittest.TestCase):
+    def test_todays_quote_during_trading_is_short_lived(self):
+        self.assertEqual(expires_after({'d': '20240306'}, TRADING), twse_quotes.TRADING_TTL_SECONDS)
+
+    def test_old_dated_quote_during_trading_is_rechecked(self):
+        # 平日盤中拿到前一交易日的報價 (休市或證交所尚未更新)，不能沿用到隔天開盤
+        self.assertEqual(expires_after({'d': '20240305'}, TRADING), twse_quotes.STALE_DATE_TTL_SECONDS)
+
+    def test_after_close_lasts_until_next_open(self):
+        expires = twse_quotes.quote_expires({'d': '20240306'}, AFTER_CLOSE.timestamp())
+        self.assertEqual(datetime.fromtimestamp(expires), datetime(2024, 3, 7, 9, 0))
+
+    def test_weekend_skips_to_monday_open(self):
+        expires = twse_quotes.quote_expires({'d': '20240308'}, FRIDAY_EVENING.timestamp())
+        self.assertEqual(datetime.fromtimestamp(expires), datetime(2024, 3, 11, 9, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import requests
+import urllib3
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "account_book.db")
+API_URL = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
+
+# 保守的網址長度上限 (證交所前端在 2KB 左右開始出錯)
+MAX_URL_LENGTH = 1800
+MAX_WORKERS = 4
+MARKETS = ('tse', 'otc')
+
+# 報價快取：盤中很快就過期，收盤後/休市日可一直用到下個交易日開盤
+TRADING_TTL_SECONDS = 20
+# 盤中拿到的報價日期不是今天 (休市日，或開盤後證交所尚未更新)：隔一段時間再確認一次
+STALE_DATE_TTL_SECONDS = 10 * 60
+MARKET_OPEN = (9, 0)
+# 13:30 收盤，多留幾分鐘給最後一筆撮合
+MARKET_CLOSE = (13, 35)
+
+
+def _channel(code, market):
+    return f"{market}_{code}.tw"
+
+
+def split_batches(channels, base_length=len(API_URL) + 40, limit=MAX_URL_LENGTH):
+    """把頻道清單切成多批，每批組成的網址都不超過 limit"""
+    batches = []
+    current = []
+    length = base_length
+    for ch in channels:
+        # 分隔符號 "|" 網址編碼後為 %7C，佔 3 個字元
+        added = len(ch) + 3
+        if current and length + added > limit:
+            batches.append(current)
+            current = []
+            length = base_length
+        current.append(ch)
+        length += added
+    if current:
+        batches.append(current)
+    return batches
+
+
+class QuoteFetcher:
+    """證交所即時報價 (上市 tse / 上櫃 otc)
+
+    - 每個代號的市場別只判斷一次，結果存在 stock_markets 表
+    - 代號依網址長度分批，多批同時以共用連線查詢後合併
+    """
+
+    def __init__(self, db_path=DB_PATH, max_workers=MAX_WORKERS):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        self.session.verify = False
+        self._lock = threading.Lock()
+        self._markets = None
+
+    # ---------- 市場別快取 ----------
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=20)
+        conn.execute("CREATE TABLE IF NOT EXISTS stock_markets (code TEXT PRIMARY KEY, market TEXT NOT NULL, updated REAL)")
+        return conn
+
+    def markets(self):
+        with self._lock:
+            if self._markets is None:
+                try:
+                    conn = self._connect()
+                    self._markets = dict(conn.execute("SELECT code, market FROM stock_markets"))
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.error(f"市場別快取讀取失敗: {e}")
+                    self._markets = {}
+            return dict(self._markets)
+
+    def _save_markets(self, found):
+        if not found:
+            return
+        with self._lock:
+            self._markets.update(found)
+            try:
+                conn = self._connect()
+                now = time.time()
+                conn.executemany("INSERT OR REPLACE INTO stock_markets (code, market, updated) VALUES (?, ?, ?)",
+                                 [(code, market, now) for code, market in found.items()])
+                conn.commit()
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"市場別快取寫入失敗: {e}")
+        logger.info(f"新判斷市場別 {len(found)} 檔：{found}")
+
+    # ---------- 查詢 ----------
+    def _fetch_batch(self, channels):
+        params = {'ex_ch': "|".join(channels), '_': int(time.time() * 1000)}
+        try:
+            resp = self.session.get(API_URL, params=params, timeout=20)
+            return resp.json().get('msgArray', [])
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"報價查詢失敗 ({len(channels)} 檔): {e}")
+            return []
+
+    def fetch(self, codes):
+        """回傳 {代號: 證交所原始報價 dict}；查不到的代號不會出現在結果中"""
+        codes = list(dict.fromkeys(str(c).strip() for c in codes if str(c).strip()))
+        known = self.markets()
+        channels = []
+        for code in codes:
+            if code in known:
+                channels.append(_channel(code, known[code]))
+            else:
+                # 尚未判斷的代號兩個市場都查，依回傳的 ex 欄位記下市場別
+                channels.extend(_channel(code, m) for m in MARKETS)
+
+        batches = split_batches(channels)
+        quotes = {}
+        found = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches) or 1)) as pool:
+            for rows in pool.map(self._fetch_batch, batches):
+                for stock in rows:
+                    code = stock.get('c')
+                    if not code or code not in codes:
+                        continue
+                    quotes[code] = stock
+                    if code not in known and stock.get('ex') in MARKETS:
+                        found[code] = stock['ex']
+        self._save_markets(found)
+
+        missing = [c for c in codes if c not in quotes]
+        if missing:
+            logger.warning(f"查無報價：{', '.join(missing)}")
+        logger.info(f"報價查詢 {len(codes)} 檔，分 {len(batches)} 批，取得 {len(quotes)} 檔")
+        return quotes
+
+
+# ================= 🗃️ 報價快取 =================
+def is_trading_time(now):
+    return now.weekday() < 5 and MARKET_OPEN <= (now.hour, now.minute) < MARKET_CLOSE
+
+
+def next_open(now):
+    day = now
+    if (now.hour, now.minute) >= MARKET_OPEN:
+        day = now + timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day.replace(hour=MARKET_OPEN[0], minute=MARKET_OPEN[1], second=0, microsecond=0)
+
+
+def quote_expires(stock, fetched):
+    """盤中短暫有效；盤中拿到舊日期的報價最多沿用 10 分鐘；收盤後有效到下個交易日開盤"""
+    now = datetime.fromtimestamp(fetched)
+    if not is_trading_time(now):
+        return next_open(now).timestamp()
+    if stock.get('d', now.strftime('%Y%m%d')) == now.strftime('%Y%m%d'):
+        return fetched + TRADING_TTL_SECONDS
+    # 無法單憑日期分辨是休市還是報價延遲，不能一路信任到下個開盤
+    return fetched + STALE_DATE_TTL_SECONDS
+
+
+class QuoteCache:
+    """以代號為鍵的共用報價快取 (記憶體 + SQLite，cron 與 bot 不同行程也能共用)
+
+    同一代號同時有多個請求時只查詢一次，其他請求等待同一份結果 (single-flight)。
+    """
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+        self._memory = {}       # code -> (expires, stock)
+        self._inflight = {}     # code -> Future
+
+    def _connect(self):
+        conn = self.fetcher._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS stock_quotes (code TEXT PRIMARY KEY, data TEXT, expires REAL)")
+        return conn
+
+    def _load_db(self, codes, now):
+        try:
+            conn = self._connect()
+            marks = ",".join("?" * len(codes))
+            rows = conn.execute(f"SELECT code, data, expires FROM stock_quotes WHERE code IN ({marks}) AND expires > ?",
+                                (*codes, now)).fetchall()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"報價快取讀取失敗: {e}")
+            return {}
+        return {code: (expires, json.loads(data)) for code, data, expires in rows}
+
+    def _save_db(self, entries):
+        try:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO stock_quotes (code, data, expires) VALUES (?, ?, ?)",
+                             [(code, json.dumps(stock, ensure_ascii=False), expires)
+                              for code, (expires, stock) in entries.items()])
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"報價快取寫入失敗: {e}")
+
+    def get(self, codes):
+        """回傳 {代號: 報價}，只有過期且沒人在查的代號才會真的送出查詢"""
+        codes = list(dict.fromkeys(str(c).strip() for c in codes if str(c).strip()))
+        now = time.time()
+        result = {}
+        with self._lock:
+            missing = [c for c in codes if c not in self._memory or self._memory[c][0] <= now]
+        if missing:
+            from_db = self._load_db(missing, now)
+            with self._lock:
+                self._memory.update(from_db)
+
+        to_fetch, waiting = [], {}
+        with self._lock:
+            for code in codes:
+                entry = self._memory.get(code)
+                if entry and entry[0] > now:
+                    result[code] = entry[1]
+                elif code in self._inflight:
+                    waiting[code] = self._inflight[code]
+                else:
+                    to_fetch.append(code)
+                    self._inflight[code] = Future()
+
+        if to_fetch:
+            fetched_at = time.time()
+            quotes = {}
+            entries = {}
+            try:
+                quotes = self.fetcher.fetch(to_fetch)
+                entries = {code: (quote_expires(stock, fetched_at), stock) for code, stock in quotes.items()}
+            except Exception as e:
+                logger.error(f"報價查詢異常: {e}")
+            finally:
+                # 不論成功與否都要喚醒等待同一代號的請求，否則它們會永遠卡住
+                with self._lock:
+                    self._memory.update(entries)
+                    for code in to_fetch:
+                        self._inflight.pop(code).set_result(quotes.get(code))
+            self._save_db(entries)
+            result.update(quotes)
+
+        for code, future in waiting.items():
+            stock = future.result()
+            if stock:
+                result[code] = stock
+
+        hits = len(codes) - len(to_fetch) - len(waiting)
+        if hits or waiting:
+            logger.info(f"報價快取命中 {hits} 檔，共用查詢 {len(waiting)} 檔，實際查詢 {len(to_fetch)} 檔")
+        return result
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_path=DB_PATH):
+    with _caches_lock:
+        cache = _caches.get(db_path)
+        if cache is None:
+            cache = _caches[db_path] = QuoteCache(QuoteFetcher(db_path))
+        return cache
+
+
+def fetch_quotes(codes, db_path=DB_PATH):
+    """經由共用快取取得報價；盤中約 20 秒內、收盤後到下次開盤前都不會重複查詢"""
+    return get_cache(db_path).get(codes)